@@ -1,22 +1,46 @@
+import argparse
 import asyncio
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
 
 from gdrive_helper_code import GDriveHelper
-from audio_transcriber_code import AudioTranscriber
+from job_ledger_code import get_job_ledger
+from transcription_pipeline_code import TranscriptionJob, TranscriptionPipeline
 from workflow_states_code import WorkflowEnum
-from workflow_tracker_code import WorkflowTracker
 from update_status import async_error_handler
 from logger_code import LoggerBase
-from env_settings_code import get_settings
-from pydantic_models import GDriveInput
+from env_settings_code import check_settings, get_settings
+from status_sink_code import TERMINAL_STATUSES
 
-def init_WorkflowTracker_mp3(mp3_gdrive_id):
-    WorkflowTracker.update(
-    transcript_audio_quality= "medium",
-    transcript_compute_type= "float16",
+# Failed jobs, often on transient errors. Retried with a backoff in watcher mode.
+FAILED_STATUSES = frozenset({WorkflowEnum.ERROR.name, WorkflowEnum.TRANSCRIPTION_FAILED.name})
 
-    input_mp3 = GDriveInput(gdrive_id=mp3_gdrive_id)
+async def queue_file(gh: GDriveHelper, pipeline: TranscriptionPipeline, file: dict, delete_after_upload: bool) -> Optional[TranscriptionJob]:
+    """Submits the listed mp3 gfile to the pipeline unless its transcript was already uploaded. Returns the job, if any."""
+    logger = LoggerBase.setup_logger('AudioTranscriber Manager')
+    status_model = gh.status_model_from_listing(file)
+    logger.warning(f"\n---------\n {status_model.model_dump_json(indent=4)}")
+    if status_model.status == WorkflowEnum.TRANSCRIPTION_UPLOAD_COMPLETE.name:
+        if delete_after_upload:
+            await gh.delete_file(file['id'])
+        return None
+    return await pipeline.submit(file['id'])
 
-    )
+async def queue_unfinished_jobs(pipeline: TranscriptionPipeline) -> Dict[str, TranscriptionJob]:
+    """
+    Submits the jobs the job ledger has not seen finish (their last transition is not terminal), so a restart
+    picks up where the last run stopped. Returns the queued jobs by mp3 gfile id.
+    """
+    logger = LoggerBase.setup_logger('AudioTranscriber Manager')
+    job_ledger = get_job_ledger()
+    if job_ledger is None:
+        return {}
+    jobs = {}
+    for transition in await job_ledger.find_unfinished_jobs():
+        logger.info(f"Queuing mp3 gfile {transition.mp3_gfile_id} again. Its last recorded status is {transition.status}.")
+        jobs[transition.mp3_gfile_id] = await pipeline.submit(transition.mp3_gfile_id, resume_from=transition)
+    return jobs
 
 @async_error_handler(error_message = 'Errored attempting to manage mp3 audio file transcription.')
 async def main(delete_after_upload=False):
@@ -27,17 +51,155 @@ async def main(delete_after_upload=False):
     files_to_process = await gh.list_files_to_transcribe(folder_id)
     logger.info(f"Number of Files to process: {len(files_to_process)}")
 
-    for file in files_to_process:
-        gdrive_input = GDriveInput(gdrive_id=file['id'])
-        status_model = await gh.get_status_model(gdrive_input)
-        logger.warning(f"\n---------\n {status_model.model_dump_json(indent=4)}")
-        if status_model.status == WorkflowEnum.TRANSCRIPTION_UPLOAD_COMPLETE.name and delete_after_upload:
-            await gh.delete_file(file['id'])
-        elif status_model.status != WorkflowEnum.TRANSCRIPTION_UPLOAD_COMPLETE.name:
-            # Transcribe mp3
-            transcriber = AudioTranscriber()
-            await transcriber.transcribe()
+    # Downloads, transcription and uploads overlap in the pipeline's stages. The listing already holds each
+    # file's status (in its description), so no file needs another round trip before it is queued.
+    pipeline = TranscriptionPipeline()
+    pipeline.start()
+    try:
+        resumed_jobs = await queue_unfinished_jobs(pipeline)
+        for file in files_to_process:
+            if file['id'] not in resumed_jobs:
+                await queue_file(gh, pipeline, file, delete_after_upload)
+        await pipeline.join()
+    finally:
+        await pipeline.stop()
+
+class WatchedJobs:
+    """
+    The watcher's last job for each mp3 gfile, and whether a file should be submitted again.
+
+    A file whose job is still in the pipeline is not submitted again. One whose transcript was uploaded is only
+    submitted again when its content (md5Checksum) changes. A job that failed (ERROR or TRANSCRIPTION_FAILED),
+    often on a transient network or quota error, is retried after backoff_s, doubled with each failure, up to
+    max_retries times. New content resets the count.
+
+    Attributes:
+        max_retries (int): Retries of a failed file with unchanged content.
+        backoff_s (float): Seconds before the first retry.
+    """
+    def __init__(self, max_retries: int, backoff_s: float, clock: Callable[[], float] = time.monotonic):
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.clock = clock
+        self.jobs: Dict[str, TranscriptionJob] = {}
+        self._files: Dict[str, dict] = {}
+        self._failures: Dict[str, int] = {}
+        self._retry_at: Dict[str, Optional[float]] = {}
+
+    def should_submit(self, file: dict) -> bool:
+        job = self.jobs.get(file['id'])
+        if job is None:
+            return True
+        status = job.workflow_model.status
+        if status not in TERMINAL_STATUSES:
+            return False
+        if self._files[file['id']].get('md5Checksum') != file.get('md5Checksum'):
+            self._failures.pop(file['id'], None)
+            self._retry_at.pop(file['id'], None)
+            return True
+        if status == WorkflowEnum.TRANSCRIPTION_UPLOAD_COMPLETE.name:
+            return False
+        retry_at = self._schedule_retry(file['id'])
+        return retry_at is not None and self.clock() >= retry_at
+
+    def submitted(self, file: dict, job: TranscriptionJob) -> None:
+        self.jobs[file['id']] = job
+        self._files[file['id']] = file
+        self._retry_at.pop(file['id'], None)
+
+    def retries_due(self) -> List[dict]:
+        """The last listing of each failed file whose retry is due. A failed file may never change again, so check every poll."""
+        return [self._files[gdrive_id] for gdrive_id, job in self.jobs.items()
+                if job.workflow_model.status in FAILED_STATUSES and self.should_submit(self._files[gdrive_id])]
+
+    def _schedule_retry(self, gdrive_id: str) -> Optional[float]:
+        # Counts each failed job once, when it is first seen. None once the retries are used up.
+        if gdrive_id not in self._retry_at:
+            failures = self._failures.get(gdrive_id, 0) + 1
+            self._failures[gdrive_id] = failures
+            self._retry_at[gdrive_id] = self.clock() + self.backoff_s * 2 ** (failures - 1) if failures <= self.max_retries else None
+        return self._retry_at[gdrive_id]
+
+def load_changes_token(token_path: Path) -> Optional[str]:
+    if not token_path.exists():
+        return None
+    return token_path.read_text(encoding='utf-8').strip() or None
+
+def save_changes_token(token_path: Path, page_token: str) -> None:
+    # Write then rename, so a crash never leaves half a token behind.
+    temp_path = token_path.with_suffix(token_path.suffix + '.tmp')
+    temp_path.write_text(page_token, encoding='utf-8')
+    temp_path.replace(token_path)
+
+@async_error_handler(error_message = 'Errored watching the mp3 folder for changes.')
+async def watch(delete_after_upload=False, poll_interval_s: Optional[float] = None):
+    """
+    Transcribes mp3 files as they are added to the folder, until cancelled.
+
+    The Drive changes page token is saved in changes_token_path. On startup the jobs the job ledger has not
+    seen finish are queued again and the whole folder is scanned once, as main() does, even with a saved
+    token: the token moves on when a file is submitted, not when its job finishes, so the files whose jobs
+    were in the pipeline when the last run stopped would otherwise be lost. Their status is not terminal, so
+    the scan queues them again. After that each poll only fetches the files that changed since the last one,
+    so polling every few seconds costs O(changes) rather than O(folder size).
+
+    Our own status writes also show up as changes. A file is not queued again while its job is in the
+    pipeline, and once its transcript is uploaded only when its content (md5Checksum) changed. Failed jobs
+    are retried with a backoff, see WatchedJobs.
+    """
+    logger = LoggerBase.setup_logger('AudioTranscriber Watcher')
+    gh = GDriveHelper()
+    settings = get_settings()
+    folder_id = settings.gdrive_mp3_folder_id
+    poll_interval_s = poll_interval_s if poll_interval_s else settings.watch_poll_interval_s
+    token_path = Path(settings.changes_token_path)
+    watched = WatchedJobs(settings.watch_max_retries, settings.watch_retry_backoff_s)
+
+    async def _queue(file: dict) -> None:
+        if not watched.should_submit(file):
+            return
+        job = await queue_file(gh, pipeline, file, delete_after_upload)
+        if job:
+            watched.submitted(file, job)
 
+    pipeline = TranscriptionPipeline()
+    pipeline.start()
+    try:
+        page_token = load_changes_token(token_path)
+        if page_token is None:
+            # Take the token before the scan so nothing that changes during the scan is missed.
+            page_token = await gh.get_changes_start_token()
+        resumed_jobs = await queue_unfinished_jobs(pipeline)
+        files_to_process = await gh.list_files_to_transcribe(folder_id)
+        logger.info(f"Scanned the folder: {len(files_to_process)} files. {len(resumed_jobs)} unfinished jobs queued again.")
+        for file in files_to_process:
+            if file['id'] in resumed_jobs:
+                watched.submitted(file, resumed_jobs[file['id']])
+            else:
+                await _queue(file)
+        save_changes_token(token_path, page_token)
+        while True:
+            changed_files, page_token = await gh.list_changed_files(folder_id, page_token)
+            if changed_files:
+                logger.debug(f"{len(changed_files)} files changed since the last poll.")
+            for file in changed_files:
+                await _queue(file)
+            for file in watched.retries_due():
+                logger.debug(f"Retrying mp3 gfile {file['id']}, which failed before.")
+                await _queue(file)
+            save_changes_token(token_path, page_token)
+            await asyncio.sleep(poll_interval_s)
+    finally:
+        await pipeline.stop()
 
 if __name__ == "__main__":
-    asyncio.run(main(delete_after_upload=False))
+    parser = argparse.ArgumentParser(description="Transcribe the mp3 files in the GDrive mp3 folder.")
+    parser.add_argument('--watch', action='store_true', help="Keep polling the folder for new files.")
+    parser.add_argument('--delete-after-upload', action='store_true')
+    args = parser.parse_args()
+    # Stops here, before any job starts, if the settings are not valid.
+    LoggerBase.configure(check_settings())
+    if args.watch:
+        asyncio.run(watch(delete_after_upload=args.delete_after_upload))
+    else:
+        asyncio.run(main(delete_after_upload=args.delete_after_upload))
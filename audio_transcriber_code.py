@@ -32,24 +32,31 @@
 # SOFTWARE.
 ###########################################################################################
 import asyncio
+import hashlib
 from pathlib import Path
-from typing import Tuple
+from typing import AsyncIterator, Optional, Tuple
 
 import aiofiles
 from fastapi import UploadFile
-import torch
-from transformers import pipeline
 
 from env_settings_code import get_settings
 from gdrive_helper_code import GDriveHelper
 from logger_code import LoggerBase
+from model_cache_code import default_device, get_model_cache, resolve_compute_type
 from pydantic_models import (
                              GDriveInput,
                              validate_upload_file)
 from workflow_states_code import WorkflowEnum
-from workflow_tracker_code import WorkflowTracker, WorkflowTrackerModel, AUDIO_QUALITY_MAP, COMPUTE_TYPE_MAP
+from workflow_tracker_code import WorkflowTracker, ASSISTANT_MODEL_MAP, AUDIO_QUALITY_MAP, COMPUTE_TYPE_MAP
+from job_ledger_code import JobTransition, get_job_ledger
+from resumable_upload_code import TeeReader
+from transcript_cache_code import TranscriptCache, hash_file, options_digest
+from streaming_decode_code import (ByteChunkQueue, counted_byte_chunks, file_byte_chunks, iter_transcribed_windows,
+                                   probe_duration_seconds, transcribe_byte_stream)
 from update_status import update_status
-from workflow_error_code import async_error_handler
+from vad_code import transcribe_with_pipeline, vad_options
+from worker_pool_code import get_worker_pool
+from workflow_error_code import async_error_handler, handle_error
 
 class AudioTranscriber:
     """
@@ -73,6 +80,7 @@ class AudioTranscriber:
         self.logger = LoggerBase.setup_logger("AudioTranscriber")
         self.gh = GDriveHelper()
         self.workflow_tracker = WorkflowTracker
+        self.transcript_cache = TranscriptCache(self.settings.transcript_cache_path) if self.settings.transcript_cache_enabled else None
 
     @async_error_handler()
     async def transcribe(self) -> str:
@@ -102,11 +110,221 @@ class AudioTranscriber:
         - This method is designed to be called asynchronously within an asyncio event loop to efficiently manage I/O
         operations and long-running tasks without blocking the execution of other coroutines.
     """
+        if self.settings.streaming_decode:
+            transcription_text = await self.transcribe_streaming()
+        else:
+            await self.prepare_mp3()
+            transcription_text = await self.lookup_cached_transcript()
+            if transcription_text is None:
+                transcription_text = await self.transcribe_mp3()
+                await self.cache_transcript(transcription_text)
+        await self.upload_transcript(transcription_text)
+        return transcription_text
+
+    @async_error_handler()
+    async def lookup_cached_transcript(self) -> Optional[str]:
+        """
+        Looks for a transcript of the same audio made with the same model, compute type and VAD options.
+
+        The local mp3 is hashed (unless the workflow already has its audio_sha256) and the hash is looked up
+        in the transcript cache. Call after prepare_mp3.
+
+        Returns:
+            Optional[str]: The cached transcript, or None if there is none or the cache is turned off.
+        """
+        if not self.transcript_cache:
+            return None
+        audio_sha256 = WorkflowTracker.get('audio_sha256')
+        if not audio_sha256:
+            loop = asyncio.get_running_loop()
+            audio_sha256 = await loop.run_in_executor(None, hash_file, WorkflowTracker.get('local_mp3_path'))
+            WorkflowTracker.update(audio_sha256=audio_sha256)
+        hf_model_name, compute_type = self.resolve_model_and_compute_type()
+        transcription_text = await self.transcript_cache.lookup(audio_sha256, hf_model_name, compute_type, self.transcript_options())
+        if transcription_text is not None:
+            WorkflowTracker.update(comment='The same audio was transcribed before. Using the cached transcript.')
+            await self.gh.log_status()
+        return transcription_text
+
+    @async_error_handler()
+    async def resume_transcript(self, transition: JobTransition) -> Optional[str]:
+        """
+        The transcript of a job that had finished transcribing (TRANSCRIPTION_COMPLETE) before a restart, taken
+        from the transcript cache, so the job can go straight to the upload. None when the job had not got that
+        far, the transcript is not cached or the mp3 changed on Drive since.
+        """
+        if transition.status != WorkflowEnum.TRANSCRIPTION_COMPLETE.name or not transition.audio_sha256 or not self.transcript_cache:
+            return None
+        if transition.mp3_md5_checksum != await self.gh.get_md5_checksum(GDriveInput(gdrive_id=transition.mp3_gfile_id)):
+            return None
+        WorkflowTracker.update(
+        mp3_gfile_id=transition.mp3_gfile_id,
+        audio_sha256=transition.audio_sha256,
+        mp3_md5_checksum=transition.mp3_md5_checksum
+        )
+        return await self.lookup_cached_transcript()
+
+    @async_error_handler()
+    async def cache_transcript(self, transcription_text: str) -> None:
+        """Stores the transcript in the transcript cache under the workflow's audio_sha256."""
+        audio_sha256 = WorkflowTracker.get('audio_sha256')
+        if not self.transcript_cache or not audio_sha256:
+            return
+        hf_model_name, compute_type = self.resolve_model_and_compute_type()
+        await self.transcript_cache.store(audio_sha256, hf_model_name, compute_type, transcription_text, self.transcript_options())
+
+    def transcript_options(self) -> str:
+        """
+        The digest of the VAD options that the transcript cache key includes. The VAD cuts out silence and
+        re-batches the speech, which changes the text. With the VAD off its other options do not matter.
+        The assistant model is not part of the key: speculative decoding gives the main model's transcript.
+        """
+        options = vad_options(self.settings)
+        if not options['use_vad']:
+            options = {'use_vad': False}
+        return options_digest(options)
+
+    @async_error_handler()
+    async def transcribe_streaming(self) -> str:
+        """
+        Transcribes the mp3 while its bytes are still arriving, without reading a local mp3 file.
+
+        For a GDrive input the mp3 is never written to local_mp3_dir: the download stream goes straight to
+        the decoder, and the status records how much of it was streamed. An uploaded mp3 still has to be
+        copied to GDrive to get the gfile that holds the workflow status. The decoder gets the bytes that
+        upload reads (through a TeeReader), so the upload is read once and no local copy is written.
+        Inference runs in this process, even when a worker pool is configured.
+
+        Returns:
+            str: The transcribed text.
+        """
+        input_mp3 = WorkflowTracker.get('input_mp3')
+        hf_model_name, compute_type = self.resolve_model_and_compute_type()
+        assistant_model_name = self.resolve_assistant_model()
+        batch_size = self.settings.transcription_batch_size
+        def _transcribe_stream(byte_chunks):
+            pipe = get_model_cache().get_pipeline(hf_model_name, compute_type, assistant_model_name=assistant_model_name)
+            return transcribe_byte_stream(pipe, byte_chunks, batch_size)
+        if isinstance(input_mp3, GDriveInput):
+            transcription_text = await self._transcribe_gdrive_stream(input_mp3, _transcribe_stream, hf_model_name)
+        else:
+            transcription_text = await self._transcribe_upload_stream(input_mp3, _transcribe_stream, hf_model_name)
+        await update_status()
+        return transcription_text
+
+    async def _transcribe_gdrive_stream(self, gdrive_input: GDriveInput, transcribe_stream, hf_model_name: str) -> str:
+        WorkflowTracker.update(
+        status=WorkflowEnum.START.name,
+        comment= "Starting the streaming transcription workflow.",
+        mp3_gfile_id = gdrive_input.gdrive_id
+        )
+        await self.gh.log_status()
+        byte_chunks = await self.gh.open_gdrive_stream(gdrive_input, chunksize=self.settings.stream_chunk_mb * 1024 * 1024)
+        loop = asyncio.get_running_loop()
+        # The chunks are downloaded in the executor thread. The tracker lives in this task's context, so the
+        # progress comes back here through a queue.
+        progress_queue: asyncio.Queue = asyncio.Queue()
+        def _on_chunk(bytes_read: int):
+            loop.call_soon_threadsafe(progress_queue.put_nowait, bytes_read)
+        transcription = asyncio.ensure_future(loop.run_in_executor(None, transcribe_stream, counted_byte_chunks(byte_chunks, _on_chunk)))
+        streaming = False
+        while True:
+            next_progress = asyncio.ensure_future(progress_queue.get())
+            done, _ = await asyncio.wait({transcription, next_progress}, return_when=asyncio.FIRST_COMPLETED)
+            if next_progress not in done:
+                next_progress.cancel()
+                break
+            # Only the latest count matters when several chunks arrived since the last report.
+            bytes_read = next_progress.result()
+            while not progress_queue.empty():
+                bytes_read = progress_queue.get_nowait()
+            if not streaming:
+                # The first chunk arrived.
+                streaming = True
+                WorkflowTracker.update(
+                status=WorkflowEnum.TRANSCRIBING.name,
+                comment= f'Streaming the mp3 from GDrive into the whisper {hf_model_name} model.',
+                )
+                await update_status()
+            else:
+                WorkflowTracker.update(comment=f'Streamed {bytes_read / 1e6:.1f} MB of the mp3 into the whisper {hf_model_name} model.')
+            await self.gh.log_status()
+            if transcription in done:
+                break
+        return await transcription
+
+    async def _transcribe_upload_stream(self, upload_file: UploadFile, transcribe_stream, hf_model_name: str) -> str:
+        await validate_upload_file(upload_file)
+        WorkflowTracker.update(
+        status=WorkflowEnum.START.name,
+        comment= "Starting the streaming transcription workflow.",
+        )
+        await self.gh.log_status()
+        loop = asyncio.get_running_loop()
+        decoder_chunks = ByteChunkQueue()
+        audio_digest = hashlib.sha256()
+        upload_file.file.seek(0)
+        tee = TeeReader(upload_file.file, decoder_chunks, audio_digest)
+        transcription = asyncio.ensure_future(loop.run_in_executor(None, transcribe_stream, decoder_chunks))
+        try:
+            mp3_gfile_id = await self.gh.upload_mp3_to_gdrive(Path(upload_file.filename), source=tee)
+            await loop.run_in_executor(None, tee.copy_rest)
+        except BaseException as e:
+            # Stops the decoder. Its error is the upload's.
+            decoder_chunks.close(e)
+            await asyncio.gather(transcription, return_exceptions=True)
+            raise
+        decoder_chunks.close()
+        WorkflowTracker.update(
+        status=WorkflowEnum.MP3_UPLOADED.name,
+        comment= "The mp3 is on GDrive.",
+        mp3_gfile_id=mp3_gfile_id,
+        audio_sha256=audio_digest.hexdigest()
+        )
+        await self.gh.log_status()
+        WorkflowTracker.update(
+        status=WorkflowEnum.TRANSCRIBING.name,
+        comment= f'Streaming the audio into the whisper {hf_model_name} model.',
+        )
+        await self.gh.log_status()
+        await update_status()
+        return await transcription
+
+    @async_error_handler()
+    async def prepare_mp3(self) -> Path:
+        """
+        The first stage of the workflow. Makes a local copy of the mp3 (uploaded or on GDrive) and moves the
+        workflow to MP3_DOWNLOADED.
+
+        The stages (prepare_mp3, transcribe_mp3, upload_transcript) are separate methods so a runner that works
+        on many files at once can interleave them, for example batching the transcription of several files.
+
+        Returns:
+        - Path: The path to the local copy of the MP3 file.
+        """
         gfile_id = None
         input_mp3 = WorkflowTracker.get('input_mp3')
         if isinstance(input_mp3, GDriveInput):
             gfile_id = input_mp3.gdrive_id
         mp3_gfile_id = gfile_id if gfile_id else None
+        job_ledger = get_job_ledger()
+        if job_ledger and mp3_gfile_id:
+            resumed = await job_ledger.find_resumable_download(mp3_gfile_id)
+            # The mp3 may have been replaced on Drive since it was downloaded.
+            if resumed and resumed.mp3_md5_checksum != await self.gh.get_md5_checksum(input_mp3):
+                self.logger.debug(f"The mp3 gfile {mp3_gfile_id} changed on Drive since it was downloaded. Downloading it again.")
+                resumed = None
+            if resumed:
+                WorkflowTracker.update(
+                status=WorkflowEnum.MP3_DOWNLOADED.name,
+                comment="Resumed from the job ledger. The mp3 downloaded before the restart is unchanged.",
+                mp3_gfile_id=mp3_gfile_id,
+                local_mp3_path=Path(resumed.local_mp3_path),
+                audio_sha256=resumed.audio_sha256,
+                mp3_md5_checksum=resumed.mp3_md5_checksum
+                )
+                await self.gh.log_status()
+                return Path(resumed.local_mp3_path)
         WorkflowTracker.update(
         status=WorkflowEnum.START.name,
         comment= "Starting the transcription workflow.",
@@ -115,15 +333,35 @@ class AudioTranscriber:
         await self.gh.log_status()
         # First load the mp3 file (either a GDrive file or uploaded) into a local temporary file
         mp3_gfile_id, local_mp3_path = await self.create_local_mp3_from_input()
+        # An UploadFile is hashed while it is copied. A downloaded mp3 still has to be read once more.
+        audio_sha256 = WorkflowTracker.get('audio_sha256')
+        if job_ledger and not audio_sha256:
+            # Recorded with MP3_DOWNLOADED so a restart can check the file. The transcript cache reuses it.
+            loop = asyncio.get_running_loop()
+            audio_sha256 = await loop.run_in_executor(None, hash_file, local_mp3_path)
         WorkflowTracker.update(
         status=WorkflowEnum.MP3_DOWNLOADED.name,
         comment="mp3 file is ready for transcription.",
         mp3_gfile_id=mp3_gfile_id,
-        local_mp3_path=local_mp3_path
+        local_mp3_path=local_mp3_path,
+        audio_sha256=audio_sha256
         )
         await self.gh.log_status()
         await update_status()
-        transcription_text = await self.transcribe_mp3()
+        return local_mp3_path
+
+    @async_error_handler()
+    async def upload_transcript(self, transcription_text: str) -> str:
+        """
+        The last stage of the workflow. Marks the transcription complete and uploads the transcript to the
+        GDrive transcript folder.
+
+        Args:
+            transcription_text (str): The transcript returned by the transcription stage.
+
+        Returns:
+            str: The gfile id of the uploaded transcript.
+        """
         WorkflowTracker.update(
             status=WorkflowEnum.TRANSCRIPTION_COMPLETE.name,
             comment= f'Success! First 50 chars: {transcription_text[:50]}',
@@ -140,7 +378,7 @@ class AudioTranscriber:
         )
 
         await self.gh.log_status()
-        return transcription_text
+        return transcript_gfile_id
 
     @async_error_handler()
 
@@ -212,10 +450,15 @@ class AudioTranscriber:
         local_mp3_dir_path = self._make_sure_dir_exists(self.settings.local_mp3_dir)
         local_mp3_file_path = Path(local_mp3_dir_path) / upload_file.filename
         upload_file.file.seek(0)  # Rewind to the start of the file.
-        async with aiofiles.open(str(local_mp3_file_path), "wb") as temp_file:
-            content = await upload_file.read()
-            await temp_file.write(content)
-        mp3_gfile_id = await self.gh.upload_mp3_to_gdrive(local_mp3_file_path)
+        # One pass over the upload: the GDrive upload reads it in chunks through the tee, which writes each
+        # chunk to the local file and hashes it. The whole file is never in memory.
+        audio_digest = hashlib.sha256()
+        with open(local_mp3_file_path, "wb") as local_mp3_file:
+            tee = TeeReader(upload_file.file, local_mp3_file, audio_digest)
+            mp3_gfile_id = await self.gh.upload_mp3_to_gdrive(local_mp3_file_path, source=tee)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, tee.copy_rest)
+        WorkflowTracker.update(audio_sha256=audio_digest.hexdigest())
         return mp3_gfile_id, local_mp3_file_path
 
 
@@ -267,8 +510,10 @@ class AudioTranscriber:
         """
         # TODO: Start from this entry and not just transcribe?
 
-        WorkflowTrackerModel.status = WorkflowEnum.TRANSCRIPTION_STARTING.name
-        WorkflowTrackerModel.comment ='At beginning of transcribe_mp3'
+        WorkflowTracker.update(
+            status=WorkflowEnum.TRANSCRIPTION_STARTING.name,
+            comment='At beginning of transcribe_mp3'
+        )
         await self.gh.log_status()
 
         # Proceed with transcription using the validated options
@@ -296,17 +541,9 @@ class AudioTranscriber:
         Insight:
         Central to the transcription workflow, this method directly interacts with the transcription model, reflecting the process's start, ongoing status, and completion in the workflow tracker. The choice of model and compute type allows for customizable transcription fidelity and performance.
         """
-        audio_quality_setting = self.settings.audio_quality_default
-        compute_type_setting = self.settings.compute_type_default
-        default_audio_model = AUDIO_QUALITY_MAP.get(audio_quality_setting)
-        default_compute_type = COMPUTE_TYPE_MAP.get(compute_type_setting)
-        self.logger.debug(f"Default audio quality: {default_audio_model} and default compute type: {default_compute_type}")
-        audio_quality_text_representation = WorkflowTracker.get('transcript_audio_quality')
-        compute_type_text_representation = WorkflowTracker.get('transcript_compute_type')
-        hf_model_name = AUDIO_QUALITY_MAP.get(audio_quality_text_representation,default_audio_quality)
-        compute_type_pytorch = COMPUTE_TYPE_MAP.get(compute_type_text_representation, default_compute_type)
+        hf_model_name, compute_type = self.resolve_model_and_compute_type()
 
-        self.logger.debug(f"Starting transcription with model: {hf_model_name} and compute type: {compute_type_pytorch}")
+        self.logger.debug(f"Starting transcription with model: {hf_model_name} and compute type: {compute_type}")
         WorkflowTracker.update(
         status=WorkflowEnum.TRANSCRIBING.name,
         comment= f'Start by loading the whisper {hf_model_name} model.',
@@ -316,13 +553,107 @@ class AudioTranscriber:
         transcription_text = ""
         audio_file_path = WorkflowTracker.get('local_mp3_path')
         audio_file_path_str = str(audio_file_path) # Pathname to filename.
-        transcription_text = await self._transcribe_pipeline(audio_file_path_str, hf_model_name, compute_type_pytorch)
+        transcription_text = await self._transcribe_pipeline(audio_file_path_str, hf_model_name, compute_type, self.resolve_assistant_model())
 
         await update_status()
         return transcription_text
 
+    def resolve_model_and_compute_type(self) -> Tuple[str, str]:
+        """
+        Maps the workflow's transcript_audio_quality and transcript_compute_type to the Hugging Face model name
+        and compute type, falling back to the defaults in the settings. The compute type is then resolved to the
+        fastest precision the device supports (float16 runs as float32 on the CPU) and the result is recorded
+        in the tracker's transcript_precision. It stays a string. The model cache turns it into a torch dtype.
+
+        Returns:
+            Tuple[str, str]: The Hugging Face model name and the compute type, e.g. "float32".
+        """
+        audio_quality_setting = self.settings.audio_quality_default
+        compute_type_setting = self.settings.compute_type_default
+        default_audio_model = AUDIO_QUALITY_MAP.get(audio_quality_setting)
+        default_compute_type = COMPUTE_TYPE_MAP.get(compute_type_setting)
+        self.logger.debug(f"Default audio quality: {default_audio_model} and default compute type: {default_compute_type}")
+        audio_quality_text_representation = WorkflowTracker.get('transcript_audio_quality')
+        compute_type_text_representation = WorkflowTracker.get('transcript_compute_type')
+        hf_model_name = AUDIO_QUALITY_MAP.get(audio_quality_text_representation, default_audio_model)
+        compute_type = COMPUTE_TYPE_MAP.get(compute_type_text_representation, default_compute_type)
+        compute_type = resolve_compute_type(compute_type, default_device())
+        WorkflowTracker.update(transcript_precision=compute_type)
+        return hf_model_name, compute_type
+
+    def resolve_assistant_model(self) -> Optional[str]:
+        """The speculative decoding assistant (ASSISTANT_MODEL_MAP) of the workflow's audio quality, or None for plain decoding."""
+        audio_quality = WorkflowTracker.get('transcript_audio_quality')
+        if audio_quality not in AUDIO_QUALITY_MAP:
+            audio_quality = self.settings.audio_quality_default
+        return ASSISTANT_MODEL_MAP.get(audio_quality)
+
+    async def transcribe_stream(self) -> AsyncIterator[dict]:
+        """
+        Transcribes the local mp3 (see prepare_mp3) chunk by chunk, yielding each chunk as soon as it is done.
+
+        A long recording shows results within seconds instead of after the whole file is transcribed. After
+        each chunk the tracker comment is updated with the progress and the text so far is flushed to the
+        local transcript file (the file upload_transcript_to_gdrive later writes the full transcript to).
+
+        Yields:
+            dict: 'text' of the chunk, its 'timestamp' (start, end) in seconds, the pipeline's timestamped
+            'chunks' and 'progress', the percent of the audio transcribed so far (None if the duration is unknown).
+        """
+        audio_file_path = Path(WorkflowTracker.get('local_mp3_path'))
+        hf_model_name, compute_type = self.resolve_model_and_compute_type()
+        assistant_model_name = self.resolve_assistant_model()
+        transcript_dir_path = self._make_sure_dir_exists(self.settings.local_transcript_dir)
+        transcript_file_path = transcript_dir_path / (audio_file_path.stem + '.txt')
+        loop = asyncio.get_running_loop()
+        total_seconds = await loop.run_in_executor(None, probe_duration_seconds, str(audio_file_path))
+
+        WorkflowTracker.update(
+        status=WorkflowEnum.TRANSCRIBING.name,
+        comment= f'Start streaming the transcript with the whisper {hf_model_name} model.',
+        )
+        await self.gh.log_status()
+
+        def _start_windows():
+            pipe = get_model_cache().get_pipeline(hf_model_name, compute_type, assistant_model_name=assistant_model_name)
+            return iter_transcribed_windows(pipe, file_byte_chunks(str(audio_file_path)))
+        def _next_window(window_iterator):
+            # StopIteration cannot be raised into a future, so the end of the windows is None.
+            return next(window_iterator, None)
+
+        window_iterator = None
+        try:
+            window_iterator = await loop.run_in_executor(None, _start_windows)
+            async with aiofiles.open(str(transcript_file_path), "w") as transcript_file:
+                while True:
+                    result = await loop.run_in_executor(None, _next_window, window_iterator)
+                    if result is None:
+                        break
+                    end_seconds = result['timestamp'][1]
+                    progress = min(100.0, 100 * end_seconds / total_seconds) if total_seconds else None
+                    result['progress'] = progress
+                    if result['text']:
+                        await transcript_file.write(result['text'] + " ")
+                        await transcript_file.flush()
+                    progress_text = f"{progress:.0f}%" if progress is not None else f"{end_seconds:.0f} seconds"
+                    WorkflowTracker.update(comment=f'Transcribed {progress_text} of {audio_file_path.name}.')
+                    await self.gh.log_status()
+                    yield result
+        except Exception as e: # pylint: disable=broad-exception-caught
+            await handle_error(error_message=str(e), operation='transcribe_stream')
+        finally:
+            if window_iterator is not None:
+                # Stops the decoder if the caller stopped reading before the end.
+                try:
+                    await loop.run_in_executor(None, window_iterator.close)
+                except ValueError:
+                    # Still running a window in the executor (the caller was cancelled). It stops after that window.
+                    pass
+            await self.gh.flush_status()
+
     @async_error_handler()
-    async def _transcribe_pipeline(self, audio_filename: str, model_name: str, compute_float_type: torch.dtype) -> str:
+    async def _transcribe_pipeline(self, audio_filename: str, model_name: str, compute_float_type: str,
+                                   assistant_model_name: Optional[str] = None) -> str:
         """
         Transcribes an audio file to text using a Hugging Face ASR model, considering model specifics and compute optimization.
 
@@ -331,23 +662,30 @@ class AudioTranscriber:
         Args:
             audio_filename (str): The path to the audio file to be transcribed.
             model_name (str): Identifier for the Hugging Face ASR model to use.
-            compute_float_type (torch.dtype): The data type for computation, indicating precision and possibly affecting performance.
+            compute_float_type (str): The data type for computation, one of the values in COMPUTE_TYPE_MAP, indicating precision and possibly affecting performance.
+            assistant_model_name (str, optional): The speculative decoding assistant model, one of the values in ASSISTANT_MODEL_MAP.
 
         Returns:
             str: The transcribed text from the audio file.
 
         Insight:
         It's wrapped with an async error handler to gracefully handle failures, marking the transcription phase as failed in such events. The method encapsulates model loading and execution within a synchronous function, offloading it to an executor to maintain async workflow integrity.
+        The pipeline comes from the process-wide model cache, so the model is only loaded the first time a (model, compute type, device) combination is used.
+        When `transcription_workers` is set, the work is sent to the worker process pool instead and the workers' status messages are written to the tracker comment.
         """
-        self.logger.debug("Transcribe using HF's Transformer pipeline (_transcribe_pipeline)...LOADING MODEL")
+        worker_pool = get_worker_pool()
+        if worker_pool:
+            async def _on_worker_status(message: str):
+                WorkflowTracker.update(comment=message)
+                await self.gh.log_status()
+            transcripts = await worker_pool.transcribe_files([audio_filename], model_name, compute_float_type, on_status=_on_worker_status,
+                                                             assistant_model_name=assistant_model_name)
+            return transcripts[0]
+        self.logger.debug("Transcribe using HF's Transformer pipeline (_transcribe_pipeline)...GETTING MODEL")
         def load_and_run_pipeline():
-            pipe = pipeline(
-                "automatic-speech-recognition",
-                model=model_name,
-                device=0 if torch.cuda.is_available() else -1,
-                torch_dtype=compute_float_type
-            )
-            return pipe(audio_filename, chunk_length_s=30, batch_size=8, return_timestamps=False)
+            pipe = get_model_cache().get_pipeline(model_name, compute_float_type, assistant_model_name=assistant_model_name)
+            results = transcribe_with_pipeline(pipe, [audio_filename], self.settings.transcription_batch_size, **vad_options(self.settings))
+            return results[0]
         loop = asyncio.get_running_loop()
         # Run the blocking operation in an executor
         result = await loop.run_in_executor(None, load_and_run_pipeline)
@@ -0,0 +1,116 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-04
+# Summary: batch_transcriber_code transcribes several mp3 files in one pass through a
+# shared ASR pipeline. The Hugging Face pipeline splits every file into 30 second chunks.
+# When it is given a list of files, the chunks of all the files are pooled and run through
+# the model in full batches. The results are then regrouped per file, in the order the
+# files were given. Short recordings no longer leave most of a batch empty.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from env_settings_code import get_settings
+from logger_code import LoggerBase
+from model_cache_code import get_model_cache
+from vad_code import transcribe_with_pipeline, vad_options
+from worker_pool_code import get_worker_pool
+from workflow_error_code import async_error_handler
+
+# (audio filename, Hugging Face model name, compute type, assistant model name or None)
+TranscriptionRequest = Tuple[str, str, object, Optional[str]]
+
+class BatchTranscriber:
+    """
+    Runs the chunks of several audio files through one shared pipeline in full batches.
+
+    Attributes:
+        batch_size (int): The number of 30 second chunks sent through the model at once.
+    """
+    def __init__(self, batch_size: Optional[int] = None):
+        self.settings = get_settings()
+        self.batch_size = batch_size if batch_size else self.settings.transcription_batch_size
+        self.logger = LoggerBase.setup_logger('BatchTranscriber')
+
+    @async_error_handler()
+    async def transcribe_files(self, audio_filenames: List[str], model_name: str, compute_float_type,
+                               assistant_model_name: Optional[str] = None) -> List[str]:
+        """
+        Transcribes the audio files with the same model and compute type.
+
+        Args:
+            audio_filenames (List[str]): Paths to the audio files.
+            model_name (str): Hugging Face model id, one of the values in AUDIO_QUALITY_MAP.
+            compute_float_type (str): One of the values in COMPUTE_TYPE_MAP.
+            assistant_model_name (str, optional): The speculative decoding assistant, one of the values in ASSISTANT_MODEL_MAP.
+
+        Returns:
+            List[str]: The transcript of each file, in the same order as `audio_filenames`.
+        """
+        if not audio_filenames:
+            return []
+        worker_pool = get_worker_pool()
+        if worker_pool:
+            return await worker_pool.transcribe_files(audio_filenames, model_name, compute_float_type,
+                                                      assistant_model_name=assistant_model_name)
+        def _run_pipeline():
+            pipe = get_model_cache().get_pipeline(model_name, compute_float_type, assistant_model_name=assistant_model_name)
+            # Given a list, the pipeline streams the chunks of every file into shared batches and
+            # packs the outputs back into one result per file, in input order.
+            results = transcribe_with_pipeline(pipe, audio_filenames, self.batch_size, **vad_options(self.settings))
+            return [result['text'] for result in results]
+        self.logger.debug(f"Transcribing {len(audio_filenames)} files together with {model_name} in batches of {self.batch_size} chunks.")
+        loop = asyncio.get_running_loop()
+        transcripts = await loop.run_in_executor(None, _run_pipeline)
+        return transcripts
+
+    @async_error_handler()
+    async def transcribe_requests(self, requests: List[TranscriptionRequest]) -> List[str]:
+        """
+        Transcribes requests that may use different models or compute types. Requests sharing a model, compute
+        type and assistant model are batched together, and the transcripts are scattered back to the position of
+        their request.
+
+        Args:
+            requests (List[TranscriptionRequest]): (audio filename, model name, compute type, assistant model name) tuples.
+
+        Returns:
+            List[str]: The transcript of each request, in the same order as `requests`.
+        """
+        groups: Dict[Tuple[str, object, Optional[str]], List[int]] = {}
+        for index, (_, model_name, compute_float_type, assistant_model_name) in enumerate(requests):
+            groups.setdefault((model_name, compute_float_type, assistant_model_name), []).append(index)
+
+        # The groups run concurrently, so with a worker pool each group can go to a different worker.
+        group_transcripts = await asyncio.gather(*(
+            self.transcribe_files([requests[index][0] for index in indices], model_name, compute_float_type, assistant_model_name)
+            for (model_name, compute_float_type, assistant_model_name), indices in groups.items()
+        ))
+        transcripts: List[Optional[str]] = [None] * len(requests)
+        for indices, texts in zip(groups.values(), group_transcripts):
+            for index, transcript in zip(indices, texts):
+                transcripts[index] = transcript
+        return transcripts
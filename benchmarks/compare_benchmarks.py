@@ -0,0 +1,89 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-20
+# Summary: compare_benchmarks compares two run_benchmarks result files, usually the base commit
+# and a candidate. It prints the change in the median time of every stage both files have
+# and exits with status 1 when any of them got slower by more than the threshold, so it
+# can gate a rollout.
+# 
+#     python -m benchmarks.compare_benchmarks base.json candidate.json --threshold 0.10
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ResultKey = Tuple[str, Optional[str], Optional[str], Optional[float]]
+
+def result_key(result: dict) -> ResultKey:
+    return (result["stage"], result.get("quality"), result.get("compute_type"), result.get("audio_seconds"))
+
+def load_results(results_path: Path) -> Dict[ResultKey, dict]:
+    with open(results_path, encoding='utf-8') as results_file:
+        return {result_key(result): result for result in json.load(results_file)["results"]}
+
+def compare(base: Dict[ResultKey, dict], candidate: Dict[ResultKey, dict], threshold: float) -> List[dict]:
+    """The relative change of the median time for every result in both files. Slower than `threshold` is a regression."""
+    comparisons = []
+    for key in sorted(base.keys() & candidate.keys(), key=str):
+        base_seconds = base[key]["median_seconds"]
+        candidate_seconds = candidate[key]["median_seconds"]
+        change = (candidate_seconds - base_seconds) / base_seconds if base_seconds else 0.0
+        comparisons.append({
+            "key": key,
+            "base_seconds": base_seconds,
+            "candidate_seconds": candidate_seconds,
+            "change": change,
+            "regression": change > threshold,
+        })
+    return comparisons
+
+def format_key(key: ResultKey) -> str:
+    stage, quality, compute_type, audio_seconds = key
+    parts = [stage] + [str(part) for part in (quality, compute_type) if part]
+    if audio_seconds:
+        parts.append(f"{audio_seconds:g}s")
+    return " ".join(parts)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files and fail on regressions.")
+    parser.add_argument('base', type=Path)
+    parser.add_argument('candidate', type=Path)
+    parser.add_argument('--threshold', type=float, default=0.10, help="Allowed slowdown, 0.10 is 10%%.")
+    args = parser.parse_args(argv)
+
+    comparisons = compare(load_results(args.base), load_results(args.candidate), args.threshold)
+    for comparison in comparisons:
+        flag = "REGRESSION" if comparison["regression"] else ""
+        print(f"{format_key(comparison['key']):<60} {comparison['base_seconds']:>10.4f}s {comparison['candidate_seconds']:>10.4f}s "
+              f"{comparison['change']:>+8.1%} {flag}")
+    regressions = [comparison for comparison in comparisons if comparison["regression"]]
+    print(f"{len(comparisons)} results compared, {len(regressions)} regressions over {args.threshold:.0%}.")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
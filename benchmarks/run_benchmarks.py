@@ -0,0 +1,242 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-20
+# Summary: run_benchmarks times each stage of the transcription hot path on synthetic audio and
+# writes the results to JSON. The stages are decode, model load, inference (reported per
+# second of audio), the transcript upload and the log_status overhead. Every
+# AUDIO_QUALITY_MAP entry and compute type is covered by default. Compare two result files
+# with compare_benchmarks to gate performance regressions before a rollout.
+# 
+# Run from the repo root, e.g.:
+#     python -m benchmarks.run_benchmarks --durations 60 600 --qualities tiny medium --output bench.json
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+
+from benchmarks.synthetic_audio import synthetic_mp3
+from env_settings_code import get_settings, override_settings
+from fake_drive_code import FakeGoogleDrive
+from gdrive_helper_code import GDriveHelper
+from logger_code import LoggerBase
+from model_cache_code import ModelCache, default_device, resolve_compute_type
+from pydantic_models import GDriveInput
+from vad_code import load_audio, transcribe_with_pipeline
+from workflow_states_code import WorkflowEnum
+from workflow_tracker_code import ASSISTANT_MODEL_MAP, AUDIO_QUALITY_MAP, COMPUTE_TYPE_MAP, WorkflowTracker
+
+DEFAULT_AUDIO_DIR = Path(tempfile.gettempdir()) / "audio_to_transcript_benchmarks"
+
+logger = LoggerBase.setup_logger('Benchmarks')
+
+def time_call(fn: Callable, repeat: int) -> List[float]:
+    """Wall-clock seconds of `repeat` calls to fn."""
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start_time)
+    return timings
+
+def make_result(stage: str, timings: List[float], audio_seconds: Optional[float] = None, **labels) -> dict:
+    median = statistics.median(timings)
+    return {
+        "stage": stage,
+        "quality": labels.get("quality"),
+        "model": labels.get("model"),
+        "compute_type": labels.get("compute_type"),
+        "precision": labels.get("precision"),
+        "audio_seconds": audio_seconds,
+        "repeat": len(timings),
+        "median_seconds": median,
+        "min_seconds": min(timings),
+        "seconds_per_audio_second": median / audio_seconds if audio_seconds else None,
+    }
+
+def benchmark_decode(mp3_path: Path, audio_seconds: float, repeat: int) -> dict:
+    return make_result("decode", time_call(lambda: load_audio(str(mp3_path)), repeat), audio_seconds)
+
+def benchmark_log_status(iterations: int) -> dict:
+    """
+    The cost of one log_status call without the GDrive round trip: serializing the tracker, handing the status to
+    the status sink (debounced per status_debounce_s), writing it to the mp3 gfile's description on the in-process
+    fake drive and formatting the log record. The statuses still pending at the end are flushed and counted.
+    """
+    # The fake drive needs no credentials. The job ledger is turned off so the benchmark does not add
+    # transitions for a made-up gfile to the real ledger.
+    drive = FakeGoogleDrive()
+    mp3_gfile = drive.CreateFile({'title': 'benchmark.mp3'})
+    mp3_gfile.SetContentString("benchmark mp3")
+    mp3_gfile.Upload()
+    with override_settings(job_ledger_enabled=False):
+        gh = GDriveHelper(drive=drive)
+        # Format every record as usual, then throw it away.
+        with open(os.devnull, 'w', encoding='utf-8') as devnull:
+            streams = {}
+            for handler in gh.logger.handlers:
+                if isinstance(handler, logging.StreamHandler):
+                    streams[handler] = handler.setStream(devnull)
+            try:
+                async def _log_status_calls() -> List[float]:
+                    WorkflowTracker.start_job(status=WorkflowEnum.TRANSCRIBING.name, comment="Benchmarking log_status.",
+                                              transcript_audio_quality="medium", transcript_compute_type="float16",
+                                              mp3_gfile_id=mp3_gfile['id'])
+                    timings = []
+                    for _ in range(iterations):
+                        start_time = time.perf_counter()
+                        await gh.log_status()
+                        timings.append(time.perf_counter() - start_time)
+                    start_time = time.perf_counter()
+                    await gh.flush_status()
+                    timings[-1] += time.perf_counter() - start_time
+                    return timings
+                timings = asyncio.run(_log_status_calls())
+            finally:
+                for handler, stream in streams.items():
+                    handler.setStream(stream)
+    return make_result("log_status", timings)
+
+def benchmark_upload(transcript_text: str, repeat: int) -> dict:
+    """Uploads a transcript-sized text file to the transcripts folder and deletes it again. Needs GDrive credentials."""
+    gh = GDriveHelper()
+    folder_input = GDriveInput(gdrive_id=get_settings().gdrive_transcripts_folder_id)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        transcript_path = Path(temp_dir) / "benchmark_transcript.txt"
+        transcript_path.write_text(transcript_text, encoding='utf-8')
+        async def _uploads() -> List[float]:
+            timings = []
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                gfile_id = await gh.upload(folder_input, transcript_path)
+                timings.append(time.perf_counter() - start_time)
+                await gh.delete_file(gfile_id)
+            return timings
+        timings = asyncio.run(_uploads())
+    return make_result("upload", timings)
+
+def benchmark_models(mp3_paths: Dict[float, Path], qualities: List[str], compute_types: List[str],
+                     batch_size: int, repeat: int) -> Tuple[List[dict], Dict[float, str]]:
+    """
+    Model load and inference for every quality x compute type. The model is loaded cold, outside the
+    model cache, so the load time is the real one.
+
+    Returns:
+        Tuple[List[dict], Dict[float, str]]: The results, and the last transcript of each recording length.
+    """
+    device = default_device()
+    results = []
+    transcripts = {}
+    for quality in qualities:
+        model_name = AUDIO_QUALITY_MAP[quality]
+        assistant_model_name = ASSISTANT_MODEL_MAP.get(quality)
+        for compute_type in compute_types:
+            resolved_compute_type = resolve_compute_type(COMPUTE_TYPE_MAP[compute_type], device)
+            labels = {"quality": quality, "model": model_name, "compute_type": compute_type,
+                      "precision": resolved_compute_type}
+            logger.info(f"Benchmarking {quality} ({model_name}) with {compute_type} as {labels['precision']}.")
+            start_time = time.perf_counter()
+            pipe = ModelCache._load_pipeline(model_name, resolved_compute_type, device, assistant_model_name) # pylint: disable=protected-access
+            results.append(make_result("model_load", [time.perf_counter() - start_time], **labels))
+            # The first call also warms up kernels and allocators. Keep it out of the timings.
+            transcribe_with_pipeline(pipe, [str(next(iter(mp3_paths.values())))], batch_size)
+            for audio_seconds, mp3_path in mp3_paths.items():
+                outputs = []
+                timings = time_call(lambda: outputs.append(transcribe_with_pipeline(pipe, [str(mp3_path)], batch_size)), repeat) # pylint: disable=cell-var-from-loop
+                results.append(make_result("inference", timings, audio_seconds, **labels))
+                transcripts[audio_seconds] = outputs[-1][0]['text']
+            del pipe
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+    return results, transcripts
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, check=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def metadata(args: argparse.Namespace) -> dict:
+    return {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        "cpu_count": os.cpu_count(),
+        "batch_size": args.batch_size,
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Benchmark the transcription hot path on synthetic audio.")
+    parser.add_argument('--durations', type=float, nargs='+', default=[60.0],
+                        help="Lengths of the synthetic recordings in seconds (60 to 10800).")
+    parser.add_argument('--qualities', nargs='+', default=list(AUDIO_QUALITY_MAP), choices=list(AUDIO_QUALITY_MAP))
+    parser.add_argument('--compute-types', nargs='+', default=list(COMPUTE_TYPE_MAP), choices=list(COMPUTE_TYPE_MAP))
+    parser.add_argument('--batch-size', type=int, default=settings.transcription_batch_size)
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs of each stage. The median is reported.")
+    parser.add_argument('--log-status-iterations', type=int, default=200)
+    parser.add_argument('--upload', action='store_true', help="Also time the transcript upload. Needs GDrive credentials unless storage_backend is a fake drive.")
+    parser.add_argument('--skip-models', action='store_true', help="Only run the stages that do not load a model.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--audio-dir', type=Path, default=DEFAULT_AUDIO_DIR)
+    parser.add_argument('--output', type=Path, default=Path("benchmark_results.json"))
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    mp3_paths = {audio_seconds: synthetic_mp3(audio_seconds, args.audio_dir, args.seed) for audio_seconds in args.durations}
+    results = [benchmark_decode(mp3_path, audio_seconds, args.repeat) for audio_seconds, mp3_path in mp3_paths.items()]
+    results.append(benchmark_log_status(args.log_status_iterations))
+    transcripts = {}
+    if not args.skip_models:
+        model_results, transcripts = benchmark_models(mp3_paths, args.qualities, args.compute_types, args.batch_size, args.repeat)
+        results.extend(model_results)
+    if args.upload:
+        transcript_text = transcripts.get(max(args.durations), "benchmark " * 2000)
+        results.append(benchmark_upload(transcript_text, args.repeat))
+    args.output.write_text(json.dumps({"metadata": metadata(args), "results": results}, indent=2), encoding='utf-8')
+    logger.info(f"Wrote {len(results)} benchmark results to {args.output}.")
+
+if __name__ == "__main__":
+    main()
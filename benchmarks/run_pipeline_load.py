@@ -0,0 +1,129 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-22
+# Summary: run_pipeline_load pushes many mp3 files through the full download -> transcribe -> upload
+# pipeline against the in-process fake drive, with no Google credentials or network. It
+# seeds the fake drive with copies of a synthetic recording, runs the TranscriptionPipeline
+# and writes the throughput and the number of failed jobs to JSON. Use the fake drive
+# latency and error rate options to see how the pipeline holds up against a slow or flaky
+# drive.
+# 
+#     python -m benchmarks.run_pipeline_load --files 1000 --seconds 30 --latency-ms 50 --error-rate 0.01
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import argparse
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from benchmarks.run_benchmarks import DEFAULT_AUDIO_DIR, metadata
+from benchmarks.synthetic_audio import synthetic_mp3
+from env_settings_code import get_settings, reload_settings
+from fake_drive_code import get_fake_drive
+from logger_code import LoggerBase
+from transcription_pipeline_code import TranscriptionPipeline
+from workflow_states_code import WorkflowEnum
+
+logger = LoggerBase.setup_logger('PipelineLoad')
+
+def configure_fake_drive(args: argparse.Namespace) -> None:
+    """Points the settings at the fake drive. Must run before the first get_fake_drive call."""
+    os.environ['STORAGE_BACKEND'] = 'local' if args.fake_drive_dir else 'memory'
+    if args.fake_drive_dir:
+        os.environ['FAKE_DRIVE_DIR'] = str(args.fake_drive_dir)
+    os.environ['FAKE_DRIVE_LATENCY_MS'] = str(args.latency_ms)
+    os.environ['FAKE_DRIVE_ERROR_RATE'] = str(args.error_rate)
+    # Every file has the same audio. Without this, all but the first would be transcript cache hits.
+    os.environ['TRANSCRIPT_CACHE_ENABLED'] = 'false'
+    # The fake drive's gfiles are made up. Keep their transitions out of the real job ledger.
+    os.environ['JOB_LEDGER_ENABLED'] = 'false'
+    reload_settings()
+
+def seed_fake_drive(mp3_path: Path, num_files: int) -> List[str]:
+    """Uploads `num_files` copies of the mp3 to the mp3 folder of the fake drive. Returns their gfile ids."""
+    settings = get_settings()
+    drive = get_fake_drive(settings)
+    # Seeding is not part of the load test, so it runs without the injected latency and errors.
+    latency_ms, error_rate = drive.latency_ms, drive.error_rate
+    drive.latency_ms, drive.error_rate = 0.0, 0.0
+    gfile_ids = []
+    for index in range(num_files):
+        gfile = drive.CreateFile({'parents': [{'id': settings.gdrive_mp3_folder_id}]})
+        gfile.SetContentFile(str(mp3_path))
+        gfile['title'] = f"load_{index:05d}.mp3"
+        gfile.Upload()
+        gfile_ids.append(gfile['id'])
+    drive.latency_ms, drive.error_rate = latency_ms, error_rate
+    return gfile_ids
+
+async def run_load(gfile_ids: List[str], quality: str, compute_type: str) -> dict:
+    pipeline = TranscriptionPipeline()
+    pipeline.start()
+    start_time = time.perf_counter()
+    try:
+        jobs = [await pipeline.submit(gfile_id, quality, compute_type) for gfile_id in gfile_ids]
+        await pipeline.join()
+    finally:
+        await pipeline.stop()
+    elapsed = time.perf_counter() - start_time
+    completed = sum(job.workflow_model.status == WorkflowEnum.TRANSCRIPTION_UPLOAD_COMPLETE.name for job in jobs)
+    return {
+        "files": len(jobs),
+        "completed": completed,
+        "failed": len(jobs) - completed,
+        "seconds": elapsed,
+        "files_per_second": len(jobs) / elapsed if elapsed else None,
+    }
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Load test the transcription pipeline against the fake drive.")
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=30.0, help="Length of the synthetic recording in each file.")
+    parser.add_argument('--quality', default="tiny")
+    parser.add_argument('--compute-type', default="default")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Latency of every fake drive API call.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of fake drive API calls that fail.")
+    parser.add_argument('--fake-drive-dir', type=Path, default=None, help="Keep the fake drive's content here instead of in memory.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--audio-dir', type=Path, default=DEFAULT_AUDIO_DIR)
+    parser.add_argument('--output', type=Path, default=Path("pipeline_load_results.json"))
+    args = parser.parse_args(argv)
+    # metadata() reads these.
+    args.batch_size, args.repeat = None, 1
+
+    configure_fake_drive(args)
+    mp3_path = synthetic_mp3(args.seconds, args.audio_dir, args.seed)
+    gfile_ids = seed_fake_drive(mp3_path, args.files)
+    result = asyncio.run(run_load(gfile_ids, args.quality, args.compute_type))
+    result.update({"audio_seconds_per_file": args.seconds, "quality": args.quality, "compute_type": args.compute_type,
+                   "latency_ms": args.latency_ms, "error_rate": args.error_rate})
+    args.output.write_text(json.dumps({"metadata": metadata(args), "result": result}, indent=2), encoding='utf-8')
+    logger.info(f"{result['completed']} of {result['files']} files in {result['seconds']:.1f} seconds. Wrote {args.output}.")
+
+if __name__ == "__main__":
+    main()
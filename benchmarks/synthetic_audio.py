@@ -0,0 +1,96 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-20
+# Summary: synthetic_audio generates deterministic, speech-like audio for the benchmarks.
+# Real recordings cannot be checked into the repo at the lengths the benchmarks need (1
+# minute to 3 hours). The audio is made of voiced syllables (a glottal pitch with
+# harmonics shaped by two formants) grouped into utterances with pauses between them. This
+# gives the decoder, the VAD and the model the same kind of signal a lecture does. The same
+# seed always produces the same samples.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+from vad_code import SAMPLING_RATE
+
+def _syllable(rng: np.random.Generator, sampling_rate: int) -> np.ndarray:
+    num_samples = int(rng.uniform(0.12, 0.30) * sampling_rate)
+    t = np.arange(num_samples) / sampling_rate
+    # The pitch glides a little over the syllable, like intonation does.
+    f0 = rng.uniform(90.0, 220.0)
+    pitch = f0 * (1 + rng.uniform(-0.15, 0.15) * t / t[-1])
+    phase = 2 * np.pi * np.cumsum(pitch) / sampling_rate
+    formant_1, formant_2 = rng.uniform(300.0, 900.0), rng.uniform(900.0, 2500.0)
+    samples = np.zeros(num_samples)
+    for harmonic in range(1, 16):
+        frequency = harmonic * f0
+        if frequency > sampling_rate / 2:
+            break
+        weight = np.exp(-((frequency - formant_1) / 150.0) ** 2) + 0.5 * np.exp(-((frequency - formant_2) / 250.0) ** 2)
+        samples += (weight + 0.02) * np.sin(harmonic * phase)
+    samples *= np.hanning(num_samples)
+    return rng.uniform(0.1, 0.4) * samples / max(np.max(np.abs(samples)), 1e-9)
+
+def synthesize_speech_like(seconds: float, seed: int = 0, sampling_rate: int = SAMPLING_RATE) -> np.ndarray:
+    """
+    Returns `seconds` of speech-like mono float32 audio.
+
+    Utterances of 1 to 8 seconds of syllables alternate with 0.2 to 1.5 second pauses, over a noise
+    floor around -60 dBFS.
+    """
+    rng = np.random.default_rng(seed)
+    num_samples = int(seconds * sampling_rate)
+    audio = (0.001 * rng.standard_normal(num_samples)).astype(np.float32)
+    position = 0
+    while position < num_samples:
+        utterance_end = position + int(rng.uniform(1.0, 8.0) * sampling_rate)
+        while position < min(utterance_end, num_samples):
+            syllable = _syllable(rng, sampling_rate)[:num_samples - position]
+            audio[position:position + len(syllable)] += syllable
+            position += len(syllable) + int(rng.uniform(0.0, 0.05) * sampling_rate)
+        position += int(rng.uniform(0.2, 1.5) * sampling_rate)
+    return np.clip(audio, -1.0, 1.0)
+
+def write_mp3(audio: np.ndarray, mp3_path: Path, sampling_rate: int = SAMPLING_RATE) -> Path:
+    """Encodes float32 samples to an mp3 with ffmpeg."""
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+    command = ['ffmpeg', '-loglevel', 'quiet', '-y', '-f', 's16le', '-ar', str(sampling_rate), '-ac', '1',
+               '-i', 'pipe:0', '-b:a', '64k', str(mp3_path)]
+    try:
+        subprocess.run(command, input=pcm, check=True)
+    except FileNotFoundError as e:
+        raise ValueError("ffmpeg was not found but is required to encode the benchmark audio.") from e
+    return mp3_path
+
+def synthetic_mp3(seconds: float, audio_dir: Path, seed: int = 0) -> Path:
+    """The path to a synthetic mp3 of `seconds` length. It is generated the first time and reused after that."""
+    audio_dir.mkdir(parents=True, exist_ok=True)
+    mp3_path = audio_dir / f"speech_like_{int(seconds)}s_seed{seed}.mp3"
+    if not mp3_path.exists():
+        write_mp3(synthesize_speech_like(seconds, seed), mp3_path)
+    return mp3_path
@@ -0,0 +1,102 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-29
+# Summary: drive_client_pool_code keeps a process-wide pool of authenticated Drive clients. Every
+# GDriveHelper used to log in with the service account and build its own GoogleDrive, and
+# one was made per job, so the auth round trip and the HTTP connections were thrown away
+# over and over. Now a client is created (and logged in) once per pool slot and reused.
+# The executor functions borrow a client for the duration of their Drive calls. A client is
+# only used by one thread at a time, and pydrive2 keeps a keep-alive HTTP connection per
+# thread and client. Expired access tokens are refreshed when a client is borrowed.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from logger_code import LoggerBase
+
+class DriveClientPool:
+    """
+    A thread-safe pool of Drive clients (pydrive2 GoogleDrive, or anything with the same interface).
+
+    Clients are created on demand up to `size`. When all of them are borrowed, borrow() waits for one to
+    be returned.
+
+    Attributes:
+        create_client (Callable[[], Any]): Creates and logs in a new client.
+        size (int): The most clients the pool creates. 0 or less means no limit, for a client that is
+            thread-safe and shared by every borrower, as the FakeGoogleDrive is.
+    """
+    def __init__(self, create_client: Callable[[], Any], size: int):
+        self.create_client = create_client
+        self.size = size
+        self.logger = LoggerBase.setup_logger('DriveClientPool')
+        self._idle: "queue.LifoQueue[Any]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def borrow(self) -> Iterator[Any]:
+        """Borrows a client for the calls in the with block. Blocks, so use it in executor functions."""
+        client = self._acquire()
+        try:
+            self._refresh_if_expired(client)
+            yield client
+        finally:
+            self._idle.put(client)
+
+    def _acquire(self) -> Any:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self.size <= 0 or self._created < self.size
+            if can_create:
+                self._created += 1
+        if not can_create:
+            return self._idle.get()
+        try:
+            client = self.create_client()
+        except BaseException:
+            with self._lock:
+                self._created -= 1
+            raise
+        self.logger.debug(f"Created Drive client {self._created} of {self.size if self.size > 0 else 'unlimited'}.")
+        return client
+
+    def _refresh_if_expired(self, client: Any) -> None:
+        # A service account token lasts an hour. Refreshing here keeps the refresh off the request path
+        # of whatever call happens to hit the expiry.
+        auth = getattr(client, 'auth', None)
+        if auth is not None and getattr(auth, 'credentials', None) is not None and auth.access_token_expired:
+            self.logger.debug("Refreshing the access token of a pooled Drive client.")
+            auth.Refresh()
+
+    def created(self) -> int:
+        with self._lock:
+            return self._created
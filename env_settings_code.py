@@ -1,15 +1,23 @@
 
 import json
-from typing import List
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
 from dotenv import load_dotenv
 
-from pydantic_settings import BaseSettings
-from pydantic import  field_validator
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from pydantic import  field_validator, ValidationError
+
+from workflow_tracker_code import AUDIO_QUALITY_MAP, COMPUTE_TYPE_MAP
 
 load_dotenv()
 
 # Matches the variables in .env
 class Settings(BaseSettings):
+    # Fields such as model_cache_max_gb start with pydantic's reserved "model_" prefix.
+    model_config = SettingsConfigDict(protected_namespaces=('settings_',))
+
     gdrive_mp3_folder_id: str
     gdrive_transcripts_folder_id: str
     audio_quality_default: str
@@ -18,6 +26,79 @@ class Settings(BaseSettings):
     google_drive_oauth_scopes: List[str]
     local_mp3_dir: str
     local_transcript_dir: str
+    # Memory budget (in GB) for the ASR pipelines kept loaded by the model cache.
+    model_cache_max_gb: float = 12.0
+    # Number of 30 second chunks run through the model at once.
+    transcription_batch_size: int = 8
+    # Number of queued mp3 files whose chunks are pooled into shared batches.
+    batch_max_files: int = 8
+    # Workers per stage of the background download -> transcribe -> upload pipeline.
+    download_concurrency: int = 2
+    inference_concurrency: int = 1
+    upload_concurrency: int = 2
+    # Maximum number of jobs waiting between two stages of the pipeline.
+    pipeline_queue_maxsize: int = 8
+    # Number of worker processes running inference. 0 runs inference in a thread of this process.
+    transcription_workers: int = 0
+    # torch intra-op threads per worker process.
+    threads_per_worker: int = 4
+    # Pin each worker process to its own block of threads_per_worker cores (Linux only).
+    pin_worker_cores: bool = True
+    # Skip silence before inference with the energy-based voice activity detector.
+    vad_enabled: bool = False
+    # A frame is speech when its energy is this many dB above the noise floor.
+    vad_threshold_db: float = 10.0
+    # Pauses shorter than this stay inside the speech segment around them.
+    vad_min_silence_ms: int = 500
+    # Audio kept before and after each speech segment.
+    vad_pad_ms: int = 200
+    # Decode the mp3 while it downloads instead of saving it to local_mp3_dir first. Applies to transcribe() and to the
+    # background pipeline, where each file then streams on its own: no batching across files, worker pool or transcript cache.
+    streaming_decode: bool = False
+    # Size of each GDrive download chunk when streaming.
+    stream_chunk_mb: int = 8
+    # Reuse the transcript of audio that was transcribed before with the same model, compute type and VAD options.
+    transcript_cache_enabled: bool = True
+    transcript_cache_path: str = "transcript_cache.sqlite3"
+    # Where GDriveHelper keeps files: "gdrive" (Google Drive), or for offline load tests the fake drive,
+    # "memory" or "local" (content stored under fake_drive_dir).
+    storage_backend: str = "gdrive"
+    fake_drive_dir: str = "fake_drive"
+    # Latency added to, and the fraction of failures injected into, every fake drive API call.
+    fake_drive_latency_ms: float = 0.0
+    fake_drive_error_rate: float = 0.0
+    # Seconds a status waits for a newer one before it is written to the mp3 gfile description. 0 writes every status.
+    status_debounce_s: float = 2.0
+    # Watcher mode: seconds between polls of the Drive changes feed, and where its page token is saved.
+    watch_poll_interval_s: float = 5.0
+    changes_token_path: str = "drive_changes_token.txt"
+    # Watcher mode: a failed job is retried after watch_retry_backoff_s, doubled with each failure, up to
+    # watch_max_retries times until the mp3's content changes.
+    watch_max_retries: int = 3
+    watch_retry_backoff_s: float = 60.0
+    # Most authenticated Drive clients kept in the pool, i.e. Drive calls in flight at once. A streaming
+    # download holds a client until it ends, so keep this above the number of concurrent streams.
+    drive_client_pool_size: int = 8
+    # Uploads go to Drive in chunks of this size (rounded up to a multiple of 256 KiB) through a resumable
+    # session. A failed chunk is retried from the last acknowledged byte, up to upload_max_retries times in a row.
+    upload_chunk_mb: int = 8
+    upload_max_retries: int = 5
+    # Downloads of this many MB or more are split into ranged_download_segment_mb Range requests, fetched by
+    # ranged_download_workers threads at once. Each thread borrows a pooled client, see drive_client_pool_size.
+    ranged_download_threshold_mb: int = 64
+    ranged_download_segment_mb: int = 16
+    ranged_download_workers: int = 4
+    # "stream" logs colorized text to stderr from the thread that logs. "queue" hands each record to a background
+    # thread that writes newline-delimited JSON to log_json_path (stderr when empty), rotated every log_max_mb.
+    log_backend: str = "stream"
+    log_json_path: str = ""
+    log_max_mb: int = 50
+    log_backup_count: int = 5
+    # Queue backend only: the fraction of DEBUG and FLOW records kept per logger name, e.g. '{"FakeGoogleDrive": 0.01}'.
+    log_sample_rates: Dict[str, float] = {}
+    # Record every job transition in a local SQLite ledger so a restarted runner resumes instead of starting over.
+    job_ledger_enabled: bool = True
+    job_ledger_path: str = "job_ledger.sqlite3"
 
     @field_validator('google_drive_oauth_scopes')
     @classmethod
@@ -28,6 +109,95 @@ class Settings(BaseSettings):
             except json.JSONDecodeError:
                 pass  # Optionally handle error or log a warning
         return v
+
+    @field_validator('storage_backend')
+    @classmethod
+    def check_storage_backend(cls, v):
+        if v not in ('gdrive', 'memory', 'local'):
+            raise ValueError(f"storage_backend must be 'gdrive', 'memory' or 'local', not {v}.")
+        return v
+
+    @field_validator('audio_quality_default')
+    @classmethod
+    def check_audio_quality_default(cls, v):
+        if v not in AUDIO_QUALITY_MAP:
+            raise ValueError(f"audio_quality_default must be one of {', '.join(AUDIO_QUALITY_MAP)}, not {v}.")
+        return v
+
+    @field_validator('compute_type_default')
+    @classmethod
+    def check_compute_type_default(cls, v):
+        if v not in COMPUTE_TYPE_MAP:
+            raise ValueError(f"compute_type_default must be one of {', '.join(COMPUTE_TYPE_MAP)}, not {v}.")
+        return v
+
+    @field_validator('log_backend')
+    @classmethod
+    def check_log_backend(cls, v):
+        if v not in ('stream', 'queue'):
+            raise ValueError(f"log_backend must be 'stream' or 'queue', not {v}.")
+        return v
+
+    @field_validator('download_concurrency', 'inference_concurrency', 'upload_concurrency', 'pipeline_queue_maxsize',
+                     'transcription_batch_size', 'batch_max_files', 'threads_per_worker', 'upload_chunk_mb',
+                     'ranged_download_segment_mb', 'ranged_download_workers', 'stream_chunk_mb')
+    @classmethod
+    def check_positive(cls, v, info):
+        if v < 1:
+            raise ValueError(f"{info.field_name} must be at least 1, not {v}.")
+        return v
+
+    @field_validator('fake_drive_error_rate')
+    @classmethod
+    def check_error_rate(cls, v):
+        if not 0.0 <= v < 1.0:
+            raise ValueError(f"fake_drive_error_rate must be from 0 up to (not including) 1, not {v}.")
+        return v
+
+_settings_override: Optional[Settings] = None
+
+@lru_cache(maxsize=1)
+def _load_settings() -> Settings:
+    return Settings()
+
 # Dependency that retrieves the settings
 def get_settings() -> Settings:
-    return Settings()
\ No newline at end of file
+    """
+    The settings, read from the environment and .env and validated on the first call, then reused. Treat
+    them as read-only. Call reload_settings() after changing the environment.
+    """
+    if _settings_override is not None:
+        return _settings_override
+    return _load_settings()
+
+def reload_settings() -> Settings:
+    """Reads the settings from the environment again. Objects that already hold the old settings keep them."""
+    _load_settings.cache_clear()
+    return get_settings()
+
+@contextmanager
+def override_settings(**overrides) -> Iterator[Settings]:
+    """
+    For tests. Within the block get_settings() returns settings with `overrides` applied on top of the
+    environment. The overridden settings are validated like any others.
+    """
+    global _settings_override # pylint: disable=global-statement
+    previous = _settings_override
+    _settings_override = Settings(**overrides)
+    try:
+        yield _settings_override
+    finally:
+        _settings_override = previous
+
+def check_settings() -> Settings:
+    """
+    Loads and validates the settings. Call it at startup so a configuration error stops the process with a
+    readable message before any job starts, rather than failing the first job that needs the setting.
+    """
+    try:
+        settings = reload_settings()
+    except ValidationError as e:
+        raise SystemExit(f"The settings are not valid. Check the environment and .env:\n{e}") from e
+    if settings.storage_backend == 'gdrive' and not Path(settings.google_service_account_credentials_path).is_file():
+        raise SystemExit(f"The service account credentials file {settings.google_service_account_credentials_path} does not exist.")
+    return settings
\ No newline at end of file
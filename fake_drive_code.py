@@ -0,0 +1,398 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-22
+# Summary: fake_drive_code is an in-process stand-in for pydrive2's GoogleDrive. It lets
+# GDriveHelper and the pipeline run without Google credentials or network access, for
+# example to load test the pipeline with 1,000+ files on an isolated box. FakeGoogleDrive
+# implements the subset of the pydrive2 API that GDriveHelper uses, with the same semantics:
+# CreateFile, Upload, SetContentFile, GetContentFile, GetContentIOBuffer, FetchMetadata,
+# Delete, ListFile with Drive's query syntax and paging, metadata fields such as
+# description, and the changes feed. File content is kept in memory or in a local directory. Every API call can
+# be given extra latency and a random failure rate.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import hashlib
+import io
+import itertools
+import mimetypes
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from logger_code import LoggerBase
+from resumable_upload_code import UploadSource, source_mimetype, source_size
+
+class FakeDriveApiError(IOError):
+    """Raised where pydrive2 raises ApiRequestError: an unknown file id, a bad query or an injected failure."""
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+def _parse_fields(fields: Optional[str]) -> Optional[Dict[str, Optional[str]]]:
+    """Parses a Drive `fields` selector such as "items(id,title),nextPageToken" into {name: sub-selector}."""
+    if not fields:
+        return None
+    parsed, depth, start = {}, 0, 0
+    for index, char in enumerate(fields + ','):
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        if char == ',' and depth == 0:
+            part = fields[start:index].strip()
+            start = index + 1
+            if not part:
+                continue
+            name, _, sub_fields = part.partition('(')
+            parsed[name.strip()] = sub_fields[:-1] if sub_fields else None
+    return parsed
+
+def select_fields(metadata: dict, fields: Optional[str]) -> dict:
+    """The part of the metadata the selector asks for. Fields the file does not have are left out, as Drive does."""
+    parsed = _parse_fields(fields)
+    if parsed is None:
+        return dict(metadata)
+    return {name: metadata[name] for name in parsed if name in metadata}
+
+_QUERY_CLAUSE_PATTERNS = [
+    (re.compile(r"^'(?P<value>[^']*)'\s+in\s+parents$"),
+     lambda value: lambda metadata: any(parent['id'] == value for parent in metadata.get('parents', []))),
+    (re.compile(r"^trashed\s*=\s*(?P<value>true|false)$", re.IGNORECASE),
+     lambda value: lambda metadata: metadata['labels']['trashed'] == (value.lower() == 'true')),
+    (re.compile(r"^title\s*=\s*'(?P<value>[^']*)'$"),
+     lambda value: lambda metadata: metadata.get('title') == value),
+    (re.compile(r"^title\s+contains\s+'(?P<value>[^']*)'$"),
+     lambda value: lambda metadata: value in metadata.get('title', '')),
+    (re.compile(r"^mimeType\s*=\s*'(?P<value>[^']*)'$"),
+     lambda value: lambda metadata: metadata.get('mimeType') == value),
+    (re.compile(r"^mimeType\s*!=\s*'(?P<value>[^']*)'$"),
+     lambda value: lambda metadata: metadata.get('mimeType') != value),
+]
+
+def parse_query(query: Optional[str]):
+    """Turns a Drive v2 search query (clauses joined by "and") into a predicate on file metadata."""
+    predicates = []
+    for clause in re.split(r'\s+and\s+', query.strip(), flags=re.IGNORECASE) if query else []:
+        for pattern, make_predicate in _QUERY_CLAUSE_PATTERNS:
+            match = pattern.match(clause.strip())
+            if match:
+                predicates.append(make_predicate(match.group('value')))
+                break
+        else:
+            raise FakeDriveApiError(f"The fake drive does not support the query clause: {clause}")
+    return lambda metadata: all(predicate(metadata) for predicate in predicates)
+
+class FakeGoogleDriveFile(dict):
+    """
+    A file of the FakeGoogleDrive. Like pydrive2's GoogleDriveFile it is a dict of the file's metadata.
+    Metadata set on it (and content set with SetContentFile/SetContentString) is stored by Upload().
+    """
+    def __init__(self, drive: "FakeGoogleDrive", metadata: Optional[dict] = None, uploaded: bool = False):
+        super().__init__(metadata or {})
+        self.drive = drive
+        self.uploaded = uploaded
+        self.content: Optional[io.BytesIO] = None
+
+    def SetContentFile(self, filename: str) -> None: # pylint: disable=invalid-name
+        with open(filename, 'rb') as content_file:
+            self.content = io.BytesIO(content_file.read())
+        if self.get('title') is None:
+            self['title'] = filename
+        if self.get('mimeType') is None:
+            self['mimeType'] = mimetypes.guess_type(filename)[0]
+
+    def SetContentString(self, content: str, encoding: str = 'utf-8') -> None: # pylint: disable=invalid-name
+        self.content = io.BytesIO(content.encode(encoding))
+        if self.get('mimeType') is None:
+            self['mimeType'] = 'text/plain'
+
+    def Upload(self, param: Optional[dict] = None) -> None: # pylint: disable=invalid-name,unused-argument
+        content = self.content.getvalue() if self.content is not None else None
+        self.update(self.drive._store(dict(self), content)) # pylint: disable=protected-access
+        self.uploaded = True
+
+    def FetchMetadata(self, fields: Optional[str] = None, fetch_all: bool = False) -> None: # pylint: disable=invalid-name,unused-argument
+        self.update(select_fields(self.drive._fetch(self._file_id(), 'FetchMetadata'), fields)) # pylint: disable=protected-access
+        self.uploaded = True
+
+    def GetContentString(self, encoding: str = 'utf-8') -> str: # pylint: disable=invalid-name
+        return self.drive._read(self._file_id()).decode(encoding) # pylint: disable=protected-access
+
+    def GetContentFile(self, filename: str, mimetype: Optional[str] = None) -> None: # pylint: disable=invalid-name,unused-argument
+        Path(filename).write_bytes(self.drive._read(self._file_id())) # pylint: disable=protected-access
+
+    def GetContentIOBuffer(self, mimetype: Optional[str] = None, chunksize: int = 100 * 1024 * 1024) -> Iterator[bytes]: # pylint: disable=invalid-name,unused-argument
+        content = self.drive._read(self._file_id()) # pylint: disable=protected-access
+        return (content[start:start + chunksize] for start in range(0, len(content), chunksize))
+
+    def Trash(self) -> None: # pylint: disable=invalid-name
+        self.update(self.drive._store({'id': self._file_id(), 'labels': {'trashed': True}}, None)) # pylint: disable=protected-access
+
+    def Delete(self) -> None: # pylint: disable=invalid-name
+        self.drive._delete(self._file_id()) # pylint: disable=protected-access
+
+    def _file_id(self) -> str:
+        if not self.get('id'):
+            raise FakeDriveApiError("The file has no id. Upload it first.")
+        return self['id']
+
+class FakeResumableUpload:
+    """
+    A resumable upload to the FakeGoogleDrive, with the interface of resumable_upload_code.DriveResumableUpload.
+    Every chunk is an API call, so it can be slowed down or fail like any other. A failed chunk is not
+    acknowledged and is sent again by the next next_chunk().
+    """
+    def __init__(self, drive: "FakeGoogleDrive", metadata: dict, source: UploadSource, chunk_size: int):
+        self.drive = drive
+        self.metadata = dict(metadata)
+        self.source = source
+        self.chunk_size = chunk_size
+        self.total_size = source_size(source)
+        self.resumable_progress = 0
+        self._received = io.BytesIO()
+
+    def restart(self) -> None:
+        self.resumable_progress = 0
+        self._received = io.BytesIO()
+
+    def next_chunk(self) -> Optional[dict]:
+        if self.resumable_progress < self.total_size:
+            self.drive._api_call('UploadChunk') # pylint: disable=protected-access
+            chunk = self._read_chunk()
+            self._received.write(chunk)
+            self.resumable_progress += len(chunk)
+            if self.resumable_progress < self.total_size:
+                return None
+        if self.metadata.get('mimeType') is None:
+            self.metadata['mimeType'] = source_mimetype(self.metadata)
+        return self.drive._store(self.metadata, self._received.getvalue()) # pylint: disable=protected-access
+
+    def _read_chunk(self) -> bytes:
+        if isinstance(self.source, (str, Path)):
+            with open(self.source, 'rb') as content_file:
+                content_file.seek(self.resumable_progress)
+                return content_file.read(self.chunk_size)
+        self.source.seek(self.resumable_progress)
+        return self.source.read(self.chunk_size)
+
+class FakeGoogleDriveFileList(dict):
+    """
+    The result of FakeGoogleDrive.ListFile. Like pydrive2's GoogleDriveFileList, iterating it yields one
+    page (a list of files) at a time and GetList() returns every file, or one page when maxResults is set.
+    """
+    def __init__(self, drive: "FakeGoogleDrive", param: Optional[dict] = None):
+        super().__init__(param or {})
+        self.drive = drive
+        self.metadata: dict = {}
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> List[FakeGoogleDriveFile]:
+        if 'pageToken' in self and self['pageToken'] is None:
+            raise StopIteration
+        self.metadata = self.drive._list(self.get('q'), self.get('maxResults'), self.get('pageToken'), self.get('fields')) # pylint: disable=protected-access
+        self['pageToken'] = self.metadata.get('nextPageToken')
+        return [FakeGoogleDriveFile(self.drive, metadata, uploaded=True) for metadata in self.metadata.get('items', [])]
+
+    def GetList(self) -> List[FakeGoogleDriveFile]: # pylint: disable=invalid-name
+        if self.get('maxResults') is None:
+            return list(itertools.chain.from_iterable(self))
+        return next(self)
+
+class FakeGoogleDrive:
+    """
+    An in-process Google Drive with the pydrive2 GoogleDrive interface.
+
+    Metadata is kept in memory. Content is kept in memory, or in `root_dir` (one file per id) so large
+    mp3s do not all have to fit in memory. All access is guarded by a lock so executor threads can share
+    one FakeGoogleDrive.
+
+    Attributes:
+        root_dir (Path, optional): Where the content is stored. None keeps it in memory.
+        latency_ms (float): Added to every API call, the way a network round trip would be.
+        error_rate (float): The fraction of API calls that fail with FakeDriveApiError.
+        seed (int, optional): Seeds the failure injection so a load test can be repeated exactly.
+    """
+    def __init__(self, root_dir: Optional[str] = None, latency_ms: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.root_dir = Path(root_dir) if root_dir else None
+        if self.root_dir:
+            self.root_dir.mkdir(parents=True, exist_ok=True)
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.logger = LoggerBase.setup_logger('FakeGoogleDrive')
+        self._random = random.Random(seed)
+        self._files: Dict[str, dict] = {}
+        self._contents: Dict[str, bytes] = {}
+        # The changes feed: the id of every file in the order it was changed. A page token is an index into it.
+        self._changes: List[str] = []
+        self._lock = threading.Lock()
+
+    def CreateFile(self, metadata: Optional[dict] = None) -> FakeGoogleDriveFile: # pylint: disable=invalid-name
+        return FakeGoogleDriveFile(self, metadata)
+
+    def ListFile(self, param: Optional[dict] = None) -> FakeGoogleDriveFileList: # pylint: disable=invalid-name
+        return FakeGoogleDriveFileList(self, param)
+
+    def GetContentRange(self, file_id: str, start: int, end: int) -> bytes: # pylint: disable=invalid-name
+        """Bytes `start` to `end` (inclusive) of the file's content, like a Range request."""
+        return self._read(file_id)[start:end + 1]
+
+    def CreateResumableUpload(self, metadata: dict, source: UploadSource, chunk_size: int) -> FakeResumableUpload: # pylint: disable=invalid-name
+        """A resumable upload to a new file, like GoogleDriveWithChanges.CreateResumableUpload."""
+        return FakeResumableUpload(self, metadata, source, chunk_size)
+
+    def GetStartPageToken(self) -> str: # pylint: disable=invalid-name
+        """The page token of the next change, like changes.getStartPageToken."""
+        self._api_call('GetStartPageToken')
+        with self._lock:
+            return str(len(self._changes))
+
+    def ListChanges(self, page_token: str, max_results: int = 1000, fields: Optional[str] = None) -> dict: # pylint: disable=invalid-name
+        """
+        One page of the changes since `page_token`, like Drive v2 changes.list: 'items' of {fileId, deleted,
+        file}, and 'nextPageToken' while there are more pages, or 'newStartPageToken' on the last page.
+        """
+        self._api_call('ListChanges')
+        parsed_fields = _parse_fields(fields)
+        item_fields = _parse_fields(parsed_fields['items']) if parsed_fields and parsed_fields.get('items') else None
+        file_fields = item_fields.get('file') if item_fields else None
+        with self._lock:
+            start = int(page_token)
+            end = min(start + max_results, len(self._changes))
+            items = []
+            for file_id in self._changes[start:end]:
+                metadata = self._files.get(file_id)
+                item = {'fileId': file_id, 'deleted': metadata is None}
+                if metadata is not None:
+                    item['file'] = select_fields(metadata, file_fields)
+                items.append(item)
+            result = {'items': items}
+            if end < len(self._changes):
+                result['nextPageToken'] = str(end)
+            else:
+                result['newStartPageToken'] = str(end)
+            return result
+
+    def _api_call(self, operation: str) -> None:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        if self.error_rate:
+            with self._lock:
+                failed = self._random.random() < self.error_rate
+            if failed:
+                raise FakeDriveApiError(f"Injected failure of {operation}.")
+
+    def _store(self, changes: dict, content: Optional[bytes]) -> dict:
+        self._api_call('Upload')
+        with self._lock:
+            file_id = changes.get('id')
+            if file_id:
+                if file_id not in self._files:
+                    raise FakeDriveApiError(f"File not found: {file_id}")
+                metadata = self._files[file_id]
+            else:
+                file_id = uuid.uuid4().hex
+                metadata = {'id': file_id, 'title': 'Untitled', 'parents': [{'id': 'root'}],
+                            'labels': {'trashed': False}, 'createdDate': _now()}
+                self._files[file_id] = metadata
+            metadata.update({key: value for key, value in changes.items() if key not in ('id', 'labels')})
+            metadata['labels'] = {**metadata['labels'], **changes.get('labels', {})}
+            if content is not None:
+                self._write_content(file_id, content)
+                metadata['fileSize'] = str(len(content))
+                metadata['md5Checksum'] = hashlib.md5(content).hexdigest()
+            metadata['modifiedDate'] = _now()
+            self._changes.append(file_id)
+            return dict(metadata)
+
+    def _fetch(self, file_id: str, operation: str) -> dict:
+        self._api_call(operation)
+        with self._lock:
+            if file_id not in self._files:
+                raise FakeDriveApiError(f"File not found: {file_id}")
+            return dict(self._files[file_id])
+
+    def _read(self, file_id: str) -> bytes:
+        self._fetch(file_id, 'GetContent')
+        with self._lock:
+            if self.root_dir:
+                content_path = self.root_dir / file_id
+                return content_path.read_bytes() if content_path.exists() else b''
+            return self._contents.get(file_id, b'')
+
+    def _write_content(self, file_id: str, content: bytes) -> None:
+        if self.root_dir:
+            (self.root_dir / file_id).write_bytes(content)
+        else:
+            self._contents[file_id] = content
+
+    def _delete(self, file_id: str) -> None:
+        self._api_call('Delete')
+        with self._lock:
+            if self._files.pop(file_id, None) is None:
+                raise FakeDriveApiError(f"File not found: {file_id}")
+            self._changes.append(file_id)
+            self._contents.pop(file_id, None)
+            if self.root_dir:
+                (self.root_dir / file_id).unlink(missing_ok=True)
+
+    def _list(self, query: Optional[str], max_results: Optional[int], page_token: Optional[str], fields: Optional[str]) -> dict:
+        self._api_call('ListFile')
+        matches = parse_query(query)
+        with self._lock:
+            # Drive lists the most recently modified files first by default.
+            files = sorted((metadata for metadata in self._files.values() if matches(metadata)),
+                           key=lambda metadata: metadata['modifiedDate'], reverse=True)
+        start = int(page_token) if page_token else 0
+        end = start + max_results if max_results else len(files)
+        parsed_fields = _parse_fields(fields)
+        item_fields = parsed_fields.get('items') if parsed_fields else None
+        result = {'items': [select_fields(metadata, item_fields) for metadata in files[start:end]]}
+        if end < len(files):
+            result['nextPageToken'] = str(end)
+        return result
+
+_fake_drive: Optional[FakeGoogleDrive] = None
+_fake_drive_lock = threading.Lock()
+
+def get_fake_drive(settings) -> FakeGoogleDrive:
+    """
+    Returns the process-wide FakeGoogleDrive for `settings.storage_backend` ("memory" or "local"). Every
+    GDriveHelper shares it, so what one uploads the others can download.
+    """
+    global _fake_drive # pylint: disable=global-statement
+    if settings.storage_backend not in ('memory', 'local'):
+        raise ValueError(f"{settings.storage_backend} is not a fake drive storage backend. Use 'memory' or 'local'.")
+    with _fake_drive_lock:
+        if _fake_drive is None:
+            _fake_drive = FakeGoogleDrive(
+                root_dir=settings.fake_drive_dir if settings.storage_backend == 'local' else None,
+                latency_ms=settings.fake_drive_latency_ms,
+                error_rate=settings.fake_drive_error_rate,
+            )
+        return _fake_drive
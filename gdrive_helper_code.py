@@ -1,46 +1,113 @@
 from pathlib import Path
 import asyncio
 import json
-from typing import Union
+import threading
+from typing import BinaryIO, List, Optional, Tuple, Union
 
 import aiofiles
 from pydantic import ValidationError
-from pydrive2.auth import GoogleAuth
+from pydrive2.auth import GoogleAuth, LoadAuth
 from pydrive2.drive import GoogleDrive
 
 from workflow_states_code import WorkflowEnum
 from workflow_tracker_code import WorkflowTracker
 from env_settings_code import get_settings
-from logger_code import LoggerBase
+from drive_client_pool_code import DriveClientPool
+from fake_drive_code import get_fake_drive
+from job_ledger_code import JobTransition, get_job_ledger
+from resumable_upload_code import DriveResumableUpload, UploadSource, run_resumable_upload
+from ranged_download_code import download_ranges, verify_md5
+from status_sink_code import StatusSink
+from logger_code import LazyMessage, LoggerBase
 from update_status import async_error_handler,update_status
 from workflow_error_code import handle_error
 from pydantic_models import GDriveInput, TranscriptText, MP3filename, StatusModel
 
 
 
+# The metadata list_files_to_transcribe asks for, and how many files it asks for per call (the Drive v2 maximum).
+LISTING_FIELDS = "items(id,title,description,fileSize,md5Checksum,modifiedDate),nextPageToken"
+LISTING_PAGE_SIZE = 1000
+# The same file metadata, asked for on each file of the changes feed.
+CHANGES_FIELDS = "items(fileId,deleted,file(id,title,description,fileSize,md5Checksum,modifiedDate,parents,labels)),nextPageToken,newStartPageToken"
+
+class GoogleDriveWithChanges(GoogleDrive):
+    """
+    pydrive2's GoogleDrive plus the Drive changes feed, ranged downloads and resumable uploads, which pydrive2
+    does not wrap.
+    FakeGoogleDrive has the same methods.
+    """
+    @LoadAuth
+    def GetContentRange(self, file_id: str, start: int, end: int) -> bytes: # pylint: disable=invalid-name
+        """Bytes `start` to `end` (inclusive) of the file's content."""
+        request = self.auth.service.files().get_media(fileId=file_id)
+        request.headers['Range'] = f"bytes={start}-{end}"
+        return request.execute(http=self.http)
+
+    @LoadAuth
+    def CreateResumableUpload(self, metadata: dict, source: UploadSource, chunk_size: int) -> DriveResumableUpload: # pylint: disable=invalid-name
+        return DriveResumableUpload(self.auth, metadata, source, chunk_size)
+
+    @LoadAuth
+    def GetStartPageToken(self) -> str: # pylint: disable=invalid-name
+        return self.auth.service.changes().getStartPageToken().execute()['startPageToken']
+
+    @LoadAuth
+    def ListChanges(self, page_token: str, max_results: int = 1000, fields: Optional[str] = None) -> dict: # pylint: disable=invalid-name
+        return self.auth.service.changes().list(
+            pageToken=page_token, maxResults=max_results, fields=fields, includeDeleted=True
+        ).execute()
+
+def login_with_service_account():
+    settings = get_settings()
+    login_settings = {
+        "client_config_backend": "service",
+        "oauth_scope": settings.google_drive_oauth_scopes,
+        "service_config": {
+            "client_json_file_path":settings.google_service_account_credentials_path
+        }
+    }
+    gauth = GoogleAuth(settings=login_settings)
+    gauth.ServiceAuth()
+    return gauth
+
+_drive_client_pool: Optional[DriveClientPool] = None
+_drive_client_pool_lock = threading.Lock()
+
+def get_drive_client_pool() -> DriveClientPool:
+    """
+    Returns the process-wide pool of Drive clients for the storage_backend setting. Google Drive clients are
+    logged in with the service account once each. The fake drive is shared by every borrower.
+    """
+    global _drive_client_pool # pylint: disable=global-statement
+    with _drive_client_pool_lock:
+        if _drive_client_pool is None:
+            settings = get_settings()
+            if settings.storage_backend == 'gdrive':
+                _drive_client_pool = DriveClientPool(
+                    lambda: GoogleDriveWithChanges(login_with_service_account()), settings.drive_client_pool_size)
+            else:
+                fake_drive = get_fake_drive(settings)
+                _drive_client_pool = DriveClientPool(lambda: fake_drive, size=0)
+        return _drive_client_pool
 
 class GDriveHelper:
-    def __init__(self):
+    def __init__(self, drive=None):
+        """
+        Args:
+            drive (optional): A drive to use instead of the process-wide client pool. It has the pydrive2
+                GoogleDrive interface and is shared by every call, so it must be thread-safe.
+        """
         self.logger = LoggerBase.setup_logger()
-        self.gauth = self._login_with_service_account()
-        self.drive = GoogleDrive(self.gauth)
         self.settings = get_settings()
+        self.client_pool = DriveClientPool(lambda: drive, size=0) if drive else get_drive_client_pool()
+        self.status_sink = StatusSink(self._write_status_to_gfile, self.settings.status_debounce_s)
 
-    def _login_with_service_account(self):
-        try:
-            settings = get_settings()
-            login_settings = {
-                "client_config_backend": "service",
-                "oauth_scope": settings.google_drive_oauth_scopes,
-                "service_config": {
-                    "client_json_file_path":settings.google_service_account_credentials_path
-                }
-            }
-            gauth = GoogleAuth(settings=login_settings)
-            gauth.ServiceAuth()
-        except Exception as e:
-            raise e
-        return gauth
+    @property
+    def gauth(self):
+        """The GoogleAuth of a pooled client (None for the fake drive)."""
+        with self.client_pool.borrow() as drive:
+            return getattr(drive, 'auth', None)
 
     @async_error_handler()
     async def log_status(self) -> None:
@@ -48,32 +115,47 @@ class GDriveHelper:
         if WorkflowTracker.get('mp3_gfile_id'):
             await self.update_transcription_status_in_mp3_gfile()
             able_to_store_state = True
-        log_message = WorkflowTracker.get_model().model_dump_json(indent=4)
+            job_ledger = get_job_ledger()
+            if job_ledger:
+                await job_ledger.record_transition(JobTransition.from_tracker(WorkflowTracker.get_model()))
+        # The indented json is only built if the FLOW record is formatted. stacklevel=3 skips this method and
+        # the async_error_handler wrapper, so the record points at the caller of log_status.
+        self.logger.flow(LazyMessage(self._flow_message, WorkflowTracker.get_model(), able_to_store_state), stacklevel=3)
+
+    @staticmethod
+    def _flow_message(workflow_tracker_model, able_to_store_state: bool) -> str:
+        log_message = workflow_tracker_model.model_dump_json(indent=4)
         state_message = f"\n-------------\nstate stored: {able_to_store_state}"
         # Combine the JSON message with the state storage status
-        full_log_message = f"{log_message}\n{state_message}"
-        self.logger.flow(full_log_message)
+        return f"{log_message}\n{state_message}"
 
     @async_error_handler()
     async def update_transcription_status_in_mp3_gfile(self) -> bool:
-        loop = asyncio.get_running_loop()
-        def _update_transcription_status():
-            gfile_id = WorkflowTracker.get('mp3_gfile_id')
-            if not gfile_id:
-                return False
-            file_to_update = self.drive.CreateFile({'id': gfile_id})
-            transcription_info_json = WorkflowTracker.get_model().model_dump_json()
+        """
+        Hands the current status to the status sink, which writes it to the mp3 gfile's description. Rapid
+        updates are coalesced. Terminal states are written before this returns.
+        """
+        gfile_id = WorkflowTracker.get('mp3_gfile_id')
+        if not gfile_id:
+            await handle_error(error_message='There was no mp3 gfile id in WorkflowTracker.  Status info is stored within the description field of the mp3 file.',operation='update_transcription_status_in_mp3_gfile', raise_exception=False)
+            return True
+        transcription_info_json = WorkflowTracker.get_model().model_dump_json()
+        await self.status_sink.submit(gfile_id, transcription_info_json, WorkflowTracker.get('status'))
+        return True
+
+    def _write_status_to_gfile(self, gfile_id: str, transcription_info_json: str) -> None:
+        with self.client_pool.borrow() as drive:
+            file_to_update = drive.CreateFile({'id': gfile_id})
             # The transcription (workflow) status is placed as a json string within the gfile's description field.
             # This is not ideal, but using labels proved to be way too difficult?
             file_to_update['description'] = transcription_info_json
             file_to_update.Upload()
-            return True
 
-        if not await loop.run_in_executor(None, _update_transcription_status):
-            await handle_error(error_message='There was no mp3 gfile id in WorkflowTracker.  Status info is stored within the description field of the mp3 file.',operation='update_transcription_status_in_mp3_gfile', raise_exception=False)
-        return True
+    async def flush_status(self) -> None:
+        """Writes every status still waiting in the status sink. Call it before shutting down."""
+        await self.status_sink.flush()
     @async_error_handler()
-    async def upload_mp3_to_gdrive(self, mp3_file_path:Path) -> GDriveInput:
+    async def upload_mp3_to_gdrive(self, mp3_file_path:Path, source: Optional[BinaryIO] = None) -> GDriveInput:
         """
         Asynchronously uploads an MP3 file to Google Drive.
 
@@ -83,6 +165,8 @@ class GDriveHelper:
 
         Parameters:
         - input (Path): A pydantic class that verifies the mp3_file_path entry is a valid Path variable.
+        - source (BinaryIO, optional): Read the content from this seekable stream instead of mp3_file_path,
+          for example a TeeReader that writes mp3_file_path while the upload reads it.
 
         Returns:
         - str: The Google Drive file ID of the uploaded MP3 file.
@@ -92,7 +176,7 @@ class GDriveHelper:
         """
         folder_gdrive_id = self.settings.gdrive_mp3_folder_id
         # Returns the gfile id of the mp3 file.
-        gfile_id = await self.upload(GDriveInput(gdrive_id=folder_gdrive_id), mp3_file_path)
+        gfile_id = await self.upload(GDriveInput(gdrive_id=folder_gdrive_id), mp3_file_path, source)
         return gfile_id
 
     @async_error_handler(error_message = 'Could not upload the transcript to a gflie.')
@@ -118,46 +202,126 @@ class GDriveHelper:
         return transcription_gfile_id,txt_filename
 
     @async_error_handler(error_message = 'Could not upload the transcript to gdrive transcript folder.')
-    async def upload(self, folder_gdrive_input:GDriveInput, file_path: Path) -> GDriveInput:
+    async def upload(self, folder_gdrive_input:GDriveInput, file_path: Path, source: Optional[BinaryIO] = None) -> GDriveInput:
+        """
+        Uploads a local file to the gdrive folder in chunks of `upload_chunk_mb` through a resumable upload
+        session. A chunk that fails is retried from the last byte Drive acknowledged. The progress goes into
+        the WorkflowTracker comment as the chunks are acknowledged.
+
+        When `source` is given, the content is read from that seekable stream and `file_path` only names the gfile.
+
+        Returns:
+            str: The gfile id of the uploaded file.
+        """
+        loop = asyncio.get_running_loop()
+        # Progress is reported from the executor thread. The tracker lives in this task's context, so the
+        # progress comes back here through a queue.
+        progress_queue: asyncio.Queue = asyncio.Queue()
+        def _on_progress(bytes_sent: int, total_bytes: int):
+            loop.call_soon_threadsafe(progress_queue.put_nowait, (bytes_sent, total_bytes))
         def _upload():
-            folder_gdrive_id = folder_gdrive_input.gdrive_id
-            gfile = self.drive.CreateFile({'parents': [{'id': folder_gdrive_id}]})
-            gfile.SetContentFile(str(file_path))
             # Set the name to be the same filename as the local filename.
-            gfile['title'] = file_path.name
-            gfile.Upload()
-            if hasattr(gfile, 'content') and gfile.content:
-                gfile.content.close()
+            metadata = {'title': file_path.name, 'parents': [{'id': folder_gdrive_input.gdrive_id}]}
+            with self.client_pool.borrow() as drive:
+                upload = drive.CreateResumableUpload(metadata, file_path if source is None else source, self.settings.upload_chunk_mb * 1024 * 1024)
+                uploaded_metadata = run_resumable_upload(upload, self.settings.upload_max_retries, _on_progress)
             #  TODO: Can remove the local transcript...
-            gfile_input = GDriveInput(gdrive_id=gfile['id'])
+            gfile_input = GDriveInput(gdrive_id=uploaded_metadata['id'])
             gfile_id = gfile_input.gdrive_id
             return gfile_id
-        loop = asyncio.get_running_loop()
-        gfile_id = await loop.run_in_executor(None, _upload)
-        return gfile_id
+        upload_future = asyncio.ensure_future(loop.run_in_executor(None, _upload))
+        while True:
+            next_progress = asyncio.ensure_future(progress_queue.get())
+            done, _ = await asyncio.wait({upload_future, next_progress}, return_when=asyncio.FIRST_COMPLETED)
+            if next_progress not in done:
+                next_progress.cancel()
+                break
+            # Only the latest progress matters when several chunks were acknowledged since the last report.
+            bytes_sent, total_bytes = next_progress.result()
+            while not progress_queue.empty():
+                bytes_sent, total_bytes = progress_queue.get_nowait()
+            await self._report_upload_progress(file_path.name, bytes_sent, total_bytes)
+            if upload_future in done:
+                break
+        return upload_future.result()
+
+    async def _report_upload_progress(self, filename: str, bytes_sent: int, total_bytes: int) -> None:
+        WorkflowTracker.update(comment=f"Uploaded {bytes_sent / 2**20:.1f} of {total_bytes / 2**20:.1f} MB of {filename}.")
+        await update_status()
 
     @async_error_handler(error_message = 'Could not download_from_gdrive.')
     async def download_from_gdrive(self, gdrive_input:GDriveInput, directory_path: Path):
+        """
+        Downloads the gfile into `directory_path`. Files of `ranged_download_threshold_mb` or more are fetched
+        as HTTP Range segments by `ranged_download_workers` threads at once, smaller ones in a single stream.
+        Either way the local file is checked against Drive's md5Checksum, which is recorded in the tracker's
+        mp3_md5_checksum.
+
+        Returns:
+            Path: The local file.
+        """
         loop = asyncio.get_running_loop()
+        megabyte = 1024 * 1024
         def _download():
-            gfile = self.drive.CreateFile({'id': gdrive_input.gdrive_id})
-            gfile.FetchMetadata(fields="title")
-            filename = gfile['title']
-            local_file_path = directory_path / filename
-            gfile.GetContentFile(str(local_file_path))
-            return local_file_path
-
-        local_file_path = await loop.run_in_executor(None, _download)
+            with self.client_pool.borrow() as drive:
+                gfile = drive.CreateFile({'id': gdrive_input.gdrive_id})
+                gfile.FetchMetadata(fields="title,fileSize,md5Checksum")
+                filename = gfile['title']
+                local_file_path = directory_path / filename
+                file_size = int(gfile.get('fileSize') or 0)
+                ranged = file_size >= self.settings.ranged_download_threshold_mb * megabyte
+                if not ranged:
+                    gfile.GetContentFile(str(local_file_path))
+            if ranged:
+                # Each segment borrows its own client, so the segments do not share a connection.
+                def _fetch_range(start: int, end: int) -> bytes:
+                    with self.client_pool.borrow() as segment_drive:
+                        return segment_drive.GetContentRange(gdrive_input.gdrive_id, start, end)
+                download_ranges(_fetch_range, local_file_path, file_size, self.settings.ranged_download_segment_mb * megabyte,
+                                self.settings.ranged_download_workers)
+            verify_md5(local_file_path, gfile.get('md5Checksum'))
+            return local_file_path, gfile.get('md5Checksum')
+
+        local_file_path, md5_checksum = await loop.run_in_executor(None, _download)
+        WorkflowTracker.update(mp3_md5_checksum=md5_checksum)
         return local_file_path
 
+    @async_error_handler(error_message = 'Could not open a download stream for the gfile.')
+    async def open_gdrive_stream(self, gdrive_input: GDriveInput, chunksize: int):
+        """
+        Opens a download stream of the gfile's content instead of saving it to a local file.
+
+        Returns:
+            An iterable of byte chunks of at most `chunksize` bytes. Iterating it downloads the next chunk,
+            so iterate it from a thread rather than the event loop. It holds a pooled Drive client until the
+            last chunk is read, and all its requests are made from the thread iterating it.
+        """
+        def _stream():
+            with self.client_pool.borrow() as drive:
+                gfile = drive.CreateFile({'id': gdrive_input.gdrive_id})
+                yield from gfile.GetContentIOBuffer(chunksize=chunksize)
+        return _stream()
+
+    @async_error_handler(error_message = 'Could not get the md5Checksum of the gfile.')
+    async def get_md5_checksum(self, gfile_input: GDriveInput) -> Optional[str]:
+        """Drive's md5Checksum of the gfile's current content."""
+        loop = asyncio.get_running_loop()
+        def _get_md5_checksum():
+            with self.client_pool.borrow() as drive:
+                file = drive.CreateFile({'id': gfile_input.gdrive_id})
+                file.FetchMetadata(fields='md5Checksum')
+            return file.get('md5Checksum')
+        return await loop.run_in_executor(None, _get_md5_checksum)
+
     @async_error_handler(error_message = 'Could not get the filename of the gfile.')
     async def get_filename(self, gfile_input:GDriveInput) -> str:
         gfile_id = gfile_input.gdrive_id
         loop = asyncio.get_running_loop()
         def _get_filename():
-            file = self.drive.CreateFile({'id': gfile_id})
-            # Fetch the filename from the metadata
-            file.FetchMetadata(fields='title')
+            with self.client_pool.borrow() as drive:
+                file = drive.CreateFile({'id': gfile_id})
+                # Fetch the filename from the metadata
+                file.FetchMetadata(fields='title')
             filename = file['title']
             return filename
         filename = await loop.run_in_executor(None, _get_filename)
@@ -170,52 +334,110 @@ class GDriveHelper:
         loop = asyncio.get_running_loop()
 
         def _get_status_model() -> Union[dict, None]:
-            gfile = self.drive.CreateFile({'id': gfile_id})
-            gfile.FetchMetadata(fields="description")
-            try:
-                transcription_status_json = gfile['description']
-            except KeyError:
-                status_model = StatusModel()
-                transcription_status_json = status_model.model_dump_json()
-                gfile['description'] = transcription_status_json
-                gfile.Upload()
-
-            transcription_status_dict = json.loads(transcription_status_json)
-            try:
-                status_model = StatusModel.model_validate(transcription_status_dict)
-            except ValidationError as e:
-                self.logger.error(f"{e}")
-                status_model = StatusModel(status=WorkflowEnum.NOT_STARTED.name)
-            return status_model
+            with self.client_pool.borrow() as drive:
+                gfile = drive.CreateFile({'id': gfile_id})
+                gfile.FetchMetadata(fields="description")
+                try:
+                    transcription_status_json = gfile['description']
+                except KeyError:
+                    status_model = StatusModel()
+                    transcription_status_json = status_model.model_dump_json()
+                    gfile['description'] = transcription_status_json
+                    gfile.Upload()
+            return self.parse_status_model(transcription_status_json)
 
         transcription_status_dict = await loop.run_in_executor(None, _get_status_model)
         self.logger.debug(f"The transcription status dict is {transcription_status_dict} for gfile_id: {gfile_id}")
         return transcription_status_dict
 
+    def parse_status_model(self, transcription_status_json: Union[str, None]) -> StatusModel:
+        """The StatusModel stored in a gfile description. A missing or unreadable description is NOT_STARTED."""
+        if not transcription_status_json:
+            return StatusModel()
+        try:
+            return StatusModel.model_validate(json.loads(transcription_status_json))
+        except (json.JSONDecodeError, ValidationError) as e:
+            self.logger.error(f"{e}")
+            return StatusModel(status=WorkflowEnum.NOT_STARTED.name)
+
+    def status_model_from_listing(self, gfile) -> StatusModel:
+        """The StatusModel of a gfile returned by list_files_to_transcribe, without another round trip."""
+        return self.parse_status_model(gfile.get('description'))
+
     @async_error_handler(error_message = 'Could not get a list of mp3 files from the GDrive ID.')
     async def list_files_to_transcribe(self, gdrive_folder_id: str) -> list:
+        """
+        Lists the files in the folder in as few API calls as possible: LISTING_PAGE_SIZE files per call, each
+        with the LISTING_FIELDS metadata. The description is included so status_model_from_listing can read
+        each file's status without fetching it again.
+        """
         loop = asyncio.get_running_loop()
         def _get_file_info():
-            # Assuming get_gfile_state is properly defined as an async function
             gfiles_to_transcribe_list = []
             query = f"'{gdrive_folder_id}' in parents and trashed=false"
-            file_list = self.drive.ListFile({'q': query}).GetList()
-            for file in file_list:
-                gfiles_to_transcribe_list.append(file)
+            with self.client_pool.borrow() as drive:
+                file_list = drive.ListFile({'q': query, 'maxResults': LISTING_PAGE_SIZE, 'fields': LISTING_FIELDS})
+                for page in file_list:
+                    gfiles_to_transcribe_list.extend(page)
             return gfiles_to_transcribe_list
         gfiles_to_transcribe_list = await loop.run_in_executor(None, _get_file_info)
         return gfiles_to_transcribe_list
 
+    @async_error_handler(error_message = 'Could not get a start page token for the Drive changes feed.')
+    async def get_changes_start_token(self) -> str:
+        """The page token from which list_changed_files reports changes, i.e. from now on."""
+        loop = asyncio.get_running_loop()
+        def _get_start_page_token():
+            with self.client_pool.borrow() as drive:
+                return drive.GetStartPageToken()
+        return await loop.run_in_executor(None, _get_start_page_token)
+
+    @async_error_handler(error_message = 'Could not list the changes in the GDrive folder.')
+    async def list_changed_files(self, gdrive_folder_id: str, page_token: str) -> Tuple[List[dict], str]:
+        """
+        The files in the folder that were added or modified since `page_token`, read from the Drive changes
+        feed. The cost is proportional to the number of changes, not the size of the folder. Each file has the
+        same metadata as in list_files_to_transcribe, so status_model_from_listing works on it.
+
+        Returns:
+            Tuple[List[dict], str]: The changed files (each one once, trashed and deleted files left out),
+            and the page token to pass next time.
+        """
+        loop = asyncio.get_running_loop()
+        def _list_changes():
+            changed_files = {}
+            next_page_token = page_token
+            while True:
+                with self.client_pool.borrow() as drive:
+                    changes = drive.ListChanges(next_page_token, max_results=LISTING_PAGE_SIZE, fields=CHANGES_FIELDS)
+                for change in changes.get('items', []):
+                    gfile = change.get('file')
+                    in_folder = gfile and any(parent['id'] == gdrive_folder_id for parent in gfile.get('parents', []))
+                    if change.get('deleted') or not in_folder or gfile.get('labels', {}).get('trashed'):
+                        changed_files.pop(change['fileId'], None)
+                    else:
+                        changed_files[change['fileId']] = gfile
+                if 'nextPageToken' not in changes:
+                    return list(changed_files.values()), changes['newStartPageToken']
+                next_page_token = changes['nextPageToken']
+        return await loop.run_in_executor(None, _list_changes)
+
     @async_error_handler(error_message = 'Error attempting to delete and mp3 gfile.')
     async def delete_file(self, file_id: str):
-        file = self.drive.CreateFile({'id': file_id})
-        file.Delete()
+        def _delete():
+            with self.client_pool.borrow() as drive:
+                drive.CreateFile({'id': file_id}).Delete()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, _delete)
 
     @async_error_handler(error_message = 'Error attempting to delete and mp3 gfile.')
     async def reset_status_model(self, gdrive_input:GDriveInput):
         gfile_id = gdrive_input.gdrive_id
-        gfile = self.drive.CreateFile({'id': gfile_id})
-        status_model = StatusModel()
-        status_model_json = status_model.model_dump_json()
-        gfile['description'] = status_model_json
-        gfile.Upload()
+        status_model_json = StatusModel().model_dump_json()
+        def _reset_status_model():
+            with self.client_pool.borrow() as drive:
+                gfile = drive.CreateFile({'id': gfile_id})
+                gfile['description'] = status_model_json
+                gfile.Upload()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, _reset_status_model)
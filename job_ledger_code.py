@@ -0,0 +1,202 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-27
+# Summary: job_ledger_code is a durable local record of every job's workflow transitions. The
+# workflow state otherwise only lives in the in-memory WorkflowTracker and in the gfile
+# description JSON, so after a crash every file would start over from the download. Each
+# log_status appends the job's status, comment and artifacts (the local mp3 path and its
+# SHA-256, the gfile's md5Checksum, the transcript gfile id) to a SQLite table. On restart,
+# prepare_mp3 resumes from the ledger. The download is skipped when MP3_DOWNLOADED was
+# recorded, the local file still has the recorded checksum and the gfile on Drive still has
+# the recorded md5Checksum. The runner also asks the ledger for the jobs that had not finished
+# and queues them again before it looks at the folder.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import asyncio
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from pydantic import BaseModel
+
+from env_settings_code import get_settings
+from logger_code import LoggerBase
+from status_sink_code import TERMINAL_STATUSES
+from transcript_cache_code import hash_file
+from workflow_states_code import WorkflowEnum
+
+class JobTransition(BaseModel):
+    """One recorded status of a job, with the artifacts the job had at that point."""
+    mp3_gfile_id: str
+    status: Optional[str] = None
+    comment: Optional[str] = None
+    local_mp3_path: Optional[str] = None
+    audio_sha256: Optional[str] = None
+    mp3_md5_checksum: Optional[str] = None
+    transcript_gdrive_id: Optional[str] = None
+    recorded_at: float = 0.0
+
+    @classmethod
+    def from_tracker(cls, workflow_model) -> "JobTransition":
+        """The current state of a WorkflowTrackerModel. Read it in the job's context, before any executor hand-off."""
+        return cls(
+            mp3_gfile_id=workflow_model.mp3_gfile_id,
+            status=workflow_model.status,
+            comment=workflow_model.comment,
+            local_mp3_path=str(workflow_model.local_mp3_path) if workflow_model.local_mp3_path else None,
+            audio_sha256=workflow_model.audio_sha256,
+            mp3_md5_checksum=workflow_model.mp3_md5_checksum,
+            transcript_gdrive_id=workflow_model.transcript_gdrive_id,
+            recorded_at=time.time(),
+        )
+
+_COLUMNS = "mp3_gfile_id, status, comment, local_mp3_path, audio_sha256, transcript_gdrive_id, recorded_at, mp3_md5_checksum"
+
+class JobLedger:
+    """
+    An append-only SQLite log of job transitions, keyed by the mp3 gfile id.
+
+    Every operation opens its own connection so the ledger can be used from any executor thread.
+
+    Attributes:
+        db_path (Path): The SQLite database file. It is created on first use.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.logger = LoggerBase.setup_logger('JobLedger')
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS transitions ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " mp3_gfile_id TEXT NOT NULL,"
+                " status TEXT,"
+                " comment TEXT,"
+                " local_mp3_path TEXT,"
+                " audio_sha256 TEXT,"
+                " transcript_gdrive_id TEXT,"
+                " recorded_at REAL NOT NULL,"
+                " mp3_md5_checksum TEXT)"
+            )
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(transitions)")]
+            if 'mp3_md5_checksum' not in columns:
+                # A ledger from before the md5Checksum was recorded. Its downloads are not resumable.
+                connection.execute("ALTER TABLE transitions ADD COLUMN mp3_md5_checksum TEXT")
+            connection.execute("CREATE INDEX IF NOT EXISTS transitions_by_gfile ON transitions (mp3_gfile_id, status)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def record(self, transition: JobTransition) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                f"INSERT INTO transitions ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (transition.mp3_gfile_id, transition.status, transition.comment, transition.local_mp3_path,
+                 transition.audio_sha256, transition.transcript_gdrive_id, transition.recorded_at, transition.mp3_md5_checksum)
+            )
+
+    def history(self, mp3_gfile_id: str) -> List[JobTransition]:
+        """Every transition recorded for the job, oldest first."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT {_COLUMNS} FROM transitions WHERE mp3_gfile_id = ? ORDER BY id", (mp3_gfile_id,)
+            ).fetchall()
+        return [self._to_transition(row) for row in rows]
+
+    def last_transition(self, mp3_gfile_id: str, status: Optional[str] = None) -> Optional[JobTransition]:
+        """The job's most recent transition, or its most recent transition to `status`."""
+        query = f"SELECT {_COLUMNS} FROM transitions WHERE mp3_gfile_id = ?"
+        parameters = [mp3_gfile_id]
+        if status:
+            query += " AND status = ?"
+            parameters.append(status)
+        with self._connect() as connection:
+            row = connection.execute(query + " ORDER BY id DESC LIMIT 1", parameters).fetchone()
+        return self._to_transition(row) if row else None
+
+    def unfinished_jobs(self) -> List[JobTransition]:
+        """The last transition of every job that did not reach a terminal status, oldest job first."""
+        placeholders = ", ".join("?" for _ in TERMINAL_STATUSES)
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT {_COLUMNS} FROM transitions WHERE id IN (SELECT MAX(id) FROM transitions GROUP BY mp3_gfile_id)"
+                f" AND (status IS NULL OR status NOT IN ({placeholders})) ORDER BY id",
+                sorted(TERMINAL_STATUSES)
+            ).fetchall()
+        return [self._to_transition(row) for row in rows]
+
+    def resumable_download(self, mp3_gfile_id: str) -> Optional[JobTransition]:
+        """
+        The MP3_DOWNLOADED transition of the job if its local mp3 can be used instead of downloading again:
+        the file is still there and its SHA-256 is the one recorded. The caller still has to check that the
+        gfile's content on Drive is unchanged, i.e. that its md5Checksum is the transition's mp3_md5_checksum.
+        """
+        transition = self.last_transition(mp3_gfile_id, WorkflowEnum.MP3_DOWNLOADED.name)
+        if not transition or not transition.local_mp3_path or not transition.audio_sha256 or not transition.mp3_md5_checksum:
+            return None
+        local_mp3_path = Path(transition.local_mp3_path)
+        if not local_mp3_path.is_file() or hash_file(local_mp3_path) != transition.audio_sha256:
+            self.logger.debug(f"The mp3 recorded for {mp3_gfile_id} is missing or changed. Downloading it again.")
+            return None
+        return transition
+
+    async def record_transition(self, transition: JobTransition) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.record, transition)
+
+    async def find_resumable_download(self, mp3_gfile_id: str) -> Optional[JobTransition]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.resumable_download, mp3_gfile_id)
+
+    async def find_unfinished_jobs(self) -> List[JobTransition]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.unfinished_jobs)
+
+    @staticmethod
+    def _to_transition(row) -> JobTransition:
+        return JobTransition(**dict(zip([column.strip() for column in _COLUMNS.split(',')], row)))
+
+_job_ledger: Optional[JobLedger] = None
+_job_ledger_lock = threading.Lock()
+
+def get_job_ledger() -> Optional[JobLedger]:
+    """Returns the process-wide JobLedger, or None when `job_ledger_enabled` is off."""
+    global _job_ledger # pylint: disable=global-statement
+    settings = get_settings()
+    if not settings.job_ledger_enabled:
+        return None
+    with _job_ledger_lock:
+        if _job_ledger is None:
+            _job_ledger = JobLedger(settings.job_ledger_path)
+        return _job_ledger
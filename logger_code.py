@@ -1,5 +1,14 @@
+import atexit
+import copy
 import inspect
+import json
 import logging
+import logging.handlers
+import queue
+import random
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
 import colorlog
 
 # Step 1: Define the custom logging level
@@ -9,11 +18,54 @@ logging.addLevelName(FLOW_LEVEL_NUM, "FLOW")
 def flow(self, message, *args, **kwargs):
     # Utility method for logging messages at the custom FLOW level
     if self.isEnabledFor(FLOW_LEVEL_NUM):
+        # One more level so the record points at the caller of flow() rather than at flow() itself.
+        kwargs['stacklevel'] = kwargs.get('stacklevel', 1) + 1
         self._log(FLOW_LEVEL_NUM, message, args, **kwargs) # pylint: disable=protected-access
 
 logging.Logger.flow = flow
+
+# Fields of the JSON log that say which job a record is about. Pass them with `extra=`, for example
+# extra={'stage': 'download', 'duration_s': 3.2}. The queue backend fills in job_id and stage when they are missing.
+JOB_FIELDS = ('job_id', 'stage', 'duration_s')
+_log_context_provider: Optional[Callable[[], dict]] = None
+
+class LazyMessage:
+    """
+    A log message that is only built when a handler formats it, for payloads that are expensive to build
+    (like a WorkflowTracker model dumped as indented json). A record that is filtered out never builds it,
+    and a record that goes to several handlers builds it once.
+    """
+    def __init__(self, build, *args):
+        self.build = build
+        self.args = args
+        self._message = None
+
+    def __str__(self):
+        if self._message is None:
+            self._message = str(self.build(*self.args))
+        return self._message
+
 class CustomFormatter(colorlog.ColoredFormatter):
+    """
+    Adds custom_pathname, custom_lineno and custom_funcname to each record.
+
+    caller_lookup "record" (the default) takes them from the record, where logging already put the caller
+    of the logging call (moved up the stack with the `stacklevel` argument). "stack" walks back 10 frames
+    from the formatter and reads the source line from disk for every record. That is the old behavior and
+    is far slower, keep it for debugging only.
+    """
+    def __init__(self, *args, caller_lookup: str = "record", **kwargs):
+        super().__init__(*args, **kwargs)
+        if caller_lookup not in ("record", "stack"):
+            raise ValueError(f"caller_lookup must be 'record' or 'stack', not {caller_lookup}.")
+        self.caller_lookup = caller_lookup
+
     def format(self, record):
+        if self.caller_lookup == "record":
+            record.custom_pathname = record.pathname
+            record.custom_lineno = record.lineno
+            record.custom_funcname = record.funcName
+            return super(CustomFormatter, self).format(record)
         # Get the stack frame of the caller to the logging call
         f = inspect.currentframe()
         # Go back 2 frames to find the caller
@@ -30,47 +82,185 @@ class CustomFormatter(colorlog.ColoredFormatter):
         # Now format the message with these custom attributes
         return super(CustomFormatter, self).format(record)
 
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one line of JSON: time, level, logger, caller, message, and whichever JOB_FIELDS it has."""
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'caller': f"{record.pathname}:{record.lineno}",
+            'function': record.funcName,
+            'message': record.getMessage(),
+        }
+        for field in JOB_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Formatted by JsonQueueHandler.prepare before the record was queued.
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class JsonQueueHandler(logging.handlers.QueueHandler):
+    """
+    The QueueHandler in front of the JsonFormatter. QueueHandler.prepare formats the record, folding the
+    traceback into the message, and clears exc_info and exc_text, so the JSON line would have no 'exception'.
+    This keeps the message as logged and the formatted traceback in exc_text.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            # Formatted now, as QueueHandler.prepare does, so the queued record does not hold the traceback's frames.
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+def set_log_context_provider(provider: Optional[Callable[[], dict]]) -> None:
+    """
+    Sets the function JobContextFilter calls for the job_id and stage of the job running in the caller's
+    context. workflow_tracker_code sets it, so this module does not import the tracker.
+    """
+    global _log_context_provider # pylint: disable=global-statement
+    _log_context_provider = provider
+
+class JobContextFilter(logging.Filter):
+    """Adds the job_id and stage of the current job to each record that does not already have them (from `extra=`)."""
+    def filter(self, record):
+        context = _log_context_provider() if _log_context_provider else {}
+        for field, value in context.items():
+            if getattr(record, field, None) is None:
+                setattr(record, field, value)
+        return True
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the DEBUG and FLOW records of each logger named in `sample_rates`, for example
+    {"FakeGoogleDrive": 0.01}. Loggers that are not named keep everything, and so do INFO and above.
+    """
+    def __init__(self, sample_rates: Dict[str, float], seed: Optional[int] = None):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self._random = random.Random(seed)
+
+    def filter(self, record):
+        if record.levelno > FLOW_LEVEL_NUM:
+            return True
+        rate = self.sample_rates.get(record.name, 1.0)
+        return rate >= 1.0 or self._random.random() < rate
+
 class LoggerBase:
+    # The queue backend, once configure() has turned it on. All loggers share the one QueueHandler.
+    _queue_handler: Optional[logging.handlers.QueueHandler] = None
+    _listener: Optional[logging.handlers.QueueListener] = None
+    # Every logger set up here, with its caller_lookup, so configure() can switch its handler.
+    _loggers: Dict[str, str] = {}
+    _atexit_registered = False
+
     @staticmethod
-    def setup_logger(name=None,level=logging.DEBUG):
-        """Set up the logger with colorized output."""
+    def setup_logger(name=None,level=logging.DEBUG,caller_lookup="record"):
+        """
+        Set up the logger. With the default "stream" backend it gets colorized output to stderr, with
+        caller_lookup passed to CustomFormatter. With the "queue" backend (see configure) it gets the shared
+        QueueHandler.
+        """
         logger_name = 'TranscriptionLogger' if name is None else name
         logger = logging.getLogger(logger_name)
         logger.setLevel(level)  # Set the logging level
 
         # Check if the logger already has handlers to avoid duplicate messages
         if not logger.handlers:
-            # Define log format
-            log_format = (
-            "%(log_color)s[%(levelname)-3s]%(reset)s "
-            "%(log_color)s%(custom_pathname)s:%(custom_lineno)d%(custom_funcname)s\n"
-            "%(reset)s%(message_log_color)s%(message)s"
-        )
-            # log_format = (
-            # "%(log_color)s[%(levelname)-3s]%(reset)s "
-            # "%(log_color)s%(filename)s:%(lineno)d%(reset)s - "
-            # "%(message_log_color)s%(message)s"
-            # )
-            colors = {
-                'DEBUG': 'green',
-                'INFO': 'yellow',
-                'WARNING': 'purple',
-                'ERROR': 'red',
-                'CRITICAL': 'bold_red',
-                'FLOW': 'cyan',  # Assign a color to the "FLOW" level
-            }
-
-            # Create a stream handler (console output)
-            stream_handler = logging.StreamHandler()
-            stream_handler.setLevel(logging.DEBUG)  # Set the logging level for the handler
-
-            # Apply the colorlog ColoredFormatter to the handler
-            # formatter = colorlog.ColoredFormatter(log_format, log_colors=colors, reset=True,
-            #                                       secondary_log_colors={'message': colors})
-            formatter = CustomFormatter(log_format, log_colors=colors, reset=True,
-                                        secondary_log_colors={'message': colors})
-
-            stream_handler.setFormatter(formatter)
-            logger.addHandler(stream_handler)
+            LoggerBase._loggers[logger_name] = caller_lookup
+            logger.addHandler(LoggerBase._queue_handler or LoggerBase._stream_handler(caller_lookup))
 
         return logger
+
+    @staticmethod
+    def _stream_handler(caller_lookup: str) -> logging.Handler:
+        # Define log format
+        log_format = (
+        "%(log_color)s[%(levelname)-3s]%(reset)s "
+        "%(log_color)s%(custom_pathname)s:%(custom_lineno)d%(custom_funcname)s\n"
+        "%(reset)s%(message_log_color)s%(message)s"
+    )
+        # log_format = (
+        # "%(log_color)s[%(levelname)-3s]%(reset)s "
+        # "%(log_color)s%(filename)s:%(lineno)d%(reset)s - "
+        # "%(message_log_color)s%(message)s"
+        # )
+        colors = {
+            'DEBUG': 'green',
+            'INFO': 'yellow',
+            'WARNING': 'purple',
+            'ERROR': 'red',
+            'CRITICAL': 'bold_red',
+            'FLOW': 'cyan',  # Assign a color to the "FLOW" level
+        }
+
+        # Create a stream handler (console output)
+        stream_handler = logging.StreamHandler()
+        stream_handler.setLevel(logging.DEBUG)  # Set the logging level for the handler
+
+        # Apply the colorlog ColoredFormatter to the handler
+        # formatter = colorlog.ColoredFormatter(log_format, log_colors=colors, reset=True,
+        #                                       secondary_log_colors={'message': colors})
+        formatter = CustomFormatter(log_format, log_colors=colors, reset=True,
+                                    secondary_log_colors={'message': colors}, caller_lookup=caller_lookup)
+
+        stream_handler.setFormatter(formatter)
+        return stream_handler
+
+    @classmethod
+    def configure(cls, settings) -> None:
+        """
+        Picks the log backend from the settings. Call it once at startup, loggers already set up are switched over.
+
+        "stream" (the default) gives each logger its own colorized StreamHandler, which writes to stderr in
+        the thread that logs, so from the event loop too. "queue" gives every logger one QueueHandler: a log
+        call only puts the record on a queue, and a QueueListener thread writes it as a line of JSON to
+        settings.log_json_path (rotated every log_max_mb) or to stderr. The queue backend adds the job_id
+        and stage of the current job to each record and samples DEBUG/FLOW records by log_sample_rates.
+        """
+        if settings.log_backend not in ('stream', 'queue'):
+            raise ValueError(f"log_backend must be 'stream' or 'queue', not {settings.log_backend}.")
+        cls.shutdown()
+        if settings.log_backend == 'queue':
+            if settings.log_json_path:
+                target = logging.handlers.RotatingFileHandler(
+                    settings.log_json_path, maxBytes=settings.log_max_mb * 1024 * 1024,
+                    backupCount=settings.log_backup_count, encoding='utf-8')
+            else:
+                target = logging.StreamHandler()
+            target.setFormatter(JsonFormatter())
+            log_queue = queue.SimpleQueue()
+            cls._queue_handler = JsonQueueHandler(log_queue)
+            # Sample first so dropped records do not pay for the job context.
+            cls._queue_handler.addFilter(SamplingFilter(settings.log_sample_rates))
+            cls._queue_handler.addFilter(JobContextFilter())
+            cls._listener = logging.handlers.QueueListener(log_queue, target, respect_handler_level=True)
+            cls._listener.start()
+            if not cls._atexit_registered:
+                # Write out whatever is still queued when the process exits.
+                atexit.register(cls.shutdown)
+                cls._atexit_registered = True
+        for logger_name, caller_lookup in cls._loggers.items():
+            logger = logging.getLogger(logger_name)
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+            logger.addHandler(cls._queue_handler or cls._stream_handler(caller_lookup))
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """Stops the queue backend's listener after it has written every queued record."""
+        if cls._listener is None:
+            return
+        cls._listener.stop()
+        for handler in cls._listener.handlers:
+            handler.close()
+        cls._listener = None
+        cls._queue_handler = None
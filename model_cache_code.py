@@ -0,0 +1,237 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-02
+# Summary: model_cache_code keeps Hugging Face ASR pipelines loaded in memory so each
+# transcription does not pay the cost of loading the Whisper model again. Pipelines are
+# keyed by (model name, compute type, device, assistant model name). When the estimated memory of the loaded
+# pipelines goes over the configured budget, the least recently used pipeline is dropped.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import gc
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Set, Tuple
+
+from env_settings_code import get_settings
+from logger_code import LoggerBase
+
+ModelKey = Tuple[str, str, int, Optional[str]]
+
+def device_name(device: int) -> str:
+    return "cpu" if device < 0 else f"cuda:{device}"
+
+def default_device() -> int:
+    """The device index the HF pipeline expects: 0 for the first GPU, -1 for the CPU."""
+    import torch # pylint: disable=import-outside-toplevel
+    return 0 if torch.cuda.is_available() else -1
+
+def resolve_compute_type(compute_type: str, device: int) -> str:
+    """
+    The fastest supported precision for the requested compute type (a COMPUTE_TYPE_MAP value) on the device.
+
+    On the CPU, float16 matmuls are emulated and much slower than float32, so half precision becomes
+    float32. int8 dynamic quantization only has CPU kernels, so on a GPU it becomes float16.
+    """
+    if device < 0 and compute_type in ("float16", "bfloat16"):
+        return "float32"
+    if device >= 0 and compute_type == "int8":
+        return "float16"
+    return compute_type
+
+def torch_dtype_for(compute_type: str):
+    """The torch dtype of a compute type, e.g. torch.float16 for "float16" and torch.qint8 for "int8"."""
+    import torch # pylint: disable=import-outside-toplevel
+    return torch.qint8 if compute_type == "int8" else getattr(torch, compute_type)
+
+def quantize_linear_layers(model):
+    """Dynamically quantizes the model's Linear layers to int8. The weights are quantized once, the activations on the fly."""
+    import torch # pylint: disable=import-outside-toplevel
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def _tensor_bytes(value, seen: Set[int]) -> int:
+    # A dynamically quantized Linear keeps its int8 weight and its bias in a (weight, bias) tuple.
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(item, seen) for item in value)
+    if not hasattr(value, 'element_size'):
+        return 0
+    # Tied weights (Whisper's proj_out and embed_tokens) share their storage. Count it once.
+    if value.data_ptr() in seen:
+        return 0
+    seen.add(value.data_ptr())
+    return value.numel() * value.element_size()
+
+def estimate_model_bytes(model, seen: Optional[Set[int]] = None) -> int:
+    """
+    The size of every tensor in the model's state_dict. Unlike parameters() and buffers(), the state_dict
+    includes the packed int8 weights of quantized layers, which are neither.
+    """
+    seen = set() if seen is None else seen
+    return sum(_tensor_bytes(value, seen) for value in model.state_dict().values())
+
+def estimate_pipeline_bytes(pipe) -> int:
+    """Rough memory footprint of a pipeline: the size of its model's tensors, and its assistant model's if it has one."""
+    seen: Set[int] = set()
+    num_bytes = estimate_model_bytes(pipe.model, seen)
+    assistant_model = getattr(pipe, 'assistant_model', None)
+    if assistant_model is not None:
+        num_bytes += estimate_model_bytes(assistant_model, seen)
+    return num_bytes
+
+class ModelCache:
+    """
+    A process-wide registry of loaded ASR pipelines with LRU eviction.
+
+    Loading a Whisper model takes seconds (tens of seconds for large-v2) and allocates gigabytes. The
+    cache loads each (model name, compute type, device, assistant model name) pipeline once and hands the same pipeline back on
+    later calls. The cache is used from executor threads, so all access is guarded by a lock. The
+    lock is held while a model loads so two threads asking for the same model do not both load it.
+
+    Attributes:
+        max_bytes (int): The memory budget. Least recently used pipelines are evicted to stay under it.
+            A single pipeline larger than the budget is still kept, it is just the only one kept.
+        loader (Callable): Builds a pipeline from (model_name, compute_type, device, assistant_model_name).
+            Replaceable for tests.
+        size_estimator (Callable): Returns the number of bytes a loaded pipeline uses.
+    """
+    def __init__(self, max_bytes: int, loader: Optional[Callable] = None, size_estimator: Optional[Callable] = None):
+        self.max_bytes = max_bytes
+        self.loader = loader if loader else self._load_pipeline
+        self.size_estimator = size_estimator if size_estimator else estimate_pipeline_bytes
+        self.logger = LoggerBase.setup_logger('ModelCache')
+        self._pipelines: "OrderedDict[ModelKey, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_name: str, compute_type: str, device: int, assistant_model_name: Optional[str] = None) -> ModelKey:
+        return (model_name, str(compute_type), device, assistant_model_name)
+
+    def get_pipeline(self, model_name: str, compute_type: str, device: Optional[int] = None,
+                     assistant_model_name: Optional[str] = None):
+        """
+        Returns the pipeline for (model_name, compute_type, device, assistant_model_name), loading it on a cache miss.
+
+        Args:
+            model_name (str): Hugging Face model id, one of the values in AUDIO_QUALITY_MAP.
+            compute_type (str): One of the values in COMPUTE_TYPE_MAP, such as "float16" or "int8".
+            device (int, optional): Pipeline device index. Defaults to the GPU if there is one.
+            assistant_model_name (str, optional): Hugging Face model id of the speculative decoding assistant,
+                one of the values in ASSISTANT_MODEL_MAP. None for plain decoding.
+
+        Returns:
+            The loaded Hugging Face automatic-speech-recognition pipeline.
+        """
+        device = default_device() if device is None else device
+        key = self.make_key(model_name, compute_type, device, assistant_model_name)
+        with self._lock:
+            if key in self._pipelines:
+                self._pipelines.move_to_end(key)
+                self.logger.debug(f"Model cache hit for {key}.")
+                return self._pipelines[key][0]
+            self.logger.debug(f"Model cache miss for {key}. Loading the model.")
+            pipe = self.loader(model_name, compute_type, device, assistant_model_name)
+            num_bytes = self.size_estimator(pipe)
+            self._pipelines[key] = (pipe, num_bytes)
+            self._evict(keep=key)
+            return pipe
+
+    def _evict(self, keep: ModelKey) -> None:
+        evicted = False
+        while self.total_bytes() > self.max_bytes and len(self._pipelines) > 1:
+            oldest_key = next(iter(self._pipelines))
+            if oldest_key == keep:
+                break
+            _, num_bytes = self._pipelines.pop(oldest_key)
+            evicted = True
+            self.logger.debug(f"Evicted {oldest_key} ({num_bytes / 1e9:.2f} GB) from the model cache.")
+        if evicted:
+            # Give the memory back now rather than whenever the garbage collector gets to it.
+            gc.collect()
+            # Loading a pipeline imported torch. Do not import it here just to empty the CUDA cache.
+            torch = sys.modules.get('torch')
+            if torch and torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def total_bytes(self) -> int:
+        return sum(num_bytes for _, num_bytes in self._pipelines.values())
+
+    def keys(self):
+        with self._lock:
+            return list(self._pipelines.keys())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pipelines.clear()
+        gc.collect()
+
+    @staticmethod
+    def _load_pipeline(model_name: str, compute_type: str, device: int, assistant_model_name: Optional[str] = None):
+        # torch and transformers take seconds to import, so only the inference stage imports them.
+        import torch # pylint: disable=import-outside-toplevel
+        from transformers import AutoModelForSpeechSeq2Seq, pipeline # pylint: disable=import-outside-toplevel
+        # int8 models are loaded in float32 and quantized after loading.
+        quantize = compute_type == "int8"
+        load_dtype = torch.float32 if quantize else torch_dtype_for(compute_type)
+        if not assistant_model_name:
+            pipe = pipeline(
+                "automatic-speech-recognition",
+                model=model_name,
+                device=device,
+                torch_dtype=load_dtype
+            )
+            if quantize:
+                pipe.model = quantize_linear_layers(pipe.model)
+            return pipe
+        # The assistant drafts a few tokens at a time and the main model checks them all in one forward
+        # pass. The distil models share the tokenizer of the model they were distilled from.
+        assistant_model = AutoModelForSpeechSeq2Seq.from_pretrained(
+            assistant_model_name, torch_dtype=load_dtype, low_cpu_mem_usage=True
+        ).to(device_name(device))
+        if quantize:
+            assistant_model = quantize_linear_layers(assistant_model)
+        pipe = pipeline(
+            "automatic-speech-recognition",
+            model=model_name,
+            device=device,
+            torch_dtype=load_dtype,
+            generate_kwargs={"assistant_model": assistant_model}
+        )
+        if quantize:
+            pipe.model = quantize_linear_layers(pipe.model)
+        # Assisted generation only supports a batch size of 1. See transcribe_with_pipeline.
+        pipe.assistant_model = assistant_model
+        return pipe
+
+_model_cache: Optional[ModelCache] = None
+_model_cache_lock = threading.Lock()
+
+def get_model_cache() -> ModelCache:
+    """Returns the process-wide ModelCache, creating it with the budget from the settings on first use."""
+    global _model_cache # pylint: disable=global-statement
+    with _model_cache_lock:
+        if _model_cache is None:
+            settings = get_settings()
+            _model_cache = ModelCache(max_bytes=int(settings.model_cache_max_gb * 1e9))
+        return _model_cache
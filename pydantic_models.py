@@ -11,6 +11,12 @@ from workflow_states_code import WorkflowEnum
 
 
 
+def is_mp3_header(header: bytes) -> bool:
+    """True when the bytes start like an mp3: an ID3v2 tag, or an MPEG audio frame sync (11 set bits)."""
+    if header[:3] == b'ID3':
+        return True
+    return len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0
+
 # Asynchronous UploadeFile validation function
 async def validate_upload_file(upload_file: UploadFile):
     # Validate file extension
@@ -19,14 +25,20 @@ async def validate_upload_file(upload_file: UploadFile):
     if file_extension not in valid_extensions:
         raise ValueError(f"Invalid file extension. It should be .mp3 but it is {file_extension}.")
 
-    # Validate file size (async operation)
-    await upload_file.seek(0)  # Move to end of file to get size
-    file_size = len(upload_file.file.read()) # read to the end
-    await upload_file.seek(0)  # Reset file pointer to beginning
+    # Validate file size. Seeking to the end measures it without reading the file into memory.
+    upload_file.file.seek(0, os.SEEK_END)
+    file_size = upload_file.file.tell()
     # Define your file size limit here
     min_size = 10_240  # Minimum mp3 size in bytes (10KB)
     if file_size < min_size:
+        upload_file.file.seek(0)
         raise ValueError("File size too small to be a valid MP3 file.")
+    # Validate the content is mp3 by its first bytes.
+    upload_file.file.seek(0)
+    header = upload_file.file.read(3)
+    upload_file.file.seek(0)  # Reset file pointer to beginning
+    if not is_mp3_header(header):
+        raise ValueError("The file does not start with an ID3 tag or an MPEG audio frame, so it is not an MP3 file.")
     # Return the file if all validations pass
     return upload_file
 
@@ -85,6 +97,7 @@ class StatusModel(BaseModel):
     comment: str | None = None
     transcript_gdrive_id: str | None = None
     transcript_gdrive_filename: str | None = None
+    transcript_precision: str | None = None
 
 class YouTubeUrl(BaseModel):
     yt_url: str
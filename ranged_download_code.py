@@ -0,0 +1,113 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-05-01
+# Summary: ranged_download_code downloads large Drive files as several HTTP Range segments
+# at the same time. A single-stream download of a 500 MB recording over a high-latency link
+# takes minutes and leaves most of the bandwidth unused. The local file is preallocated, and
+# each segment is written at its own offset as soon as it arrives. Afterwards the file is
+# checked against the md5Checksum Drive reports.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from logger_code import LoggerBase
+from resumable_upload_code import is_retryable
+from transcript_cache_code import hash_file
+
+# (first byte, last byte) of a segment, inclusive, as in an HTTP Range header.
+Segment = Tuple[int, int]
+# Fetches the bytes of one segment. Called from the download threads.
+FetchRange = Callable[[int, int], bytes]
+
+def plan_segments(total_size: int, segment_size: int) -> List[Segment]:
+    """Splits `total_size` bytes into segments of `segment_size` bytes. The last one can be shorter."""
+    return [(start, min(start + segment_size, total_size) - 1) for start in range(0, total_size, segment_size)]
+
+def preallocate(local_file_path: Path, total_size: int) -> None:
+    """Creates the file at its full size so every segment can be written straight to its offset."""
+    with open(local_file_path, 'wb') as local_file:
+        local_file.truncate(total_size)
+
+def verify_md5(local_file_path: Path, md5_checksum: Optional[str]) -> None:
+    """Raises ValueError when the file does not match Drive's md5Checksum. Google Docs files have none and are not checked."""
+    if not md5_checksum:
+        return
+    local_md5 = hash_file(local_file_path, algorithm='md5')
+    if local_md5 != md5_checksum:
+        raise ValueError(f"The download of {local_file_path.name} is corrupt: its md5 is {local_md5} but Drive has {md5_checksum}.")
+
+def download_ranges(fetch_range: FetchRange, local_file_path: Path, total_size: int, segment_size: int,
+                    max_workers: int, max_retries: int = 3, backoff_s: float = 1.0) -> None:
+    """
+    Downloads the segments of a file with `max_workers` threads into a preallocated local file. Runs
+    synchronously, call it from an executor.
+
+    A segment that fails with a retryable error is fetched again after an exponential backoff, up to
+    `max_retries` times. Any other failure stops the download and is raised.
+    """
+    logger = LoggerBase.setup_logger('ranged_download')
+    preallocate(local_file_path, total_size)
+
+    def _download_segment(segment: Segment) -> None:
+        start, end = segment
+        for attempt in range(max_retries + 1):
+            try:
+                data = fetch_range(start, end)
+                break
+            except Exception as e: # pylint: disable=broad-exception-caught
+                if not is_retryable(e) or attempt == max_retries:
+                    raise
+                delay = backoff_s * 2 ** attempt * (1 + random.random())
+                logger.warning(f"Segment {start}-{end} of {local_file_path.name} failed ({e}). Retry {attempt + 1} of {max_retries} in {delay:.1f} seconds.")
+                time.sleep(delay)
+        if len(data) != end - start + 1:
+            raise ValueError(f"Segment {start}-{end} of {local_file_path.name} returned {len(data)} bytes.")
+        with open(local_file_path, 'r+b') as local_file:
+            local_file.seek(start)
+            local_file.write(data)
+
+    segments = plan_segments(total_size, segment_size)
+    start_time = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ranged-download') as executor:
+            futures = [executor.submit(_download_segment, segment) for segment in segments]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # Segments that have not started yet are not fetched.
+                for future in futures:
+                    future.cancel()
+                raise
+    except BaseException:
+        # A partial file is of no use.
+        local_file_path.unlink(missing_ok=True)
+        raise
+    logger.debug(f"Downloaded {total_size / 2**20:.1f} MB of {local_file_path.name} in {len(segments)} segments "
+                 f"in {time.perf_counter() - start_time:.1f} seconds.")
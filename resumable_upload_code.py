@@ -0,0 +1,233 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-30
+# Summary: resumable_upload_code uploads files to Drive in chunks through a resumable upload
+# session. A single-shot Upload() of a multi-hundred-MB recording that fails near the end
+# has to start again from zero. With a resumable session each chunk is acknowledged by the
+# server. A chunk that fails with a transient error is retried after a backoff, starting
+# from the last acknowledged byte. Progress is reported after every chunk.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import json
+import mimetypes
+import os
+import random
+import socket
+import ssl
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional, Set, Union
+
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
+
+from logger_code import LoggerBase
+
+# Drive wants every chunk but the last to be a multiple of 256 KiB.
+UPLOAD_CHUNK_ALIGNMENT = 256 * 1024
+# HTTP statuses worth retrying. Anything else in the 4xx range will fail again.
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Drive reports quota throttling as a 403 with one of these reasons. It passes after a backoff, unlike other 403s.
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+# Network failures worth retrying. Not every OSError: a missing or unreadable local file fails again.
+TRANSPORT_ERRORS = (ConnectionError, TimeoutError, socket.timeout, ssl.SSLError, httplib2.HttpLib2Error)
+# The upload session is gone (it expired or was never created). The upload has to start again.
+SESSION_EXPIRED_STATUS_CODES = {404, 410}
+
+ProgressCallback = Callable[[int, int], None]
+# What an upload reads its content from: a local file, or a seekable binary stream such as a TeeReader.
+UploadSource = Union[Path, BinaryIO]
+
+def aligned_chunk_size(chunk_size: int) -> int:
+    """`chunk_size` rounded up to a multiple of UPLOAD_CHUNK_ALIGNMENT."""
+    return max(1, -(-chunk_size // UPLOAD_CHUNK_ALIGNMENT)) * UPLOAD_CHUNK_ALIGNMENT
+
+def is_session_expired(error: BaseException) -> bool:
+    return isinstance(error, HttpError) and error.resp.status in SESSION_EXPIRED_STATUS_CODES
+
+def error_reasons(error: HttpError) -> Set[str]:
+    """The reason of each error in a Drive error response, e.g. 'rateLimitExceeded'. Empty when the content is not a Drive error."""
+    try:
+        content = json.loads(error.content.decode('utf-8'))
+        return {detail.get('reason') for detail in content['error']['errors']}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return set()
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    TRANSPORT_ERRORS, the fake drive's FakeDriveApiError, the HTTP statuses in RETRYABLE_STATUS_CODES and 403s
+    that are rate limits (RATE_LIMIT_REASONS).
+    """
+    # fake_drive_code imports this module.
+    from fake_drive_code import FakeDriveApiError # pylint: disable=import-outside-toplevel
+    if isinstance(error, HttpError):
+        if error.resp.status == 403:
+            return bool(error_reasons(error) & RATE_LIMIT_REASONS)
+        return error.resp.status in RETRYABLE_STATUS_CODES
+    return isinstance(error, TRANSPORT_ERRORS + (FakeDriveApiError,))
+
+def source_size(source: UploadSource) -> int:
+    """The size in bytes of an upload source, found without reading it."""
+    if isinstance(source, (str, Path)):
+        return Path(source).stat().st_size
+    position = source.tell()
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(position)
+    return size
+
+def source_mimetype(metadata: dict) -> str:
+    return mimetypes.guess_type(metadata.get('title', ''))[0] or 'application/octet-stream'
+
+class TeeReader:
+    """
+    A seekable binary stream over `source` that copies each byte to `sink` and `digest` the first time it is
+    read. An upload that reads its chunks from a TeeReader also writes the local copy and computes the hash,
+    so the source is only read once. Bytes read again when a failed chunk is resent are not copied twice.
+
+    Attributes:
+        copied (int): Bytes copied to the sink so far, always from the start of the source.
+    """
+    def __init__(self, source: BinaryIO, sink: BinaryIO, digest):
+        self.source = source
+        self.sink = sink
+        self.digest = digest
+        self.copied = 0
+
+    def read(self, size: int = -1) -> bytes:
+        position = self.source.tell()
+        if position > self.copied:
+            raise IOError(f"A read at byte {position} would skip bytes {self.copied} to {position - 1} of the copy.")
+        data = self.source.read(size)
+        new_data = data[self.copied - position:]
+        if new_data:
+            self.sink.write(new_data)
+            self.digest.update(new_data)
+            self.copied += len(new_data)
+        return data
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self.source.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.source.tell()
+
+    def seekable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def copy_rest(self, chunk_size: int = UPLOAD_CHUNK_ALIGNMENT) -> None:
+        """Copies whatever the upload did not read, so the sink and digest always cover the whole source."""
+        self.source.seek(self.copied)
+        for _ in iter(lambda: self.read(chunk_size), b''):
+            pass
+
+class DriveResumableUpload:
+    """
+    A resumable upload of a local file or a seekable stream to a new Drive file, made with the Drive v2 API
+    that pydrive2 uses. FakeGoogleDrive.CreateResumableUpload returns an object with the same interface.
+
+    Create it and use it in the same thread. googleapiclient remembers the session uri, and after a failed
+    chunk its next_chunk() asks the server how many bytes arrived before it sends more.
+
+    Attributes:
+        total_size (int): The size of the file in bytes.
+        resumable_progress (int): Bytes the server has acknowledged.
+    """
+    def __init__(self, auth, metadata: dict, source: UploadSource, chunk_size: int):
+        self.auth = auth
+        self.metadata = metadata
+        self.source = source
+        self.chunk_size = aligned_chunk_size(chunk_size)
+        self.total_size = source_size(source)
+        self.resumable_progress = 0
+        self._http = auth.Get_Http_Object()
+        self._request = None
+
+    def restart(self) -> None:
+        """Starts a new upload session from byte 0."""
+        mimetype = source_mimetype(self.metadata)
+        if isinstance(self.source, (str, Path)):
+            media = MediaFileUpload(str(self.source), mimetype=mimetype, chunksize=self.chunk_size, resumable=True)
+        else:
+            media = MediaIoBaseUpload(self.source, mimetype=mimetype, chunksize=self.chunk_size, resumable=True)
+        self._request = self.auth.service.files().insert(body=self.metadata, media_body=media)
+        self.resumable_progress = 0
+
+    def next_chunk(self) -> Optional[dict]:
+        """Sends the next chunk. Returns the new file's metadata once the last chunk is acknowledged, else None."""
+        if self._request is None:
+            self.restart()
+        status, response = self._request.next_chunk(http=self._http)
+        if response is not None:
+            self.resumable_progress = self.total_size
+            return response
+        self.resumable_progress = status.resumable_progress
+        return None
+
+def run_resumable_upload(upload, max_retries: int, on_progress: Optional[ProgressCallback] = None,
+                         backoff_s: float = 1.0) -> dict:
+    """
+    Sends the chunks of a resumable upload until the server has the whole file. Runs synchronously, call it
+    from an executor.
+
+    A chunk that fails with a retryable error is sent again after an exponential backoff with jitter, and
+    the upload carries on from the last acknowledged byte. An expired session starts the upload again.
+    The upload gives up after `max_retries` failures in a row.
+
+    Args:
+        upload: A DriveResumableUpload, or the FakeGoogleDrive equivalent.
+        max_retries (int): Failures in a row before the last error is raised.
+        on_progress (ProgressCallback, optional): Called with (bytes acknowledged, total bytes) after each chunk.
+        backoff_s (float): The wait after the first failure. It doubles with each failure in a row.
+
+    Returns:
+        dict: The metadata of the uploaded file.
+    """
+    logger = LoggerBase.setup_logger('resumable_upload')
+    failures = 0
+    while True:
+        try:
+            response = upload.next_chunk()
+        except Exception as e: # pylint: disable=broad-exception-caught
+            expired = is_session_expired(e)
+            if not (expired or is_retryable(e)) or failures >= max_retries:
+                raise
+            failures += 1
+            if expired:
+                upload.restart()
+            delay = backoff_s * 2 ** (failures - 1) * (1 + random.random())
+            logger.warning(f"Upload chunk failed at byte {upload.resumable_progress} of {upload.total_size} ({e}). "
+                           f"Retry {failures} of {max_retries} in {delay:.1f} seconds.")
+            time.sleep(delay)
+            continue
+        failures = 0
+        if on_progress:
+            on_progress(upload.resumable_progress, upload.total_size)
+        if response is not None:
+            return response
@@ -0,0 +1,116 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-24
+# Summary: status_sink_code debounces and coalesces the status writes to the mp3 gfile
+# description. Every log_status used to do a full metadata Upload() round trip, five to
+# eight blocking Drive writes per file. Now the latest status of each gfile waits in the
+# StatusSink for a short debounce interval. Updates that arrive during the interval replace
+# it, and only the last one is written. Terminal states are written straight away so
+# anything watching the description sees the final state without delay.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import asyncio
+from typing import Callable, Dict, Optional
+
+from logger_code import LoggerBase
+from workflow_error_code import handle_error
+from workflow_states_code import WorkflowEnum
+
+# Written as soon as they are submitted.
+TERMINAL_STATUSES = frozenset({
+    WorkflowEnum.TRANSCRIPTION_UPLOAD_COMPLETE.name,
+    WorkflowEnum.TRANSCRIPTION_FAILED.name,
+    WorkflowEnum.ERROR.name,
+})
+
+class StatusSink:
+    """
+    Coalesces the status writes of each gfile and writes only the latest status.
+
+    The first non-terminal status submitted for a gfile starts a debounce timer. When it fires, whatever
+    status is pending then is written. A terminal status, or a flush(), writes the pending status right
+    away. The writes of one gfile never overlap and are done in the order they were submitted.
+
+    Attributes:
+        write_status (Callable[[str, str], None]): Writes (gfile_id, status_json) to the drive. It blocks,
+            so it is run in the executor.
+        debounce_s (float): How long a non-terminal status waits for a newer one. 0 writes every status.
+    """
+    def __init__(self, write_status: Callable[[str, str], None], debounce_s: float):
+        self.write_status = write_status
+        self.debounce_s = debounce_s
+        self.logger = LoggerBase.setup_logger('StatusSink')
+        self.writes = 0
+        self.coalesced = 0
+        self._pending: Dict[str, str] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def submit(self, gfile_id: str, status_json: str, status: Optional[str]) -> None:
+        """Sets the status to write for the gfile. Waits for the write only when the status is terminal."""
+        if gfile_id in self._pending:
+            self.coalesced += 1
+        self._pending[gfile_id] = status_json
+        if status in TERMINAL_STATUSES or self.debounce_s <= 0:
+            await self.flush(gfile_id)
+        elif gfile_id not in self._timers:
+            self._timers[gfile_id] = asyncio.create_task(self._flush_later(gfile_id))
+
+    async def flush(self, gfile_id: Optional[str] = None) -> None:
+        """Writes the pending status of the gfile now, or of every gfile. Call it before shutting down."""
+        gfile_ids = [gfile_id] if gfile_id else list(self._pending)
+        for pending_gfile_id in gfile_ids:
+            timer = self._timers.pop(pending_gfile_id, None)
+            if timer:
+                timer.cancel()
+            await self._write(pending_gfile_id)
+
+    async def _flush_later(self, gfile_id: str) -> None:
+        await asyncio.sleep(self.debounce_s)
+        # Past this point flush() no longer cancels this task, so a write is never cut off half way.
+        self._timers.pop(gfile_id, None)
+        try:
+            await self._write(gfile_id)
+        except Exception as e: # pylint: disable=broad-exception-caught
+            # Nothing awaits this task, so log the error here. The status stays pending for the next write.
+            await handle_error(error_message=f"Could not write the status of gfile {gfile_id}: {e}",
+                               operation='StatusSink._flush_later', raise_exception=False)
+
+    async def _write(self, gfile_id: str) -> None:
+        lock = self._locks.setdefault(gfile_id, asyncio.Lock())
+        async with lock:
+            status_json = self._pending.pop(gfile_id, None)
+            if status_json is None:
+                return
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self.write_status, gfile_id, status_json)
+            except BaseException:
+                # Keep the status for the next attempt unless a newer one arrived in the meantime.
+                self._pending.setdefault(gfile_id, status_json)
+                raise
+            self.writes += 1
+            if gfile_id not in self._pending:
+                del self._locks[gfile_id]
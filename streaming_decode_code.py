@@ -0,0 +1,317 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-15
+# Summary: streaming_decode_code decodes mp3 bytes as they arrive, straight into a 16 kHz
+# mono float32 ring buffer, and feeds the model one window of audio at a time. The mp3 does
+# not need to be written to local_mp3_dir and read back by the pipeline. Inference also starts
+# as soon as the first windows are decoded instead of after the whole download. ffmpeg does
+# the decoding in a subprocess. One thread feeds it the mp3 bytes and another reads the
+# samples into the ring buffer. An uploaded mp3 is decoded from the bytes its GDrive upload
+# reads (a TeeReader into a ByteChunkQueue), so the upload is only read once.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import queue
+import subprocess
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from vad_code import SAMPLING_RATE, frame_energies_db, pipeline_batch_size
+
+# Bytes of mp3 read from a local file at a time.
+FILE_READ_CHUNK_SIZE = 1024 * 1024
+# Bytes of float32 samples read from ffmpeg at a time.
+_DECODER_READ_SIZE = 4 * SAMPLING_RATE
+
+class AudioRingBuffer:
+    """
+    A fixed-size, thread-safe ring buffer of float32 samples between the decoder and the model.
+
+    The decoder thread writes samples and blocks while the buffer is full. This keeps memory bounded no
+    matter how far ahead the download is. The reader peeks at a window, then consumes the part it used.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buffer = np.zeros(capacity, dtype=np.float32)
+        self._read_index = 0
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def write(self, samples: np.ndarray) -> None:
+        samples = np.asarray(samples, dtype=np.float32)
+        while len(samples):
+            with self._condition:
+                self._condition.wait_for(lambda: self._size < self.capacity or self._closed)
+                if self._closed:
+                    return
+                count = min(len(samples), self.capacity - self._size)
+                write_index = (self._read_index + self._size) % self.capacity
+                first_part = min(count, self.capacity - write_index)
+                self._buffer[write_index:write_index + first_part] = samples[:first_part]
+                self._buffer[:count - first_part] = samples[first_part:count]
+                self._size += count
+                self._condition.notify_all()
+            samples = samples[count:]
+
+    def close(self) -> None:
+        """No more samples are coming. Readers get whatever is left."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def peek(self, num_samples: int) -> np.ndarray:
+        """
+        Returns a copy of the next `num_samples` samples without consuming them. Waits until that many
+        samples are buffered. Returns fewer only when the buffer is closed.
+        """
+        num_samples = min(num_samples, self.capacity)
+        with self._condition:
+            self._condition.wait_for(lambda: self._size >= num_samples or self._closed)
+            count = min(num_samples, self._size)
+            indices = (self._read_index + np.arange(count)) % self.capacity
+            return self._buffer[indices]
+
+    def consume(self, num_samples: int) -> None:
+        with self._condition:
+            num_samples = min(num_samples, self._size)
+            self._read_index = (self._read_index + num_samples) % self.capacity
+            self._size -= num_samples
+            self._condition.notify_all()
+
+def quietest_cut(window: np.ndarray, search_samples: int, frame_length: int = SAMPLING_RATE * 30 // 1000) -> int:
+    """
+    Where to end a window: the middle of the quietest frame in its last `search_samples` samples. Cutting
+    in a pause rather than at a fixed length keeps words from being split between two windows.
+    """
+    search_start = max(0, len(window) - search_samples)
+    energies = frame_energies_db(window[search_start:], frame_length)
+    if len(energies) == 0:
+        return len(window)
+    return search_start + int(np.argmin(energies)) * frame_length + frame_length // 2
+
+def iter_windows(ring: AudioRingBuffer, window_samples: int, search_samples: int) -> Iterator[Tuple[int, np.ndarray]]:
+    """Yields (start sample, samples) of each window as soon as the ring buffer holds a full window."""
+    offset = 0
+    while True:
+        window = ring.peek(window_samples)
+        if len(window) == 0:
+            return
+        cut = len(window) if len(window) < window_samples else quietest_cut(window, search_samples)
+        yield offset, window[:cut]
+        ring.consume(cut)
+        offset += cut
+
+class StreamingAudioDecoder:
+    """
+    Decodes a stream of mp3 bytes into an AudioRingBuffer with an ffmpeg subprocess.
+
+    Attributes:
+        byte_chunks (Iterable[bytes]): The mp3 bytes, for example a GDrive download stream. It is
+            iterated in the feeder thread.
+        ring (AudioRingBuffer): Where the decoded 16 kHz mono float32 samples go.
+    """
+    def __init__(self, byte_chunks: Iterable[bytes], ring: AudioRingBuffer, sampling_rate: int = SAMPLING_RATE):
+        self.byte_chunks = byte_chunks
+        self.ring = ring
+        self.sampling_rate = sampling_rate
+        self._process: Optional[subprocess.Popen] = None
+        self._threads: List[threading.Thread] = []
+        self._error: Optional[BaseException] = None
+
+    def start(self) -> None:
+        command = ['ffmpeg', '-loglevel', 'quiet', '-i', 'pipe:0', '-ac', '1', '-ar', str(self.sampling_rate), '-f', 'f32le', 'pipe:1']
+        try:
+            self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except FileNotFoundError as e:
+            raise ValueError("ffmpeg was not found but is required to decode the audio stream.") from e
+        self._threads = [
+            threading.Thread(target=self._feed, name='mp3-feeder', daemon=True),
+            threading.Thread(target=self._read, name='pcm-reader', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def join(self) -> None:
+        """Waits for the decoder to finish and raises the error that stopped it, if any."""
+        for thread in self._threads:
+            thread.join()
+        if self._process:
+            self._process.wait()
+        if self._error:
+            raise self._error
+
+    def stop(self) -> None:
+        """Stops decoding early, for example when inference failed."""
+        self.ring.close()
+        if self._process:
+            self._process.kill()
+        for thread in self._threads:
+            thread.join()
+
+    def _feed(self) -> None:
+        try:
+            for chunk in self.byte_chunks:
+                self._process.stdin.write(chunk)
+        except BaseException as e: # pylint: disable=broad-exception-caught
+            self._error = e
+            self._process.kill()
+        finally:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+
+    def _read(self) -> None:
+        leftover = b''
+        try:
+            while True:
+                data = self._process.stdout.read(_DECODER_READ_SIZE)
+                if not data:
+                    break
+                data = leftover + data
+                # A read can end part way through a sample. Keep the partial sample for the next read.
+                usable = len(data) - len(data) % 4
+                leftover = data[usable:]
+                self.ring.write(np.frombuffer(data[:usable], dtype=np.float32))
+        except BaseException as e: # pylint: disable=broad-exception-caught
+            self._error = self._error or e
+        finally:
+            self.ring.close()
+
+class ByteChunkQueue:
+    """
+    A sink for a TeeReader whose bytes are iterated as chunks in another thread, for example by the
+    decoder's feeder thread. Iterating blocks until the next chunk is written and ends when the queue is closed.
+    """
+    def __init__(self):
+        self._chunks: "queue.Queue[Union[bytes, BaseException, None]]" = queue.Queue()
+
+    def write(self, data: bytes) -> int:
+        self._chunks.put(bytes(data))
+        return len(data)
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        """No more bytes are coming. With `error`, the iteration raises it instead of ending."""
+        self._chunks.put(error)
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            chunk = self._chunks.get()
+            if isinstance(chunk, BaseException):
+                raise chunk
+            if chunk is None:
+                return
+            yield chunk
+
+def counted_byte_chunks(byte_chunks: Iterable[bytes], on_chunk: Callable[[int], None]) -> Iterator[bytes]:
+    """Passes the chunks through and calls `on_chunk` with the number of bytes so far after each one."""
+    bytes_read = 0
+    for chunk in byte_chunks:
+        bytes_read += len(chunk)
+        on_chunk(bytes_read)
+        yield chunk
+
+def transcribe_byte_stream(pipe, byte_chunks: Iterable[bytes], batch_size: int, chunk_length_s: int = 30, search_s: int = 5) -> str:
+    """
+    Transcribes mp3 bytes while they are still arriving. Runs synchronously, call it from an executor.
+
+    The samples are cut into windows of at most `chunk_length_s` seconds, each ending in the quietest
+    moment of its last `search_s` seconds. Every `batch_size` windows go through the pipeline together.
+
+    Returns:
+        str: The transcript.
+    """
+    batch_size = pipeline_batch_size(pipe, batch_size)
+    window_samples = chunk_length_s * SAMPLING_RATE
+    ring = AudioRingBuffer(capacity=2 * window_samples)
+    decoder = StreamingAudioDecoder(byte_chunks, ring)
+    decoder.start()
+    texts: List[str] = []
+    batch: List[dict] = []
+    def _run_batch():
+        outputs = pipe(batch, batch_size=batch_size, return_timestamps=False)
+        texts.extend(output['text'].strip() for output in outputs)
+        batch.clear()
+    try:
+        for _, window in iter_windows(ring, window_samples, search_s * SAMPLING_RATE):
+            batch.append({"raw": window, "sampling_rate": SAMPLING_RATE})
+            if len(batch) == batch_size:
+                _run_batch()
+        if batch:
+            _run_batch()
+    except BaseException:
+        decoder.stop()
+        raise
+    decoder.join()
+    return " ".join(text for text in texts if text)
+
+def file_byte_chunks(audio_filename: str, chunk_size: int = FILE_READ_CHUNK_SIZE) -> Iterator[bytes]:
+    """The bytes of a local audio file in fixed-size chunks."""
+    with open(audio_filename, 'rb') as audio_file:
+        yield from iter(lambda: audio_file.read(chunk_size), b'')
+
+def probe_duration_seconds(audio_filename: str) -> Optional[float]:
+    """The duration of an audio file according to ffprobe, or None when it cannot be found."""
+    command = ['ffprobe', '-v', 'quiet', '-show_entries', 'format=duration', '-of', 'csv=p=0', audio_filename]
+    try:
+        output = subprocess.run(command, capture_output=True, check=True, text=True).stdout
+        return float(output.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+def iter_transcribed_windows(pipe, byte_chunks: Iterable[bytes], chunk_length_s: int = 30, search_s: int = 5) -> Iterator[dict]:
+    """
+    Transcribes mp3 bytes one window at a time and yields each window's result as soon as it is done.
+
+    Yields:
+        dict: 'text' of the window, its 'timestamp' (start, end) in seconds from the start of the
+        audio, and the pipeline's timestamped 'chunks' on the same timeline.
+    """
+    window_samples = chunk_length_s * SAMPLING_RATE
+    ring = AudioRingBuffer(capacity=2 * window_samples)
+    decoder = StreamingAudioDecoder(byte_chunks, ring)
+    decoder.start()
+    try:
+        for offset, window in iter_windows(ring, window_samples, search_s * SAMPLING_RATE):
+            output = pipe({"raw": window, "sampling_rate": SAMPLING_RATE}, return_timestamps=True)
+            window_start = offset / SAMPLING_RATE
+            chunks = []
+            for chunk in output.get('chunks', []):
+                start, end = chunk['timestamp']
+                chunks.append({**chunk, 'timestamp': (
+                    None if start is None else window_start + start,
+                    None if end is None else window_start + end)})
+            yield {
+                'text': output['text'].strip(),
+                'timestamp': (window_start, (offset + len(window)) / SAMPLING_RATE),
+                'chunks': chunks,
+            }
+    except BaseException:
+        # Also runs when the consumer stops early and the generator is closed.
+        decoder.stop()
+        raise
+    decoder.join()
@@ -0,0 +1,29 @@
+import pytest
+
+from env_settings_code import reload_settings
+
+# The settings with no default, so Settings can be built without a .env file.
+REQUIRED_SETTINGS = {
+    'GDRIVE_MP3_FOLDER_ID': 'mp3-folder',
+    'GDRIVE_TRANSCRIPTS_FOLDER_ID': 'transcripts-folder',
+    'AUDIO_QUALITY_DEFAULT': 'medium',
+    'COMPUTE_TYPE_DEFAULT': 'float16',
+    'GOOGLE_SERVICE_ACCOUNT_CREDENTIALS_PATH': 'service_account.json',
+    'GOOGLE_DRIVE_OAUTH_SCOPES': '["https://www.googleapis.com/auth/drive"]',
+    'LOCAL_MP3_DIR': 'local_mp3s',
+    'LOCAL_TRANSCRIPT_DIR': 'local_transcripts',
+}
+
+@pytest.fixture
+def environment(monkeypatch):
+    """Sets REQUIRED_SETTINGS in the environment and reloads the settings. Yields the monkeypatch for more variables."""
+    for name, value in REQUIRED_SETTINGS.items():
+        monkeypatch.setenv(name, value)
+    reload_settings()
+    yield monkeypatch
+    monkeypatch.undo()
+    try:
+        reload_settings()
+    except ValueError:
+        # No .env here. The next get_settings() tries again.
+        pass
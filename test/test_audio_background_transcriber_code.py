@@ -0,0 +1,83 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from audio_background_transcriber_code import WatchedJobs, watch
+from job_ledger_code import JobTransition
+from workflow_states_code import WorkflowEnum
+
+MP3_FILE = {'id': "mp3_gdrive_id_000_abcdefghijklmn", 'md5Checksum': "md5-a"}
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def job_with_status(status):
+    job = MagicMock()
+    job.workflow_model.status = status
+    return job
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def watched(clock):
+    return WatchedJobs(max_retries=2, backoff_s=10.0, clock=clock)
+
+def test_uploaded_file_is_submitted_again_only_when_its_content_changes(watched):
+    assert watched.should_submit(MP3_FILE)
+    job = job_with_status(WorkflowEnum.TRANSCRIBING.name)
+    watched.submitted(MP3_FILE, job)
+    assert not watched.should_submit({**MP3_FILE, 'md5Checksum': "md5-b"})
+    job.workflow_model.status = WorkflowEnum.TRANSCRIPTION_UPLOAD_COMPLETE.name
+    assert not watched.should_submit(MP3_FILE)
+    assert watched.should_submit({**MP3_FILE, 'md5Checksum': "md5-b"})
+
+@pytest.mark.parametrize("status", [WorkflowEnum.ERROR.name, WorkflowEnum.TRANSCRIPTION_FAILED.name])
+def test_failed_file_is_retried_with_backoff_up_to_max_retries(watched, clock, status):
+    for backoff_s in (10.0, 20.0):
+        watched.submitted(MP3_FILE, job_with_status(status))
+        assert watched.retries_due() == []
+        clock.now += backoff_s - 1
+        assert watched.retries_due() == []
+        clock.now += 1
+        assert watched.retries_due() == [MP3_FILE]
+    # The retries are used up until the content changes.
+    watched.submitted(MP3_FILE, job_with_status(status))
+    clock.now += 1000
+    assert watched.retries_due() == []
+    assert watched.should_submit({**MP3_FILE, 'md5Checksum': "md5-b"})
+
+@pytest.mark.asyncio
+async def test_restart_with_a_saved_token_queues_the_unfinished_files_again(mocker, tmp_path):
+    token_path = tmp_path / "changes_token"
+    token_path.write_text("saved-token", encoding='utf-8')
+    mocker.patch('audio_background_transcriber_code.get_settings', return_value=MagicMock(
+        changes_token_path=str(token_path), watch_poll_interval_s=1.0, watch_max_retries=2, watch_retry_backoff_s=10.0))
+    in_flight_file = {'id': "mp3_gdrive_id_001_abcdefghijklmn", 'md5Checksum': "md5-a"}
+    gh = MagicMock()
+    gh.list_files_to_transcribe = AsyncMock(return_value=[MP3_FILE, in_flight_file])
+    gh.status_model_from_listing.return_value = MagicMock(status=WorkflowEnum.TRANSCRIBING.name)
+    # Cancels the watcher at its first poll.
+    gh.list_changed_files = AsyncMock(side_effect=asyncio.CancelledError)
+    mocker.patch('audio_background_transcriber_code.GDriveHelper', return_value=gh)
+    ledger = MagicMock()
+    ledger.find_unfinished_jobs = AsyncMock(return_value=[
+        JobTransition(mp3_gfile_id=in_flight_file['id'], status=WorkflowEnum.TRANSCRIBING.name)])
+    mocker.patch('audio_background_transcriber_code.get_job_ledger', return_value=ledger)
+    pipeline = MagicMock()
+    pipeline.submit = AsyncMock(side_effect=lambda gdrive_id, **kwargs: job_with_status(WorkflowEnum.START.name))
+    pipeline.stop = AsyncMock()
+    mocker.patch('audio_background_transcriber_code.TranscriptionPipeline', return_value=pipeline)
+
+    with pytest.raises(asyncio.CancelledError):
+        await watch()
+
+    submitted = [call.args[0] for call in pipeline.submit.await_args_list]
+    assert sorted(submitted) == sorted([MP3_FILE['id'], in_flight_file['id']])
+    gh.list_changed_files.assert_awaited_once_with(mocker.ANY, "saved-token")
@@ -0,0 +1,163 @@
+import hashlib
+import io
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from audio_transcriber_code import AudioTranscriber
+from fake_drive_code import FakeGoogleDrive
+from gdrive_helper_code import GDriveHelper
+from fastapi import UploadFile
+
+from job_ledger_code import JobLedger
+from pydantic_models import GDriveInput
+from workflow_states_code import WorkflowEnum
+from workflow_tracker_code import WorkflowTracker, WorkflowTrackerModel
+
+MP3_FOLDER_ID = "mp3_folder_id_abcdefghijklmnop"
+
+WINDOWS = [
+    {'text': "first window", 'timestamp': (0.0, 30.0), 'chunks': []},
+    {'text': "second window", 'timestamp': (30.0, 55.0), 'chunks': []},
+    {'text': "last window", 'timestamp': (55.0, 60.0), 'chunks': []},
+]
+
+@pytest.fixture
+def transcriber(mocker, tmp_path):
+    mocker.patch('audio_transcriber_code.get_settings', return_value=MagicMock(
+        local_transcript_dir=str(tmp_path / "transcripts"), transcript_cache_enabled=False))
+    gh = MagicMock()
+    gh.log_status = AsyncMock()
+    gh.flush_status = AsyncMock()
+    mocker.patch('audio_transcriber_code.GDriveHelper', return_value=gh)
+    mocker.patch('audio_transcriber_code.probe_duration_seconds', return_value=60.0)
+    mocker.patch('audio_transcriber_code.get_model_cache')
+    transcriber = AudioTranscriber()
+    mocker.patch.object(transcriber, 'resolve_model_and_compute_type', return_value=("openai/whisper-tiny", "float32"))
+    mp3_path = tmp_path / "lecture.mp3"
+    mp3_path.write_bytes(b"ID3" + bytes(2048))
+    WorkflowTracker.set_model(WorkflowTrackerModel(local_mp3_path=mp3_path))
+    return transcriber
+
+@pytest.fixture
+def decoder(mocker):
+    """A fake iter_transcribed_windows. decoder['closed'] is set when the window iterator is closed."""
+    state = {'closed': False}
+    def iter_transcribed_windows(pipe, byte_chunks):
+        try:
+            for window in WINDOWS:
+                yield dict(window)
+        finally:
+            state['closed'] = True
+    mocker.patch('audio_transcriber_code.iter_transcribed_windows', side_effect=iter_transcribed_windows)
+    mocker.patch('audio_transcriber_code.file_byte_chunks')
+    return state
+
+@pytest.mark.asyncio
+async def test_transcribe_stream_yields_each_window_and_flushes_the_text(transcriber, decoder, tmp_path):
+    transcript_path = tmp_path / "transcripts" / "lecture.txt"
+    results = []
+    async for result in transcriber.transcribe_stream():
+        results.append(result)
+        # The text so far is on disk before the generator finishes.
+        assert transcript_path.read_text().split() == " ".join(r['text'] for r in results).split()
+
+    assert [(r['text'], r['timestamp']) for r in results] == [(w['text'], w['timestamp']) for w in WINDOWS]
+    progress = [r['progress'] for r in results]
+    assert progress == sorted(progress) and progress[-1] == 100.0
+    assert "100%" in WorkflowTracker.get('comment')
+    assert decoder['closed']
+    transcriber.gh.flush_status.assert_awaited()
+
+@pytest.mark.asyncio
+async def test_closing_transcribe_stream_early_closes_the_decoder(transcriber, decoder):
+    stream = transcriber.transcribe_stream()
+    first = await stream.__anext__()
+    assert first['text'] == "first window"
+    assert not decoder['closed']
+    await stream.aclose()
+    assert decoder['closed']
+
+@pytest.fixture
+def drive_transcriber(mocker, tmp_path):
+    """An AudioTranscriber on a fake drive, with a job ledger in tmp_path."""
+    mocker.patch('audio_transcriber_code.get_settings', return_value=MagicMock(
+        local_mp3_dir=str(tmp_path / "mp3s"), transcript_cache_enabled=False, stream_chunk_mb=1, transcription_batch_size=4))
+    mocker.patch('gdrive_helper_code.get_settings', return_value=MagicMock(
+        status_debounce_s=0.0, ranged_download_threshold_mb=64, upload_chunk_mb=1, upload_max_retries=3,
+        gdrive_mp3_folder_id=MP3_FOLDER_ID))
+    drive = FakeGoogleDrive()
+    mocker.patch('audio_transcriber_code.GDriveHelper', return_value=GDriveHelper(drive=drive))
+    ledger = JobLedger(str(tmp_path / "ledger.sqlite3"))
+    mocker.patch('audio_transcriber_code.get_job_ledger', return_value=ledger)
+    mocker.patch('gdrive_helper_code.get_job_ledger', return_value=ledger)
+    transcriber = AudioTranscriber()
+    transcriber.drive = drive
+    return transcriber
+
+def put_mp3(drive, content: bytes, gfile_id=None):
+    gfile = drive.CreateFile({'id': gfile_id} if gfile_id else {'title': "lecture.mp3"})
+    gfile.SetContentString(content.decode('latin-1'), encoding='latin-1')
+    gfile.Upload()
+    return gfile['id']
+
+async def prepare(transcriber, gfile_id):
+    WorkflowTracker.set_model(WorkflowTrackerModel(input_mp3=GDriveInput(gdrive_id=gfile_id)))
+    local_mp3_path = await transcriber.prepare_mp3()
+    return local_mp3_path, WorkflowTracker.get('comment')
+
+@pytest.mark.asyncio
+async def test_mp3_replaced_on_drive_is_downloaded_again(drive_transcriber):
+    first_audio, second_audio = b"ID3" + bytes(4096), b"ID3" + bytes(range(256)) * 16
+    gfile_id = put_mp3(drive_transcriber.drive, first_audio)
+    await prepare(drive_transcriber, gfile_id)
+    local_mp3_path, comment = await prepare(drive_transcriber, gfile_id)
+    assert comment.startswith("Resumed from the job ledger")
+
+    put_mp3(drive_transcriber.drive, second_audio, gfile_id)
+    local_mp3_path, comment = await prepare(drive_transcriber, gfile_id)
+
+    assert not comment.startswith("Resumed")
+    assert local_mp3_path.read_bytes() == second_audio
+    assert WorkflowTracker.get('audio_sha256') == hashlib.sha256(second_audio).hexdigest()
+
+@pytest.fixture
+def stream_decoder(mocker, drive_transcriber):
+    """A fake transcribe_byte_stream that reads every chunk. stream_decoder['bytes'] is what it was fed."""
+    mocker.patch.object(drive_transcriber, 'resolve_model_and_compute_type', return_value=("openai/whisper-tiny", "float32"))
+    mocker.patch.object(drive_transcriber, 'resolve_assistant_model', return_value=None)
+    fed = {'bytes': b""}
+    def transcribe_byte_stream(pipe, byte_chunks, batch_size):
+        fed['bytes'] = b"".join(byte_chunks)
+        return f"text of {len(fed['bytes'])} bytes"
+    mocker.patch('audio_transcriber_code.transcribe_byte_stream', side_effect=transcribe_byte_stream)
+    mocker.patch('audio_transcriber_code.get_model_cache')
+    return fed
+
+@pytest.mark.asyncio
+async def test_uploaded_mp3_is_decoded_from_the_bytes_its_upload_reads(drive_transcriber, stream_decoder, tmp_path):
+    audio = b"ID3" + bytes(range(256)) * 3000
+    upload_file = UploadFile(file=io.BytesIO(audio), filename="lecture.mp3")
+    WorkflowTracker.set_model(WorkflowTrackerModel(input_mp3=upload_file))
+
+    transcription_text = await drive_transcriber.transcribe_streaming()
+
+    assert transcription_text == f"text of {len(audio)} bytes"
+    assert stream_decoder['bytes'] == audio
+    gfile = drive_transcriber.drive.CreateFile({'id': WorkflowTracker.get('mp3_gfile_id')})
+    assert gfile.GetContentString(encoding='latin-1').encode('latin-1') == audio
+    assert WorkflowTracker.get('audio_sha256') == hashlib.sha256(audio).hexdigest()
+    assert not (tmp_path / "mp3s").exists()
+
+@pytest.mark.asyncio
+async def test_gdrive_stream_records_when_it_starts(drive_transcriber, stream_decoder, tmp_path):
+    audio = b"ID3" + bytes(range(256)) * 8000
+    gfile_id = put_mp3(drive_transcriber.drive, audio)
+    WorkflowTracker.set_model(WorkflowTrackerModel(input_mp3=GDriveInput(gdrive_id=gfile_id)))
+
+    await drive_transcriber.transcribe_streaming()
+
+    assert stream_decoder['bytes'] == audio
+    history = JobLedger(str(tmp_path / "ledger.sqlite3")).history(gfile_id)
+    assert [transition.status for transition in history][:2] == [WorkflowEnum.START.name, WorkflowEnum.TRANSCRIBING.name]
+    assert history[1].comment.startswith("Streaming the mp3 from GDrive")
@@ -0,0 +1,47 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from batch_transcriber_code import BatchTranscriber
+
+
+@pytest.fixture
+def batch_transcriber(mocker):
+    mocker.patch('batch_transcriber_code.get_settings', return_value=MagicMock(transcription_batch_size=8))
+    return BatchTranscriber()
+
+@pytest.mark.asyncio
+async def test_transcripts_are_scattered_back_in_request_order(mocker, batch_transcriber):
+    calls = []
+    async def fake_transcribe_files(audio_filenames, model_name, compute_float_type, assistant_model_name=None):
+        calls.append((tuple(audio_filenames), model_name, compute_float_type, assistant_model_name))
+        return [f"{model_name}:{filename}" for filename in audio_filenames]
+    mocker.patch.object(batch_transcriber, 'transcribe_files', side_effect=fake_transcribe_files)
+
+    requests = [
+        ("a.mp3", "openai/whisper-medium", "float16", None),
+        ("b.mp3", "openai/whisper-tiny", "float16", None),
+        ("c.mp3", "openai/whisper-medium", "float16", None),
+        ("d.mp3", "openai/whisper-large-v2", "float16", None),
+        ("e.mp3", "openai/whisper-large-v2", "float16", "distil-whisper/distil-large-v2"),
+    ]
+    transcripts = await batch_transcriber.transcribe_requests(requests)
+
+    assert transcripts == [
+        "openai/whisper-medium:a.mp3",
+        "openai/whisper-tiny:b.mp3",
+        "openai/whisper-medium:c.mp3",
+        "openai/whisper-large-v2:d.mp3",
+        "openai/whisper-large-v2:e.mp3",
+    ]
+    # Requests sharing a model, compute type and assistant model go through the pipeline together.
+    assert (("a.mp3", "c.mp3"), "openai/whisper-medium", "float16", None) in calls
+    assert (("e.mp3",), "openai/whisper-large-v2", "float16", "distil-whisper/distil-large-v2") in calls
+    assert len(calls) == 4
+
+@pytest.mark.asyncio
+async def test_no_files_does_not_load_a_model(mocker, batch_transcriber):
+    mocker.patch('batch_transcriber_code.get_worker_pool', return_value=None)
+    get_model_cache = mocker.patch('batch_transcriber_code.get_model_cache')
+    assert await batch_transcriber.transcribe_files([], "openai/whisper-tiny", "float32") == []
+    get_model_cache.assert_not_called()
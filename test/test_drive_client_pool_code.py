@@ -0,0 +1,43 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+from drive_client_pool_code import DriveClientPool
+
+def test_clients_are_reused():
+    create_client = MagicMock(side_effect=lambda: object())
+    pool = DriveClientPool(create_client, size=4)
+    with pool.borrow() as first:
+        pass
+    with pool.borrow() as second:
+        pass
+    assert first is second
+    assert create_client.call_count == 1
+
+def test_borrow_waits_when_every_client_is_borrowed():
+    pool = DriveClientPool(object, size=2)
+    in_use, max_in_use = set(), []
+    lock = threading.Lock()
+    def _use_client():
+        with pool.borrow() as client:
+            with lock:
+                in_use.add(id(client))
+                max_in_use.append(len(in_use))
+            time.sleep(0.01)
+            with lock:
+                in_use.discard(id(client))
+    threads = [threading.Thread(target=_use_client) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert pool.created() == 2
+    assert max(max_in_use) <= 2
+
+def test_expired_token_is_refreshed_on_borrow():
+    client = MagicMock()
+    client.auth.access_token_expired = True
+    pool = DriveClientPool(lambda: client, size=1)
+    with pool.borrow():
+        pass
+    client.auth.Refresh.assert_called_once()
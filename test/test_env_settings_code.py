@@ -0,0 +1,29 @@
+import pytest
+
+from env_settings_code import check_settings, get_settings, override_settings, reload_settings
+
+def test_settings_are_read_once(environment):
+    settings = get_settings()
+    environment.setenv('STATUS_DEBOUNCE_S', '9.5')
+    assert get_settings() is settings
+    assert reload_settings().status_debounce_s == 9.5
+
+def test_override_applies_within_the_block(environment):
+    settings = get_settings()
+    with override_settings(storage_backend='memory', upload_chunk_mb=1) as overridden:
+        assert get_settings() is overridden
+        assert (overridden.storage_backend, overridden.upload_chunk_mb) == ('memory', 1)
+        assert overridden.gdrive_mp3_folder_id == 'mp3-folder'
+    assert get_settings() is settings
+
+@pytest.mark.parametrize("name, value", [('STORAGE_BACKEND', 'dropbox'), ('DOWNLOAD_CONCURRENCY', '0'), ('FAKE_DRIVE_ERROR_RATE', '1.5'),
+                                         ('AUDIO_QUALITY_DEFAULT', 'meduim'), ('COMPUTE_TYPE_DEFAULT', 'fp16')])
+def test_invalid_settings_stop_the_process_at_startup(environment, name, value):
+    environment.setenv('STORAGE_BACKEND', 'memory')
+    environment.setenv(name, value)
+    with pytest.raises(SystemExit, match=name.lower()):
+        check_settings()
+
+def test_missing_credentials_file_stops_the_process_at_startup(environment):
+    with pytest.raises(SystemExit, match='service_account.json'):
+        check_settings()
@@ -0,0 +1,78 @@
+import pytest
+
+from fake_drive_code import FakeDriveApiError, FakeGoogleDrive
+
+FOLDER_ID = "mp3-folder"
+
+def upload(drive, tmp_path, title, content=b"ID3 fake mp3 bytes", folder_id=FOLDER_ID):
+    local_path = tmp_path / title
+    local_path.write_bytes(content)
+    gfile = drive.CreateFile({'parents': [{'id': folder_id}]})
+    gfile.SetContentFile(str(local_path))
+    gfile['title'] = title
+    gfile.Upload()
+    return gfile['id']
+
+@pytest.mark.parametrize("in_local_dir", [False, True])
+def test_upload_and_download_round_trip(tmp_path, in_local_dir):
+    drive = FakeGoogleDrive(root_dir=str(tmp_path / "drive") if in_local_dir else None)
+    gfile_id = upload(drive, tmp_path, "lecture.mp3")
+
+    gfile = drive.CreateFile({'id': gfile_id})
+    gfile.FetchMetadata(fields="title")
+    assert gfile['title'] == "lecture.mp3"
+    download_path = tmp_path / "download.mp3"
+    gfile.GetContentFile(str(download_path))
+    assert download_path.read_bytes() == b"ID3 fake mp3 bytes"
+    assert b"".join(gfile.GetContentIOBuffer(chunksize=4)) == b"ID3 fake mp3 bytes"
+
+def test_description_is_missing_until_set(tmp_path):
+    drive = FakeGoogleDrive()
+    gfile_id = upload(drive, tmp_path, "lecture.mp3")
+    gfile = drive.CreateFile({'id': gfile_id})
+    gfile.FetchMetadata(fields="description")
+    with pytest.raises(KeyError):
+        gfile['description'] # pylint: disable=pointless-statement
+
+    gfile['description'] = '{"status": "TRANSCRIBING"}'
+    gfile.Upload()
+    fetched = drive.CreateFile({'id': gfile_id})
+    fetched.FetchMetadata(fields="description")
+    assert fetched['description'] == '{"status": "TRANSCRIBING"}'
+
+def test_list_file_query_and_paging(tmp_path):
+    drive = FakeGoogleDrive()
+    ids = {upload(drive, tmp_path, f"{index}.mp3") for index in range(5)}
+    upload(drive, tmp_path, "other.mp3", folder_id="other-folder")
+    trashed = drive.CreateFile({'id': ids.pop()})
+    trashed.Trash()
+
+    query = f"'{FOLDER_ID}' in parents and trashed=false"
+    assert {gfile['id'] for gfile in drive.ListFile({'q': query}).GetList()} == ids
+    pages = list(drive.ListFile({'q': query, 'maxResults': 3}))
+    assert [len(page) for page in pages] == [3, 1]
+
+def test_deleted_file_is_gone(tmp_path):
+    drive = FakeGoogleDrive()
+    gfile_id = upload(drive, tmp_path, "lecture.mp3")
+    drive.CreateFile({'id': gfile_id}).Delete()
+    with pytest.raises(FakeDriveApiError):
+        drive.CreateFile({'id': gfile_id}).FetchMetadata()
+
+def test_injected_errors(tmp_path):
+    drive = FakeGoogleDrive(error_rate=1.0, seed=0)
+    with pytest.raises(FakeDriveApiError):
+        upload(drive, tmp_path, "lecture.mp3")
+
+def test_changes_feed_pages_from_the_token(tmp_path):
+    drive = FakeGoogleDrive()
+    upload(drive, tmp_path, "before.mp3")
+    page_token = drive.GetStartPageToken()
+    ids = [upload(drive, tmp_path, f"{index}.mp3") for index in range(3)]
+    drive.CreateFile({'id': ids[0]}).Delete()
+
+    first_page = drive.ListChanges(page_token, max_results=2)
+    second_page = drive.ListChanges(first_page['nextPageToken'], max_results=2)
+    assert [item['fileId'] for item in first_page['items'] + second_page['items']] == ids + [ids[0]]
+    assert all(item['deleted'] for item in first_page['items'] + second_page['items'] if item['fileId'] == ids[0])
+    assert drive.ListChanges(second_page['newStartPageToken'])['items'] == []
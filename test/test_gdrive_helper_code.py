@@ -0,0 +1,111 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from fake_drive_code import FakeGoogleDrive
+from gdrive_helper_code import GDriveHelper
+from pydantic_models import GDriveInput
+from workflow_states_code import WorkflowEnum
+from workflow_tracker_code import WorkflowTracker
+
+FOLDER_ID = "mp3-folder"
+
+@pytest.fixture
+def drive():
+    return FakeGoogleDrive()
+
+@pytest.fixture
+def gh(mocker, drive):
+    mocker.patch('gdrive_helper_code.get_settings', return_value=MagicMock(status_debounce_s=0.0))
+    return GDriveHelper(drive=drive)
+
+def add_mp3(drive, title, description=None):
+    gfile = drive.CreateFile({'parents': [{'id': FOLDER_ID}], 'title': title})
+    gfile.SetContentString("fake mp3")
+    if description is not None:
+        gfile['description'] = description
+    gfile.Upload()
+    return gfile['id']
+
+@pytest.mark.asyncio
+async def test_listing_carries_each_files_status(mocker, gh, drive):
+    done_json = f'{{"status": "{WorkflowEnum.TRANSCRIPTION_UPLOAD_COMPLETE.name}"}}'
+    done_id = add_mp3(drive, "done.mp3", done_json)
+    new_id = add_mp3(drive, "new.mp3")
+    broken_id = add_mp3(drive, "broken.mp3", "not json")
+    list_calls = mocker.spy(drive, '_list')
+    fetch_calls = mocker.spy(drive, '_fetch')
+
+    files = await gh.list_files_to_transcribe(FOLDER_ID)
+    statuses = {gfile['id']: gh.status_model_from_listing(gfile).status for gfile in files}
+
+    assert statuses == {
+        done_id: WorkflowEnum.TRANSCRIPTION_UPLOAD_COMPLETE.name,
+        new_id: WorkflowEnum.NOT_STARTED.name,
+        broken_id: WorkflowEnum.NOT_STARTED.name,
+    }
+    assert list_calls.call_count == 1
+    fetch_calls.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_listing_follows_every_page(mocker, gh, drive):
+    mocker.patch('gdrive_helper_code.LISTING_PAGE_SIZE', 2)
+    ids = {add_mp3(drive, f"{index}.mp3") for index in range(5)}
+    files = await gh.list_files_to_transcribe(FOLDER_ID)
+    assert {gfile['id'] for gfile in files} == ids
+
+@pytest.mark.asyncio
+async def test_changes_feed_reports_only_files_changed_since_the_token(gh, drive):
+    add_mp3(drive, "old.mp3")
+    page_token = await gh.get_changes_start_token()
+    new_id = add_mp3(drive, "new.mp3")
+    add_mp3(drive, "elsewhere.mp3")
+    other_folder_file = drive.CreateFile({'parents': [{'id': "other-folder"}], 'title': "other.mp3"})
+    other_folder_file.Upload()
+    # Two changes to the same file are reported once.
+    gfile = drive.CreateFile({'id': new_id})
+    gfile['description'] = '{"status": "START"}'
+    gfile.Upload()
+
+    changed_files, next_token = await gh.list_changed_files(FOLDER_ID, page_token)
+    assert sorted(gfile['title'] for gfile in changed_files) == ["elsewhere.mp3", "new.mp3"]
+    assert gh.status_model_from_listing(next(f for f in changed_files if f['id'] == new_id)).status == "START"
+
+    changed_files, _ = await gh.list_changed_files(FOLDER_ID, next_token)
+    assert changed_files == []
+
+@pytest.mark.asyncio
+async def test_upload_survives_failed_chunks_and_reports_progress(mocker, tmp_path):
+    mocker.patch('gdrive_helper_code.get_settings', return_value=MagicMock(status_debounce_s=0.0, upload_chunk_mb=1, upload_max_retries=20))
+    mocker.patch('gdrive_helper_code.update_status', new_callable=mocker.AsyncMock)
+    mocker.patch('resumable_upload_code.time.sleep')
+    drive = FakeGoogleDrive(error_rate=0.3, seed=7)
+    gh = GDriveHelper(drive=drive)
+    content = bytes(range(256)) * (14 * 1024)
+    local_path = tmp_path / "lecture.mp3"
+    local_path.write_bytes(content)
+    report_progress = mocker.spy(gh, '_report_upload_progress')
+
+    gfile_id = await gh.upload(GDriveInput(gdrive_id="1Bz3xfXbYmTqAnpLuTqKjN2pQeR4sZ"), local_path)
+
+    drive.error_rate = 0.0
+    assert drive.CreateFile({'id': gfile_id}).GetContentString(encoding='latin-1').encode('latin-1') == content
+    assert report_progress.call_args.args == ("lecture.mp3", len(content), len(content))
+    assert WorkflowTracker.get('comment') == "Uploaded 3.5 of 3.5 MB of lecture.mp3."
+
+@pytest.mark.parametrize("threshold_mb, expected_range_requests", [(1, 4), (64, 0)])
+@pytest.mark.asyncio
+async def test_download_splits_large_files_into_ranges(mocker, tmp_path, drive, threshold_mb, expected_range_requests):
+    mocker.patch('gdrive_helper_code.get_settings', return_value=MagicMock(
+        status_debounce_s=0.0, ranged_download_threshold_mb=threshold_mb, ranged_download_segment_mb=1, ranged_download_workers=3))
+    gh = GDriveHelper(drive=drive)
+    content = bytes(range(256)) * (14 * 1024)
+    gfile = drive.CreateFile({'parents': [{'id': FOLDER_ID}], 'title': "lecture.mp3"})
+    gfile.SetContentString(content.decode('latin-1'), encoding='latin-1')
+    gfile.Upload()
+    range_requests = mocker.spy(drive, 'GetContentRange')
+
+    local_path = await gh.download_from_gdrive(GDriveInput(gdrive_id=gfile['id']), tmp_path)
+
+    assert local_path.read_bytes() == content
+    assert range_requests.call_count == expected_range_requests
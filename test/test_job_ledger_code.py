@@ -0,0 +1,50 @@
+import pytest
+
+from job_ledger_code import JobLedger, JobTransition
+from transcript_cache_code import hash_file
+from workflow_states_code import WorkflowEnum
+
+GFILE_ID = "mp3_gfile_id_abcdefghijklmnop"
+
+@pytest.fixture
+def ledger(tmp_path):
+    return JobLedger(str(tmp_path / "ledger.sqlite3"))
+
+@pytest.fixture
+def downloaded_mp3(tmp_path, ledger):
+    mp3_path = tmp_path / "lecture.mp3"
+    mp3_path.write_bytes(b"ID3" + bytes(4096))
+    ledger.record(JobTransition(mp3_gfile_id=GFILE_ID, status=WorkflowEnum.START.name, recorded_at=1.0))
+    ledger.record(JobTransition(mp3_gfile_id=GFILE_ID, status=WorkflowEnum.MP3_DOWNLOADED.name, recorded_at=2.0,
+                                local_mp3_path=str(mp3_path), audio_sha256=hash_file(mp3_path), mp3_md5_checksum="md5-a"))
+    ledger.record(JobTransition(mp3_gfile_id=GFILE_ID, status=WorkflowEnum.TRANSCRIBING.name, recorded_at=3.0))
+    return mp3_path
+
+def test_transitions_are_recorded_in_order(ledger, downloaded_mp3): # pylint: disable=unused-argument
+    assert [transition.status for transition in ledger.history(GFILE_ID)] == [
+        WorkflowEnum.START.name, WorkflowEnum.MP3_DOWNLOADED.name, WorkflowEnum.TRANSCRIBING.name]
+    assert ledger.last_transition(GFILE_ID).status == WorkflowEnum.TRANSCRIBING.name
+    assert ledger.last_transition("another_gfile_id") is None
+
+def test_unchanged_download_is_resumable(ledger, downloaded_mp3):
+    resumed = ledger.resumable_download(GFILE_ID)
+    assert resumed.local_mp3_path == str(downloaded_mp3)
+
+def test_download_without_a_recorded_md5_checksum_is_not_resumable(ledger, downloaded_mp3):
+    ledger.record(JobTransition(mp3_gfile_id=GFILE_ID, status=WorkflowEnum.MP3_DOWNLOADED.name, recorded_at=4.0,
+                                local_mp3_path=str(downloaded_mp3), audio_sha256=hash_file(downloaded_mp3)))
+    assert ledger.resumable_download(GFILE_ID) is None
+
+def test_changed_or_missing_download_is_not_resumable(ledger, downloaded_mp3):
+    downloaded_mp3.write_bytes(b"ID3 truncated")
+    assert ledger.resumable_download(GFILE_ID) is None
+    downloaded_mp3.unlink()
+    assert ledger.resumable_download(GFILE_ID) is None
+
+def test_jobs_whose_last_transition_is_not_terminal_are_unfinished(ledger, downloaded_mp3): # pylint: disable=unused-argument
+    ledger.record(JobTransition(mp3_gfile_id="finished_gfile_id", status=WorkflowEnum.START.name, recorded_at=4.0))
+    ledger.record(JobTransition(mp3_gfile_id="finished_gfile_id", status=WorkflowEnum.TRANSCRIPTION_UPLOAD_COMPLETE.name, recorded_at=5.0))
+    ledger.record(JobTransition(mp3_gfile_id="failed_gfile_id", status=WorkflowEnum.ERROR.name, recorded_at=6.0))
+
+    assert [(transition.mp3_gfile_id, transition.status) for transition in ledger.unfinished_jobs()] == [
+        (GFILE_ID, WorkflowEnum.TRANSCRIBING.name)]
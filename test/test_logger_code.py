@@ -0,0 +1,106 @@
+import inspect
+import json
+import logging
+import logging.handlers
+from unittest.mock import MagicMock
+
+import pytest
+
+from logger_code import CustomFormatter, JsonQueueHandler, LazyMessage, LoggerBase, set_log_context_provider
+from workflow_error_code import async_error_handler
+
+class Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+@pytest.fixture
+def logger():
+    logger = LoggerBase.setup_logger('test_logger_code')
+    handler = Records()
+    logger.addHandler(handler)
+    yield logger, handler.records
+    logger.removeHandler(handler)
+
+def format_caller(record):
+    formatter = CustomFormatter("%(custom_pathname)s:%(custom_lineno)d %(custom_funcname)s %(message)s", no_color=True)
+    return formatter.format(record)
+
+def test_flow_record_points_at_the_caller(logger):
+    logger, records = logger
+    logger.flow("moving on")
+    line = inspect.currentframe().f_lineno - 1
+    assert format_caller(records[-1]) == f"{__file__}:{line} test_flow_record_points_at_the_caller moving on"
+
+@pytest.mark.asyncio
+async def test_stacklevel_skips_the_error_handler_wrapper(logger):
+    logger, records = logger
+    @async_error_handler()
+    async def log_status():
+        logger.flow("state", stacklevel=3)
+    await log_status()
+    assert records[-1].funcName == "test_stacklevel_skips_the_error_handler_wrapper"
+
+def test_lazy_message_is_not_built_for_a_disabled_level(logger, mocker):
+    logger, records = logger
+    build = mocker.Mock(return_value="expensive")
+    logger.setLevel(logging.INFO)
+    try:
+        logger.flow(LazyMessage(build))
+    finally:
+        logger.setLevel(logging.DEBUG)
+    build.assert_not_called()
+    logger.flow(LazyMessage(build, 1))
+    assert records[-1].getMessage() == "expensive"
+    build.assert_called_once_with(1)
+
+@pytest.fixture
+def queue_backend(tmp_path):
+    log_path = tmp_path / "transcriber.ndjson"
+    LoggerBase.configure(MagicMock(log_backend='queue', log_json_path=str(log_path), log_max_mb=1, log_backup_count=1,
+                                   log_sample_rates={'test_logger_code_sampled': 0.0}))
+    yield log_path
+    LoggerBase.configure(MagicMock(log_backend='stream'))
+    set_log_context_provider(None)
+
+def read_entries(log_path):
+    LoggerBase.shutdown()
+    return [json.loads(line) for line in log_path.read_text().splitlines()]
+
+def test_queue_backend_writes_json_lines_with_the_job_fields(queue_backend):
+    logger = LoggerBase.setup_logger('test_logger_code_queued')
+    set_log_context_provider(lambda: {'job_id': 'gfile-1', 'stage': 'TRANSCRIBING'})
+    logger.flow("transcribing")
+    logger.debug("downloaded", extra={'stage': 'download', 'duration_s': 1.5})
+
+    entries = read_entries(queue_backend)
+    assert [entry['message'] for entry in entries] == ["transcribing", "downloaded"]
+    assert entries[0]['level'] == "FLOW"
+    assert (entries[0]['job_id'], entries[0]['stage']) == ('gfile-1', 'TRANSCRIBING')
+    assert (entries[1]['stage'], entries[1]['duration_s']) == ('download', 1.5)
+
+def test_queue_backend_switches_loggers_set_up_before_it(queue_backend):
+    logger = logging.getLogger('test_logger_code')
+    assert [type(handler) for handler in logger.handlers if not isinstance(handler, Records)] == [JsonQueueHandler]
+
+def test_sampled_logger_keeps_info_and_above(queue_backend):
+    logger = LoggerBase.setup_logger('test_logger_code_sampled')
+    logger.debug("dropped")
+    logger.flow("dropped")
+    logger.info("kept")
+    assert [entry['message'] for entry in read_entries(queue_backend)] == ["kept"]
+
+def test_queue_backend_keeps_the_exception(queue_backend):
+    logger = LoggerBase.setup_logger('test_logger_code_queued')
+    try:
+        raise ValueError("bad mp3")
+    except ValueError:
+        logger.exception("transcription failed")
+
+    entries = read_entries(queue_backend)
+    assert entries[0]['message'] == "transcription failed"
+    assert entries[0]['exception'].startswith("Traceback")
+    assert "ValueError: bad mp3" in entries[0]['exception']
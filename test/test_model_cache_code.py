@@ -0,0 +1,108 @@
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from model_cache_code import ModelCache, estimate_pipeline_bytes, resolve_compute_type
+
+def fake_loader(model_name, compute_type, device, assistant_model_name=None):
+    return f"{model_name}-{compute_type}-{device}-{assistant_model_name}"
+
+def make_cache(max_bytes, calls):
+    def loader(model_name, compute_type, device, assistant_model_name=None):
+        calls.append(model_name)
+        return fake_loader(model_name, compute_type, device, assistant_model_name)
+    # Every fake pipeline "uses" 10 bytes.
+    return ModelCache(max_bytes=max_bytes, loader=loader, size_estimator=lambda pipe: 10)
+
+def test_pipeline_is_loaded_once():
+    calls = []
+    cache = make_cache(100, calls)
+    first = cache.get_pipeline("openai/whisper-tiny", "float32", device=-1)
+    second = cache.get_pipeline("openai/whisper-tiny", "float32", device=-1)
+    assert first is second
+    assert calls == ["openai/whisper-tiny"]
+
+def test_dtype_and_device_are_part_of_the_key():
+    calls = []
+    cache = make_cache(100, calls)
+    cache.get_pipeline("openai/whisper-tiny", "float32", device=-1)
+    cache.get_pipeline("openai/whisper-tiny", "float16", device=-1)
+    cache.get_pipeline("openai/whisper-tiny", "float16", device=0)
+    assert len(cache.keys()) == 3
+
+def test_least_recently_used_pipeline_is_evicted():
+    calls = []
+    cache = make_cache(20, calls)
+    cache.get_pipeline("a", "float32", device=-1)
+    cache.get_pipeline("b", "float32", device=-1)
+    # Touch "a" so "b" becomes the least recently used.
+    cache.get_pipeline("a", "float32", device=-1)
+    cache.get_pipeline("c", "float32", device=-1)
+    loaded_models = [key[0] for key in cache.keys()]
+    assert loaded_models == ["a", "c"]
+    assert cache.total_bytes() == 20
+
+def test_pipeline_over_budget_is_still_kept():
+    calls = []
+    cache = make_cache(5, calls)
+    cache.get_pipeline("a", "float32", device=-1)
+    cache.get_pipeline("b", "float32", device=-1)
+    assert [key[0] for key in cache.keys()] == ["b"]
+
+def test_assistant_model_is_part_of_the_key():
+    calls = []
+    cache = make_cache(100, calls)
+    plain = cache.get_pipeline("openai/whisper-large-v2", "float32", device=-1)
+    speculative = cache.get_pipeline("openai/whisper-large-v2", "float32", device=-1,
+                                     assistant_model_name="distil-whisper/distil-large-v2")
+    assert plain != speculative
+    assert speculative == "openai/whisper-large-v2-float32--1-distil-whisper/distil-large-v2"
+    assert len(cache.keys()) == 2
+
+class FakeTensor:
+    def __init__(self, numel, element_size, data_ptr):
+        self._numel, self._element_size, self._data_ptr = numel, element_size, data_ptr
+
+    def numel(self):
+        return self._numel
+
+    def element_size(self):
+        return self._element_size
+
+    def data_ptr(self):
+        return self._data_ptr
+
+class FakeModel:
+    def __init__(self, state_dict):
+        self._state_dict = state_dict
+
+    def state_dict(self):
+        return self._state_dict
+
+def test_pipeline_size_counts_packed_int8_weights_once():
+    embed_tokens = FakeTensor(1000, 4, data_ptr=1)
+    model = FakeModel({
+        'embed_tokens.weight': embed_tokens,
+        # Tied to embed_tokens.
+        'proj_out.weight': embed_tokens,
+        # A dynamically quantized Linear: an int8 weight and a float32 bias.
+        'fc1._packed_params._packed_params': (FakeTensor(100, 1, data_ptr=2), FakeTensor(10, 4, data_ptr=3)),
+        'fc1.scale': 1.0,
+    })
+    assistant_model = FakeModel({'fc1.weight': FakeTensor(50, 2, data_ptr=4)})
+    pipe = MagicMock(model=model, assistant_model=assistant_model)
+    assert estimate_pipeline_bytes(pipe) == 4000 + 100 + 40 + 100
+
+def test_compute_type_is_resolved_for_the_device():
+    # CPU
+    assert resolve_compute_type("float16", -1) == "float32"
+    assert resolve_compute_type("int8", -1) == "int8"
+    # GPU
+    assert resolve_compute_type("float16", 0) == "float16"
+    assert resolve_compute_type("int8", 0) == "float16"
+
+def test_importing_the_pipeline_modules_does_not_import_torch():
+    # torch and transformers are only imported when a model is loaded, so the CLI and the API start fast.
+    code = "import sys, model_cache_code, workflow_tracker_code; assert 'torch' not in sys.modules and 'transformers' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=Path(__file__).resolve().parent.parent)
@@ -0,0 +1,33 @@
+import io
+from unittest.mock import MagicMock
+
+import pytest
+
+from pydantic_models import validate_upload_file
+
+def upload_file(filename, content):
+    return MagicMock(filename=filename, file=io.BytesIO(content))
+
+@pytest.mark.asyncio
+async def test_valid_mp3_is_measured_without_reading_it():
+    mp3 = upload_file("lecture.mp3", b"ID3" + bytes(20_000))
+    read = MagicMock(wraps=mp3.file.read)
+    mp3.file.read = read
+    assert await validate_upload_file(mp3) is mp3
+    assert mp3.file.tell() == 0
+    # Only the header is read.
+    assert all(call.args == (3,) for call in read.call_args_list)
+
+@pytest.mark.asyncio
+async def test_mpeg_frame_without_id3_tag_is_valid():
+    assert await validate_upload_file(upload_file("lecture.mp3", b"\xff\xfb\x90\x64" + bytes(20_000)))
+
+@pytest.mark.parametrize("filename, content", [
+    ("lecture.wav", b"ID3" + bytes(20_000)),
+    ("lecture.mp3", b"ID3" + bytes(100)),
+    ("lecture.mp3", b"RIFF" + bytes(20_000)),
+])
+@pytest.mark.asyncio
+async def test_invalid_uploads_are_rejected(filename, content):
+    with pytest.raises(ValueError):
+        await validate_upload_file(upload_file(filename, content))
@@ -0,0 +1,48 @@
+import hashlib
+
+import pytest
+
+from fake_drive_code import FakeDriveApiError
+from ranged_download_code import download_ranges, plan_segments, verify_md5
+
+CONTENT = bytes(range(256)) * 40
+
+@pytest.fixture(autouse=True)
+def no_backoff(mocker):
+    return mocker.patch('ranged_download_code.time.sleep')
+
+def test_segments_cover_the_file_without_overlap():
+    assert plan_segments(10, 4) == [(0, 3), (4, 7), (8, 9)]
+    assert plan_segments(8, 4) == [(0, 3), (4, 7)]
+    assert plan_segments(0, 4) == []
+
+def test_segments_are_written_at_their_offsets(tmp_path):
+    local_path = tmp_path / "lecture.mp3"
+    failed = set()
+    def fetch_range(start, end):
+        # Every segment fails once before it arrives.
+        if start not in failed:
+            failed.add(start)
+            raise FakeDriveApiError("Connection reset.")
+        return CONTENT[start:end + 1]
+
+    download_ranges(fetch_range, local_path, len(CONTENT), segment_size=1000, max_workers=4)
+
+    assert local_path.read_bytes() == CONTENT
+    verify_md5(local_path, hashlib.md5(CONTENT).hexdigest())
+
+def test_failed_segment_removes_the_partial_file(tmp_path):
+    local_path = tmp_path / "lecture.mp3"
+    def fetch_range(start, end):
+        if start == 2000:
+            raise PermissionError("Forbidden.")
+        return CONTENT[start:end + 1]
+    with pytest.raises(PermissionError):
+        download_ranges(fetch_range, local_path, len(CONTENT), segment_size=1000, max_workers=2)
+    assert not local_path.exists()
+
+def test_md5_mismatch_is_an_error(tmp_path):
+    local_path = tmp_path / "lecture.mp3"
+    local_path.write_bytes(CONTENT)
+    with pytest.raises(ValueError):
+        verify_md5(local_path, hashlib.md5(b"something else").hexdigest())
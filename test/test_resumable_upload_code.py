@@ -0,0 +1,118 @@
+import hashlib
+import io
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from fake_drive_code import FakeDriveApiError, FakeGoogleDrive
+from resumable_upload_code import TeeReader, aligned_chunk_size, run_resumable_upload
+
+def http_error(status, reason=None):
+    content = json.dumps({'error': {'code': status, 'errors': [{'reason': reason}]}}).encode('utf-8') if reason else b''
+    return HttpError(MagicMock(status=status), content)
+
+@pytest.fixture(autouse=True)
+def no_backoff(mocker):
+    return mocker.patch('resumable_upload_code.time.sleep')
+
+@pytest.fixture
+def recording(tmp_path):
+    local_path = tmp_path / "lecture.mp3"
+    local_path.write_bytes(b"0123456789" * 10)
+    return local_path
+
+def test_chunk_size_is_a_multiple_of_256_kib():
+    assert aligned_chunk_size(1) == 256 * 1024
+    assert aligned_chunk_size(8 * 1024 * 1024) == 8 * 1024 * 1024
+    assert aligned_chunk_size(300 * 1024) == 512 * 1024
+
+def test_failed_chunk_resumes_from_the_last_acknowledged_byte(mocker, recording):
+    drive = FakeGoogleDrive()
+    upload = drive.CreateResumableUpload({'title': recording.name}, recording, chunk_size=30)
+    api_call = drive._api_call # pylint: disable=protected-access
+    calls = []
+    def _fail_second_chunk(operation):
+        calls.append(operation)
+        if len(calls) == 2:
+            raise FakeDriveApiError("Connection reset.")
+        api_call(operation)
+    mocker.patch.object(drive, '_api_call', side_effect=_fail_second_chunk)
+    progress = []
+
+    metadata = run_resumable_upload(upload, max_retries=3, on_progress=lambda sent, total: progress.append(sent))
+
+    assert drive.CreateFile({'id': metadata['id']}).GetContentString() == recording.read_text()
+    assert progress == [30, 60, 90, 100]
+
+def test_gives_up_after_max_retries_in_a_row(recording):
+    upload = MagicMock(resumable_progress=0, total_size=100)
+    upload.next_chunk.side_effect = http_error(503)
+    with pytest.raises(HttpError):
+        run_resumable_upload(upload, max_retries=2)
+    assert upload.next_chunk.call_count == 3
+
+def test_client_errors_are_not_retried():
+    upload = MagicMock(resumable_progress=0, total_size=100)
+    upload.next_chunk.side_effect = http_error(403)
+    with pytest.raises(HttpError):
+        run_resumable_upload(upload, max_retries=5)
+    assert upload.next_chunk.call_count == 1
+
+def test_local_file_errors_are_not_retried():
+    upload = MagicMock(resumable_progress=0, total_size=100)
+    upload.next_chunk.side_effect = FileNotFoundError("lecture.mp3")
+    with pytest.raises(FileNotFoundError):
+        run_resumable_upload(upload, max_retries=5)
+    assert upload.next_chunk.call_count == 1
+
+@pytest.mark.parametrize("reason", ['rateLimitExceeded', 'userRateLimitExceeded'])
+def test_rate_limited_chunk_is_retried(reason):
+    upload = MagicMock(resumable_progress=0, total_size=100)
+    upload.next_chunk.side_effect = [http_error(403, reason), http_error(403, reason), {'id': 'gfile-id'}]
+    assert run_resumable_upload(upload, max_retries=5) == {'id': 'gfile-id'}
+    assert upload.next_chunk.call_count == 3
+
+def test_other_403_reasons_are_not_retried():
+    upload = MagicMock(resumable_progress=0, total_size=100)
+    upload.next_chunk.side_effect = http_error(403, 'insufficientFilePermissions')
+    with pytest.raises(HttpError):
+        run_resumable_upload(upload, max_retries=5)
+    assert upload.next_chunk.call_count == 1
+
+def test_expired_session_starts_the_upload_again():
+    upload = MagicMock(resumable_progress=50, total_size=100)
+    upload.next_chunk.side_effect = [http_error(404), {'id': 'gfile-id'}]
+    assert run_resumable_upload(upload, max_retries=1) == {'id': 'gfile-id'}
+    upload.restart.assert_called_once()
+
+def test_tee_copies_and_hashes_each_byte_once_while_uploading(mocker, recording, tmp_path):
+    drive = FakeGoogleDrive()
+    api_call = drive._api_call # pylint: disable=protected-access
+    calls = []
+    def _fail_third_chunk(operation):
+        calls.append(operation)
+        if len(calls) == 3:
+            raise FakeDriveApiError("Connection reset.")
+        api_call(operation)
+    mocker.patch.object(drive, '_api_call', side_effect=_fail_third_chunk)
+    copy_path = tmp_path / "copy.mp3"
+    digest = hashlib.sha256()
+
+    with open(recording, 'rb') as source, open(copy_path, 'wb') as sink:
+        tee = TeeReader(source, sink, digest)
+        metadata = run_resumable_upload(drive.CreateResumableUpload({'title': recording.name}, tee, chunk_size=30), max_retries=3)
+        tee.copy_rest()
+
+    assert copy_path.read_bytes() == recording.read_bytes()
+    assert digest.hexdigest() == hashlib.sha256(recording.read_bytes()).hexdigest()
+    assert drive.CreateFile({'id': metadata['id']}).GetContentString() == recording.read_text()
+
+def test_tee_copies_what_the_upload_did_not_read(recording):
+    sink = io.BytesIO()
+    with open(recording, 'rb') as source:
+        tee = TeeReader(source, sink, hashlib.sha256())
+        tee.read(10)
+        tee.copy_rest()
+    assert sink.getvalue() == recording.read_bytes()
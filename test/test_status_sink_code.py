@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from status_sink_code import StatusSink
+from workflow_states_code import WorkflowEnum
+
+@pytest.fixture
+def writes():
+    return []
+
+@pytest.fixture
+def sink(writes):
+    return StatusSink(lambda gfile_id, status_json: writes.append((gfile_id, status_json)), debounce_s=0.05)
+
+@pytest.mark.asyncio
+async def test_rapid_updates_are_coalesced(sink, writes):
+    for status in (WorkflowEnum.START, WorkflowEnum.MP3_DOWNLOADED, WorkflowEnum.TRANSCRIBING):
+        await sink.submit("gfile-1", status.name, status.name)
+    assert not writes
+    await asyncio.sleep(0.1)
+    assert writes == [("gfile-1", WorkflowEnum.TRANSCRIBING.name)]
+
+@pytest.mark.asyncio
+async def test_terminal_status_is_written_immediately(sink, writes):
+    await sink.submit("gfile-1", WorkflowEnum.TRANSCRIBING.name, WorkflowEnum.TRANSCRIBING.name)
+    await sink.submit("gfile-1", WorkflowEnum.ERROR.name, WorkflowEnum.ERROR.name)
+    assert writes == [("gfile-1", WorkflowEnum.ERROR.name)]
+    await asyncio.sleep(0.1)
+    # The debounce timer was cancelled. Nothing else is written.
+    assert len(writes) == 1
+
+@pytest.mark.asyncio
+async def test_flush_writes_every_pending_status(sink, writes):
+    await sink.submit("gfile-1", "one", WorkflowEnum.START.name)
+    await sink.submit("gfile-2", "two", WorkflowEnum.START.name)
+    await sink.flush()
+    assert sorted(writes) == [("gfile-1", "one"), ("gfile-2", "two")]
@@ -0,0 +1,37 @@
+import threading
+
+import numpy as np
+
+from streaming_decode_code import AudioRingBuffer, iter_windows, quietest_cut
+from vad_code import SAMPLING_RATE
+
+def test_ring_buffer_wraps_around():
+    ring = AudioRingBuffer(capacity=5)
+    ring.write(np.arange(4))
+    ring.consume(3)
+    ring.write(np.arange(4, 8))
+    np.testing.assert_array_equal(ring.peek(5), [3, 4, 5, 6, 7])
+
+def test_windows_cover_the_stream_in_order_while_it_is_written():
+    samples = np.random.default_rng(0).standard_normal(10 * SAMPLING_RATE).astype(np.float32)
+    # The ring buffer holds less than the whole stream, so the writer has to wait for the reader.
+    ring = AudioRingBuffer(capacity=3 * SAMPLING_RATE)
+    def _write():
+        for start in range(0, len(samples), 4000):
+            ring.write(samples[start:start + 4000])
+        ring.close()
+    writer = threading.Thread(target=_write)
+    writer.start()
+
+    windows = list(iter_windows(ring, window_samples=2 * SAMPLING_RATE, search_samples=SAMPLING_RATE // 2))
+    writer.join()
+
+    assert all(len(window) <= 2 * SAMPLING_RATE for _, window in windows)
+    assert [offset for offset, _ in windows][0] == 0
+    np.testing.assert_array_equal(np.concatenate([window for _, window in windows]), samples)
+
+def test_window_is_cut_in_the_quietest_spot():
+    window = np.ones(SAMPLING_RATE, dtype=np.float32)
+    window[12_000:12_480] = 0.0
+    cut = quietest_cut(window, search_samples=SAMPLING_RATE // 2)
+    assert 12_000 <= cut <= 12_480
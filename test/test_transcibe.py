@@ -3,7 +3,6 @@ from unittest.mock import AsyncMock, MagicMock, patch
 from pathlib import Path
 from workflow_states_code import WorkflowEnum
 from audio_transcriber_code import AudioTranscriber
-import torch
 
 @pytest.fixture
 def mp3_test_path():
@@ -135,7 +134,7 @@ async def test_transcribe_mp3_success(mock_transcribe_pipeline, mp3_test_path):
     result_text = await transcriber._transcribe_mp3(mp3_test_path, "medium", "float32")
 
     # Verify
-    mock_transcribe_pipeline.assert_called_once_with(mp3_test_path, "openai/whisper-medium", torch.float32)
+    mock_transcribe_pipeline.assert_called_once_with(mp3_test_path, "openai/whisper-medium", "float32")
     assert result_text == "Expected transcription text", "The transcription text does not match the expected output."
 
 @pytest.mark.asyncio
@@ -0,0 +1,53 @@
+import hashlib
+import sqlite3
+
+import pytest
+
+from transcript_cache_code import TranscriptCache, hash_file, options_digest
+
+@pytest.fixture
+def cache(tmp_path):
+    return TranscriptCache(str(tmp_path / "cache" / "transcripts.sqlite3"))
+
+def test_hash_file_matches_hashlib(tmp_path):
+    audio_path = tmp_path / "audio.mp3"
+    audio_bytes = bytes(range(256)) * 5000
+    audio_path.write_bytes(audio_bytes)
+    assert hash_file(audio_path, chunk_size=1000) == hashlib.sha256(audio_bytes).hexdigest()
+
+def test_transcript_round_trip(cache):
+    assert cache.get("abc", "openai/whisper-medium", "float16") is None
+    cache.put("abc", "openai/whisper-medium", "float16", "hello there")
+    assert cache.get("abc", "openai/whisper-medium", "float16") == "hello there"
+
+def test_model_and_compute_type_are_part_of_the_key(cache):
+    cache.put("abc", "openai/whisper-medium", "float16", "medium transcript")
+    assert cache.get("abc", "openai/whisper-tiny", "float16") is None
+    assert cache.get("abc", "openai/whisper-medium", "float32") is None
+
+def test_options_are_part_of_the_key(cache):
+    vad_off = options_digest({'use_vad': False})
+    vad_on = options_digest({'use_vad': True, 'threshold_db': 10.0, 'min_silence_ms': 500, 'pad_ms': 200})
+    cache.put("abc", "openai/whisper-medium", "float16", "without vad", vad_off)
+    assert cache.get("abc", "openai/whisper-medium", "float16", vad_on) is None
+    assert cache.get("abc", "openai/whisper-medium", "float16", vad_off) == "without vad"
+    assert options_digest({'pad_ms': 200, 'use_vad': True}) == options_digest({'use_vad': True, 'pad_ms': 200})
+
+def test_transcripts_cached_without_options_are_dropped(tmp_path):
+    db_path = tmp_path / "transcripts.sqlite3"
+    connection = sqlite3.connect(db_path)
+    connection.execute("CREATE TABLE transcripts (audio_sha256 TEXT NOT NULL, model_name TEXT NOT NULL, compute_type TEXT NOT NULL,"
+                       " transcript TEXT NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (audio_sha256, model_name, compute_type))")
+    connection.execute("INSERT INTO transcripts VALUES ('abc', 'openai/whisper-medium', 'float16', 'old', 0)")
+    connection.commit()
+    connection.close()
+
+    cache = TranscriptCache(str(db_path))
+    assert cache.get("abc", "openai/whisper-medium", "float16") is None
+    cache.put("abc", "openai/whisper-medium", "float16", "new")
+    assert cache.get("abc", "openai/whisper-medium", "float16") == "new"
+
+@pytest.mark.asyncio
+async def test_async_lookup_and_store(cache):
+    await cache.store("def", "openai/whisper-tiny", "float32", "stored")
+    assert await cache.lookup("def", "openai/whisper-tiny", "float32") == "stored"
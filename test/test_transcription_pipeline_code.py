@@ -0,0 +1,147 @@
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from job_ledger_code import JobTransition
+from pydantic_models import GDriveInput
+from transcription_pipeline_code import TranscriptionJob, TranscriptionPipeline
+from workflow_states_code import WorkflowEnum
+from workflow_tracker_code import WorkflowTracker, WorkflowTrackerModel
+
+MP3_GDRIVE_IDS = [f"mp3_gdrive_id_{n:03d}_abcdefghijklmn" for n in range(5)]
+FAILING_GDRIVE_ID = MP3_GDRIVE_IDS[2]
+
+@pytest.fixture
+def pipeline(mocker):
+    mocker.patch('transcription_pipeline_code.get_settings', return_value=MagicMock(
+        download_concurrency=2, inference_concurrency=1, upload_concurrency=2,
+        pipeline_queue_maxsize=2, batch_max_files=3, streaming_decode=False))
+    transcriber = MagicMock()
+    async def prepare_mp3():
+        gdrive_id = WorkflowTracker.get('input_mp3').gdrive_id
+        if gdrive_id == FAILING_GDRIVE_ID:
+            raise RuntimeError("download failed")
+        return Path(f"{gdrive_id}.mp3")
+    transcriber.prepare_mp3 = AsyncMock(side_effect=prepare_mp3)
+    transcriber.resolve_model_and_compute_type.return_value = ("openai/whisper-tiny", "float32")
+    transcriber.resolve_assistant_model.return_value = None
+    transcriber.gh.log_status = AsyncMock()
+    transcriber.gh.flush_status = AsyncMock()
+    transcriber.lookup_cached_transcript = AsyncMock(return_value=None)
+    transcriber.cache_transcript = AsyncMock()
+    transcriber.resume_transcript = AsyncMock(return_value=None)
+    uploads = {}
+    async def upload_transcript(transcription_text):
+        uploads[WorkflowTracker.get('input_mp3').gdrive_id] = transcription_text
+    transcriber.upload_transcript = AsyncMock(side_effect=upload_transcript)
+    async def transcribe_streaming():
+        return f"streamed text of {WorkflowTracker.get('input_mp3').gdrive_id}"
+    transcriber.transcribe_streaming = AsyncMock(side_effect=transcribe_streaming)
+    mocker.patch('transcription_pipeline_code.AudioTranscriber', return_value=transcriber)
+
+    batch_transcriber = MagicMock()
+    async def transcribe_requests(requests):
+        return [f"text of {filename}" for filename, _, _, _ in requests]
+    batch_transcriber.transcribe_requests = AsyncMock(side_effect=transcribe_requests)
+    mocker.patch('transcription_pipeline_code.BatchTranscriber', return_value=batch_transcriber)
+
+    pipeline = TranscriptionPipeline()
+    pipeline.uploads = uploads
+    return pipeline
+
+@pytest.mark.asyncio
+async def test_every_job_is_uploaded_with_its_own_transcript(pipeline):
+    await pipeline.run(MP3_GDRIVE_IDS)
+
+    expected = {gdrive_id: f"text of {gdrive_id}.mp3" for gdrive_id in MP3_GDRIVE_IDS if gdrive_id != FAILING_GDRIVE_ID}
+    assert pipeline.uploads == expected
+    # No more files are batched together than batch_max_files.
+    for call in pipeline.batch_transcriber.transcribe_requests.await_args_list:
+        assert len(call.args[0]) <= 3
+
+@pytest.mark.asyncio
+async def test_failed_job_is_marked_error(pipeline):
+    pipeline.start()
+    job = await pipeline.submit(FAILING_GDRIVE_ID)
+    await pipeline.join()
+    await pipeline.stop()
+
+    assert job.workflow_model.status == WorkflowEnum.ERROR.name
+    assert "download" in job.workflow_model.comment
+    pipeline.transcriber.upload_transcript.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_cached_transcript_skips_inference(pipeline):
+    pipeline.transcriber.lookup_cached_transcript.return_value = "cached text"
+    await pipeline.run(MP3_GDRIVE_IDS[:2])
+
+    assert pipeline.uploads == {gdrive_id: "cached text" for gdrive_id in MP3_GDRIVE_IDS[:2]}
+    pipeline.batch_transcriber.transcribe_requests.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_pending_statuses_are_flushed_on_stop(pipeline):
+    await pipeline.run(MP3_GDRIVE_IDS[:1])
+    pipeline.transcriber.gh.flush_status.assert_awaited()
+
+@pytest.mark.asyncio
+async def test_cache_write_error_does_not_fail_the_batch(pipeline):
+    async def cache_transcript(transcription_text):
+        if WorkflowTracker.get('input_mp3').gdrive_id == MP3_GDRIVE_IDS[1]:
+            raise RuntimeError("disk full")
+    pipeline.transcriber.cache_transcript.side_effect = cache_transcript
+    pipeline.start()
+    jobs = [await pipeline.submit(gdrive_id) for gdrive_id in MP3_GDRIVE_IDS[:3] if gdrive_id != FAILING_GDRIVE_ID]
+    await pipeline.join()
+    await pipeline.stop()
+
+    assert pipeline.uploads == {job.mp3_gdrive_id: f"text of {job.mp3_gdrive_id}.mp3" for job in jobs}
+    assert all(job.workflow_model.status != WorkflowEnum.ERROR.name for job in jobs)
+
+@pytest.mark.asyncio
+async def test_streaming_decode_transcribes_without_a_local_mp3(pipeline):
+    pipeline.streaming_decode = True
+    await pipeline.run(MP3_GDRIVE_IDS[:3])
+
+    assert pipeline.uploads == {gdrive_id: f"streamed text of {gdrive_id}" for gdrive_id in MP3_GDRIVE_IDS[:3]}
+    pipeline.transcriber.prepare_mp3.assert_not_awaited()
+    pipeline.batch_transcriber.transcribe_requests.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_job_transcribed_before_a_restart_goes_straight_to_upload(pipeline):
+    pipeline.transcriber.resume_transcript.side_effect = lambda transition: (
+        "text from before the restart" if transition.status == WorkflowEnum.TRANSCRIPTION_COMPLETE.name else None)
+    pipeline.start()
+    for gdrive_id, status in [(MP3_GDRIVE_IDS[0], WorkflowEnum.TRANSCRIPTION_COMPLETE), (MP3_GDRIVE_IDS[1], WorkflowEnum.TRANSCRIBING)]:
+        await pipeline.submit(gdrive_id, resume_from=JobTransition(mp3_gfile_id=gdrive_id, status=status.name))
+    await pipeline.join()
+    await pipeline.stop()
+
+    assert pipeline.uploads == {
+        MP3_GDRIVE_IDS[0]: "text from before the restart",
+        MP3_GDRIVE_IDS[1]: f"text of {MP3_GDRIVE_IDS[1]}.mp3",
+    }
+    pipeline.transcriber.prepare_mp3.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_bad_file_does_not_fail_the_files_batched_with_it(pipeline):
+    bad_filename = f"{MP3_GDRIVE_IDS[1]}.mp3"
+    async def transcribe_requests(requests):
+        if any(filename == bad_filename for filename, _, _, _ in requests):
+            raise RuntimeError("could not decode the audio")
+        return [f"text of {filename}" for filename, _, _, _ in requests]
+    pipeline.batch_transcriber.transcribe_requests.side_effect = transcribe_requests
+    # Downloaded jobs, all waiting when the inference worker starts, so they are transcribed in one batch.
+    jobs = []
+    for gdrive_id in MP3_GDRIVE_IDS[:2]:
+        job = TranscriptionJob(mp3_gdrive_id=gdrive_id, workflow_model=WorkflowTrackerModel(input_mp3=GDriveInput(gdrive_id=gdrive_id)),
+                               transcription_request=(f"{gdrive_id}.mp3", "openai/whisper-tiny", "float32", None))
+        pipeline.inference_queue.put_nowait(job)
+        jobs.append(job)
+    pipeline.start()
+    await pipeline.join()
+    await pipeline.stop()
+
+    assert pipeline.uploads == {MP3_GDRIVE_IDS[0]: f"text of {MP3_GDRIVE_IDS[0]}.mp3"}
+    assert jobs[1].workflow_model.status == WorkflowEnum.ERROR.name
+    assert len(pipeline.batch_transcriber.transcribe_requests.await_args_list[0].args[0]) == 2
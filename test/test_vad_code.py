@@ -0,0 +1,56 @@
+import numpy as np
+
+from vad_code import SAMPLING_RATE, SpeechMap, detect_speech_segments, transcribe_with_pipeline
+
+def tone(seconds, amplitude=0.3, frequency=220.0):
+    t = np.arange(int(seconds * SAMPLING_RATE)) / SAMPLING_RATE
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+def silence(seconds):
+    rng = np.random.default_rng(0)
+    return (0.0005 * rng.standard_normal(int(seconds * SAMPLING_RATE))).astype(np.float32)
+
+def test_speech_regions_are_found():
+    audio = np.concatenate([silence(2), tone(3), silence(4), tone(2), silence(1)])
+    segments = detect_speech_segments(audio, pad_ms=0)
+    seconds = [(start / SAMPLING_RATE, end / SAMPLING_RATE) for start, end in segments]
+    assert len(seconds) == 2
+    assert abs(seconds[0][0] - 2) < 0.05 and abs(seconds[0][1] - 5) < 0.05
+    assert abs(seconds[1][0] - 9) < 0.05 and abs(seconds[1][1] - 11) < 0.05
+
+def test_short_pauses_are_bridged():
+    audio = np.concatenate([silence(1), tone(1), silence(0.2), tone(1), silence(1)])
+    assert len(detect_speech_segments(audio, min_silence_ms=500)) == 1
+
+def test_silence_has_no_speech():
+    assert detect_speech_segments(silence(5)) == []
+
+def test_timestamps_are_remapped_to_the_original_timeline():
+    speech_map = SpeechMap([(2 * SAMPLING_RATE, 5 * SAMPLING_RATE), (9 * SAMPLING_RATE, 11 * SAMPLING_RATE)])
+    assert speech_map.speech_samples == 5 * SAMPLING_RATE
+    assert speech_map.to_original_time(1.0) == 3.0
+    # 3.5 s into the speech-only audio is 0.5 s into the second segment.
+    assert speech_map.to_original_time(3.5) == 9.5
+    chunks = speech_map.remap_chunks([{'text': 'hello', 'timestamp': (0.0, 3.5)}, {'text': 'end', 'timestamp': (4.0, None)}])
+    assert chunks[0]['timestamp'] == (2.0, 9.5)
+    assert chunks[1]['timestamp'] == (10.0, None)
+
+def test_silent_file_is_not_sent_to_the_pipeline(mocker):
+    audio_by_file = {'speech.mp3': np.concatenate([silence(1), tone(2), silence(1)]), 'silent.mp3': silence(3)}
+    mocker.patch('vad_code.load_audio', side_effect=lambda filename: audio_by_file[filename])
+    pipe = mocker.Mock(return_value=[{'text': 'hi', 'chunks': [{'text': 'hi', 'timestamp': (0.5, 1.0)}]}])
+
+    results = transcribe_with_pipeline(pipe, ['silent.mp3', 'speech.mp3'], batch_size=8, use_vad=True, pad_ms=0)
+
+    assert len(pipe.call_args.args[0]) == 1
+    assert results[0] == {'text': '', 'chunks': []}
+    assert results[1]['text'] == 'hi'
+    start, end = results[1]['chunks'][0]['timestamp']
+    # The speech starts on the 30 ms frame boundary closest to 1 s.
+    assert abs(start - 1.5) < 0.03 and abs(end - 2.0) < 0.03
+
+def test_speculative_pipeline_runs_one_input_at_a_time(mocker):
+    pipe = mocker.Mock(return_value=[{'text': 'a'}, {'text': 'b'}])
+    pipe.assistant_model = object()
+    transcribe_with_pipeline(pipe, ["a.mp3", "b.mp3"], batch_size=8)
+    assert pipe.call_args.kwargs['batch_size'] == 1
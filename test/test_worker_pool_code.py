@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+import worker_pool_code
+from env_settings_code import reload_settings
+from worker_pool_code import TranscriptionWorkerPool, cores_for_worker
+
+class StubModel:
+    def state_dict(self):
+        return {}
+
+class StubPipeline:
+    """Stands in for the Hugging Face pipeline in the worker processes."""
+    model = StubModel()
+
+    def __call__(self, audio_filenames, **kwargs):
+        return [{'text': f"text of {audio_filename}"} for audio_filename in audio_filenames]
+
+def stub_loader(model_name, compute_type, device, assistant_model_name=None):
+    return StubPipeline()
+
+def first_worker_fails_loader(model_name, compute_type, device, assistant_model_name=None):
+    if worker_pool_code._worker_index == 0: # pylint: disable=protected-access
+        raise RuntimeError("out of memory")
+    return StubPipeline()
+
+@pytest.fixture
+def worker_environment(environment):
+    # The spawned workers read the settings from the environment they inherit.
+    environment.setenv('AUDIO_QUALITY_DEFAULT', 'tiny')
+    environment.setenv('COMPUTE_TYPE_DEFAULT', 'float32')
+    reload_settings()
+    return environment
+
+def test_workers_get_separate_core_blocks():
+    assert cores_for_worker(0, 4, 16) == [0, 1, 2, 3]
+    assert cores_for_worker(1, 4, 16) == [4, 5, 6, 7]
+    assert cores_for_worker(3, 4, 16) == [12, 13, 14, 15]
+
+def test_core_blocks_wrap_around_when_oversubscribed():
+    assert cores_for_worker(2, 4, 8) == [0, 1, 2, 3]
+    assert cores_for_worker(0, 16, 8) == list(range(8))
+
+@pytest.mark.asyncio
+async def test_transcribe_files_runs_in_a_worker_process(worker_environment): # pylint: disable=unused-argument
+    pytest.importorskip("torch")
+    pool = TranscriptionWorkerPool(num_workers=2, threads_per_worker=1, pin_cores=False, model_loader=stub_loader)
+    assert pool.warm_models == [("openai/whisper-tiny", "float32", None)]
+    statuses = []
+    async def on_status(message):
+        statuses.append(message)
+    try:
+        audio_filenames = ["b.mp3", "a.mp3", "c.mp3"]
+        transcripts = await pool.transcribe_files(audio_filenames, "openai/whisper-tiny", "float32", on_status=on_status)
+    finally:
+        pool.shutdown()
+
+    assert transcripts == ["text of b.mp3", "text of a.mp3", "text of c.mp3"]
+    assert statuses[0].endswith("Getting the openai/whisper-tiny model.")
+    assert any("Transcribed 3 file(s)" in status for status in statuses)
+    assert all(status.startswith("[worker ") for status in statuses)
+
+@pytest.mark.asyncio
+async def test_failed_warm_up_stops_the_pool(worker_environment): # pylint: disable=unused-argument
+    pytest.importorskip("torch")
+    pool = TranscriptionWorkerPool(num_workers=2, threads_per_worker=1, pin_cores=False, model_loader=first_worker_fails_loader)
+    try:
+        # BrokenBarrierError, for the worker that was waiting, is also a RuntimeError.
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(pool.start(), timeout=60)
+        # Nothing is left of the failed pool, so the next start() begins again.
+        assert pool._executor is None # pylint: disable=protected-access
+        assert not pool._dispatcher.is_alive() # pylint: disable=protected-access
+    finally:
+        pool.shutdown()
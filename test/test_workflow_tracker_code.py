@@ -1,3 +1,7 @@
+import asyncio
+
+import pytest
+
 
 from workflow_tracker_code import WorkflowTracker
 from workflow_states_code import WorkflowEnum
@@ -21,3 +25,24 @@ def test_update_success():
     # Print the model for visual confirmation (optional)
     print(updated_model.model_dump())
     print(updated_model.status)
+
+@pytest.mark.asyncio
+async def test_concurrent_jobs_have_their_own_model():
+    async def run_job(gfile_id):
+        WorkflowTracker.start_job(mp3_gfile_id=gfile_id, status=WorkflowEnum.START.name)
+        # Let the other job run before reading back this job's state.
+        await asyncio.sleep(0)
+        WorkflowTracker.update(status=WorkflowEnum.TRANSCRIBING.name, comment=f"job {gfile_id}")
+        await asyncio.sleep(0)
+        return WorkflowTracker.get('mp3_gfile_id'), WorkflowTracker.get('comment')
+
+    results = await asyncio.gather(run_job("job-one"), run_job("job-two"))
+
+    assert results == [("job-one", "job job-one"), ("job-two", "job job-two")]
+
+def test_set_model_switches_the_tracked_job():
+    first = WorkflowTracker.start_job(comment="first")
+    second = WorkflowTracker.start_job(comment="second")
+    assert WorkflowTracker.get_model() is second
+    WorkflowTracker.set_model(first)
+    assert WorkflowTracker.get('comment') == "first"
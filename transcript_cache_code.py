@@ -0,0 +1,121 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-18
+# Summary: transcript_cache_code is a content-addressed cache of finished transcripts. The
+# same recording is often uploaded again under a different name. Transcripts are stored in a
+# local SQLite database keyed by the SHA-256 of the audio bytes plus the model name, compute
+# type and a digest of the other options that change the text (the VAD options). The cache is checked before any inference, and a hit goes straight to the transcript
+# upload.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+from logger_code import LoggerBase
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_file(file_path: Path, chunk_size: int = HASH_CHUNK_SIZE, algorithm: str = 'sha256') -> str:
+    """The hex digest (SHA-256 by default) of a file, read in chunks so large recordings are not loaded into memory."""
+    digest = hashlib.new(algorithm)
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def options_digest(options: dict) -> str:
+    """A short digest of the transcription options that change the text, such as the VAD options. Key order does not matter."""
+    return hashlib.sha256(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+class TranscriptCache:
+    """
+    Transcripts stored in SQLite, keyed by (audio SHA-256, model name, compute type, options digest).
+
+    Every operation opens its own connection so the cache can be used from any executor thread.
+
+    Attributes:
+        db_path (Path): The SQLite database file. It is created on first use.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.logger = LoggerBase.setup_logger('TranscriptCache')
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(transcripts)")]
+            if columns and 'options' not in columns:
+                # Made before the options were part of the key. There is no telling which options those
+                # transcripts were made with, so they are dropped.
+                self.logger.warning(f"Dropping the transcripts in {self.db_path}, which were cached without their options.")
+                connection.execute("DROP TABLE transcripts")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts ("
+                " audio_sha256 TEXT NOT NULL,"
+                " model_name TEXT NOT NULL,"
+                " compute_type TEXT NOT NULL,"
+                " options TEXT NOT NULL,"
+                " transcript TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " PRIMARY KEY (audio_sha256, model_name, compute_type, options))"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, audio_sha256: str, model_name: str, compute_type, options: str = '') -> Optional[str]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT transcript FROM transcripts WHERE audio_sha256 = ? AND model_name = ? AND compute_type = ? AND options = ?",
+                (audio_sha256, model_name, str(compute_type), options)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, audio_sha256: str, model_name: str, compute_type, transcript: str, options: str = '') -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO transcripts (audio_sha256, model_name, compute_type, options, transcript, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (audio_sha256, model_name, str(compute_type), options, transcript, time.time())
+            )
+
+    async def lookup(self, audio_sha256: str, model_name: str, compute_type, options: str = '') -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        transcript = await loop.run_in_executor(None, self.get, audio_sha256, model_name, compute_type, options)
+        self.logger.debug(f"Transcript cache {'hit' if transcript is not None else 'miss'} for {audio_sha256[:12]} with {model_name}.")
+        return transcript
+
+    async def store(self, audio_sha256: str, model_name: str, compute_type, transcript: str, options: str = '') -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.put, audio_sha256, model_name, compute_type, transcript, options)
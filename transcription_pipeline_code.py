@@ -0,0 +1,297 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-08
+# Summary: transcription_pipeline_code runs the download, transcription and upload of many
+# mp3 files as three concurrent stages connected by bounded asyncio queues. While one batch
+# of files is being transcribed, the next files are downloading and the finished transcripts
+# are uploading, so neither the CPU nor the network sits idle. Each stage has its own number
+# of workers. The bounded queues keep the downloader from running too far ahead of the model.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import asyncio
+import time
+from typing import Any, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from audio_transcriber_code import AudioTranscriber
+from batch_transcriber_code import BatchTranscriber
+from env_settings_code import get_settings
+from job_ledger_code import JobTransition
+from logger_code import LoggerBase
+from pydantic_models import GDriveInput
+from worker_pool_code import shutdown_worker_pool
+from workflow_states_code import WorkflowEnum
+from workflow_tracker_code import WorkflowTracker, WorkflowTrackerModel
+
+class TranscriptionJob(BaseModel):
+    """One mp3 file moving through the pipeline, with the WorkflowTrackerModel that tracks it."""
+    mp3_gdrive_id: str
+    workflow_model: WorkflowTrackerModel
+    # (local mp3 filename, Hugging Face model name, compute type, assistant model name), set by the download stage.
+    transcription_request: Optional[Tuple[str, str, Any, Optional[str]]] = None
+    transcription_text: Optional[str] = None
+    # The job's last ledger transition when it is queued again after a restart.
+    resume_from: Optional[JobTransition] = None
+
+class TranscriptionPipeline:
+    """
+    Downloads, transcribes and uploads mp3 files in three overlapping stages.
+
+    Jobs flow download_queue -> inference_queue -> upload_queue. Each stage is a set of worker tasks. A
+    worker handles one job at a time and sets the job's WorkflowTrackerModel in its own context before
+    working on it, so the AudioTranscriber stage methods and log_status track the right file. The
+    inference workers take every job already waiting (up to batch_max_files) and transcribe them together
+    with the BatchTranscriber.
+
+    With streaming_decode set, the download and inference stages are one: each job's download stream is
+    decoded and transcribed as it arrives (AudioTranscriber.transcribe_streaming), so no mp3 is written to
+    local_mp3_dir and inference starts with the first chunk. Those jobs are not batched with other files
+    and skip the transcript cache. inference_concurrency files stream at the same time.
+
+    A job queued again after a restart (resume_from) whose transcript was finished and cached goes from the
+    download queue straight to the upload queue.
+
+    A job that fails in any stage is marked ERROR and dropped. The other jobs keep going. When a batch fails,
+    its files are transcribed again one at a time, so one bad file does not fail the files batched with it.
+
+    Attributes:
+        download_concurrency (int): Number of files downloading at the same time.
+        inference_concurrency (int): Number of batches being transcribed at the same time.
+        upload_concurrency (int): Number of transcripts uploading at the same time.
+        queue_maxsize (int): Maximum number of jobs waiting between two stages.
+    """
+    def __init__(self, download_concurrency: Optional[int] = None, inference_concurrency: Optional[int] = None,
+                 upload_concurrency: Optional[int] = None, queue_maxsize: Optional[int] = None):
+        self.settings = get_settings()
+        self.logger = LoggerBase.setup_logger('TranscriptionPipeline')
+        self.download_concurrency = download_concurrency if download_concurrency else self.settings.download_concurrency
+        self.inference_concurrency = inference_concurrency if inference_concurrency else self.settings.inference_concurrency
+        self.upload_concurrency = upload_concurrency if upload_concurrency else self.settings.upload_concurrency
+        self.queue_maxsize = queue_maxsize if queue_maxsize else self.settings.pipeline_queue_maxsize
+        self.batch_max_files = self.settings.batch_max_files
+        self.streaming_decode = self.settings.streaming_decode
+        self.transcriber = AudioTranscriber()
+        self.batch_transcriber = BatchTranscriber()
+        self.download_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_maxsize)
+        self.inference_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_maxsize)
+        self.upload_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_maxsize)
+        self._workers: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Starts the worker tasks of every stage."""
+        if self.streaming_decode:
+            stages = [
+                (self._streaming_worker, self.inference_concurrency),
+                (self._upload_worker, self.upload_concurrency),
+            ]
+        else:
+            stages = [
+                (self._download_worker, self.download_concurrency),
+                (self._inference_worker, self.inference_concurrency),
+                (self._upload_worker, self.upload_concurrency),
+            ]
+        for worker, concurrency in stages:
+            for _ in range(concurrency):
+                self._workers.append(asyncio.create_task(worker()))
+
+    async def submit(self, mp3_gdrive_id: str, transcript_audio_quality: str = "medium", transcript_compute_type: str = "float16",
+                     resume_from: Optional[JobTransition] = None) -> TranscriptionJob:
+        """
+        Queues an mp3 gfile for transcription. Waits while the download queue is full. Returns the queued job.
+        resume_from is the job's last ledger transition when an unfinished job is queued again after a restart.
+        """
+        workflow_model = WorkflowTrackerModel(
+            transcript_audio_quality=transcript_audio_quality,
+            transcript_compute_type=transcript_compute_type,
+            input_mp3=GDriveInput(gdrive_id=mp3_gdrive_id)
+        )
+        job = TranscriptionJob(mp3_gdrive_id=mp3_gdrive_id, workflow_model=workflow_model, resume_from=resume_from)
+        await self.download_queue.put(job)
+        return job
+
+    async def join(self) -> None:
+        """Waits until every submitted job has left the pipeline."""
+        await self.download_queue.join()
+        await self.inference_queue.join()
+        await self.upload_queue.join()
+
+    async def stop(self) -> None:
+        """Cancels the worker tasks, writes the statuses still waiting to be written and stops the worker processes."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self.transcriber.gh.flush_status()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, shutdown_worker_pool)
+
+    async def run(self, mp3_gdrive_ids: List[str]) -> None:
+        """Transcribes the mp3 gfiles and returns when all of them are done (or failed)."""
+        self.start()
+        try:
+            for mp3_gdrive_id in mp3_gdrive_ids:
+                await self.submit(mp3_gdrive_id)
+            await self.join()
+        finally:
+            await self.stop()
+
+    async def _download_worker(self) -> None:
+        while True:
+            job = await self.download_queue.get()
+            start_time = time.perf_counter()
+            try:
+                WorkflowTracker.set_model(job.workflow_model)
+                if await self._resume_upload(job, 'download', start_time):
+                    continue
+                local_mp3_path = await self.transcriber.prepare_mp3()
+                hf_model_name, compute_type = self.transcriber.resolve_model_and_compute_type()
+                job.transcription_request = (str(local_mp3_path), hf_model_name, compute_type, self.transcriber.resolve_assistant_model())
+                cached_text = await self.transcriber.lookup_cached_transcript()
+                self._log_stage_done(job, 'download', start_time)
+                if cached_text is not None:
+                    # Transcribed before: skip the inference stage.
+                    job.transcription_text = cached_text
+                    await self.upload_queue.put(job)
+                else:
+                    await self.inference_queue.put(job)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                await self._fail(job, 'download', e)
+            finally:
+                self.download_queue.task_done()
+
+    async def _inference_worker(self) -> None:
+        while True:
+            jobs = [await self.inference_queue.get()]
+            # Take whatever else is already downloaded so the chunks of those files share batches.
+            while len(jobs) < self.batch_max_files and not self.inference_queue.empty():
+                jobs.append(self.inference_queue.get_nowait())
+            start_time = time.perf_counter()
+            try:
+                for job in jobs:
+                    WorkflowTracker.set_model(job.workflow_model)
+                    WorkflowTracker.update(
+                    status=WorkflowEnum.TRANSCRIBING.name,
+                    comment= f'Transcribing with {job.transcription_request[1]} in a batch of {len(jobs)} files.',
+                    )
+                    await self.transcriber.gh.log_status()
+                transcripts = await self.batch_transcriber.transcribe_requests([job.transcription_request for job in jobs])
+            except Exception as e: # pylint: disable=broad-exception-caught
+                if len(jobs) == 1:
+                    await self._fail(jobs[0], 'transcription', e)
+                else:
+                    self.logger.warning(f"A batch of {len(jobs)} files failed ({e}). Transcribing its files one at a time.")
+                    await self._transcribe_one_at_a_time(jobs, start_time)
+            else:
+                # Each job is handed off on its own, so a job that fails here does not fail the jobs
+                # already on the upload queue.
+                for job, transcription_text in zip(jobs, transcripts):
+                    await self._hand_off_transcript(job, transcription_text, start_time)
+            finally:
+                for _ in jobs:
+                    self.inference_queue.task_done()
+
+    async def _transcribe_one_at_a_time(self, jobs: List[TranscriptionJob], start_time: float) -> None:
+        # After a batch failed, so only the file that breaks the transcription ends in ERROR.
+        for job in jobs:
+            try:
+                transcripts = await self.batch_transcriber.transcribe_requests([job.transcription_request])
+            except Exception as e: # pylint: disable=broad-exception-caught
+                await self._fail(job, 'transcription', e)
+            else:
+                await self._hand_off_transcript(job, transcripts[0], start_time)
+
+    async def _hand_off_transcript(self, job: TranscriptionJob, transcription_text: str, start_time: float) -> None:
+        try:
+            job.transcription_text = transcription_text
+            WorkflowTracker.set_model(job.workflow_model)
+            try:
+                await self.transcriber.cache_transcript(transcription_text)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                # The transcript is fine. Only the next transcription of the same audio misses the cache.
+                self.logger.warning(f"Could not cache the transcript of mp3 gfile {job.mp3_gdrive_id}: {e}")
+            self._log_stage_done(job, 'transcription', start_time)
+            await self.upload_queue.put(job)
+        except Exception as e: # pylint: disable=broad-exception-caught
+            await self._fail(job, 'transcription', e)
+
+    async def _streaming_worker(self) -> None:
+        # Takes jobs straight from the download queue. The download happens while the job transcribes.
+        while True:
+            job = await self.download_queue.get()
+            start_time = time.perf_counter()
+            try:
+                WorkflowTracker.set_model(job.workflow_model)
+                if await self._resume_upload(job, 'streaming transcription', start_time):
+                    continue
+                job.transcription_text = await self.transcriber.transcribe_streaming()
+                self._log_stage_done(job, 'streaming transcription', start_time)
+                await self.upload_queue.put(job)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                await self._fail(job, 'streaming transcription', e)
+            finally:
+                self.download_queue.task_done()
+
+    async def _resume_upload(self, job: TranscriptionJob, stage: str, start_time: float) -> bool:
+        # A job that was transcribed before the restart only needs its upload. Call in the job's context.
+        if job.resume_from is None:
+            return False
+        transcription_text = await self.transcriber.resume_transcript(job.resume_from)
+        if transcription_text is None:
+            return False
+        job.transcription_text = transcription_text
+        self._log_stage_done(job, stage, start_time)
+        await self.upload_queue.put(job)
+        return True
+
+    async def _upload_worker(self) -> None:
+        while True:
+            job = await self.upload_queue.get()
+            start_time = time.perf_counter()
+            try:
+                WorkflowTracker.set_model(job.workflow_model)
+                await self.transcriber.upload_transcript(job.transcription_text)
+                self._log_stage_done(job, 'upload', start_time)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                await self._fail(job, 'upload', e)
+            finally:
+                self.upload_queue.task_done()
+
+    def _log_stage_done(self, job: TranscriptionJob, stage: str, start_time: float) -> None:
+        duration_s = time.perf_counter() - start_time
+        self.logger.debug(f"The {stage} stage of mp3 gfile {job.mp3_gdrive_id} took {duration_s:.1f} seconds.",
+                          extra={'job_id': job.mp3_gdrive_id, 'stage': stage, 'duration_s': round(duration_s, 3)})
+
+    async def _fail(self, job: TranscriptionJob, stage: str, error: Exception) -> None:
+        self.logger.error(f"The {stage} stage failed for mp3 gfile {job.mp3_gdrive_id}: {error}")
+        WorkflowTracker.set_model(job.workflow_model)
+        WorkflowTracker.update(
+        status=WorkflowEnum.ERROR.name,
+        comment= f'The {stage} stage failed: {error}',
+        )
+        try:
+            await self.transcriber.gh.log_status()
+        except Exception as e: # pylint: disable=broad-exception-caught
+            self.logger.error(f"Could not store the ERROR status for mp3 gfile {job.mp3_gdrive_id}: {e}")
@@ -0,0 +1,197 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-12
+# Summary: vad_code is an energy-based voice activity detection (VAD) pre-pass. Lectures and
+# meetings are often 30-50% silence or music. Every 30 second chunk, including the silent
+# ones, would otherwise go through the full Whisper encoder and decoder. The VAD finds the
+# speech regions, only those regions are sent to the ASR pipeline, and the chunk timestamps
+# the pipeline returns are mapped back to the original recording's timeline.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import bisect
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Whisper models expect 16 kHz mono audio.
+SAMPLING_RATE = 16_000
+
+Segment = Tuple[int, int]
+
+def load_audio(audio_filename: str, sampling_rate: int = SAMPLING_RATE) -> np.ndarray:
+    """Decodes an audio file to a mono float32 array with ffmpeg, the same way the ASR pipeline does."""
+    from transformers.pipelines.audio_utils import ffmpeg_read # pylint: disable=import-outside-toplevel
+    with open(audio_filename, 'rb') as audio_file:
+        return ffmpeg_read(audio_file.read(), sampling_rate)
+
+def frame_energies_db(audio: np.ndarray, frame_length: int) -> np.ndarray:
+    """The RMS energy of each frame in dBFS. A trailing partial frame is dropped."""
+    num_frames = len(audio) // frame_length
+    if num_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = audio[:num_frames * frame_length].reshape(num_frames, frame_length).astype(np.float32)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+def detect_speech_segments(audio: np.ndarray, sampling_rate: int = SAMPLING_RATE, frame_ms: int = 30,
+                           threshold_db: float = 10.0, floor_db: float = -50.0, min_speech_ms: int = 250,
+                           min_silence_ms: int = 500, pad_ms: int = 200) -> List[Segment]:
+    """
+    Finds the regions of the audio that contain speech.
+
+    A frame is speech when its energy is `threshold_db` above the noise floor (the 10th percentile
+    of the frame energies) and above `floor_db`. Pauses shorter than `min_silence_ms` are bridged,
+    speech shorter than `min_speech_ms` is dropped, and every region is padded by `pad_ms` so word
+    onsets and endings are not clipped.
+
+    Returns:
+        List[Segment]: (start_sample, end_sample) of each speech region, sorted and not overlapping.
+    """
+    frame_length = int(sampling_rate * frame_ms / 1000)
+    energies = frame_energies_db(audio, frame_length)
+    if len(energies) == 0:
+        return []
+    noise_floor_db = np.percentile(energies, 10)
+    is_speech = energies > max(noise_floor_db + threshold_db, floor_db)
+
+    # Runs of speech frames as [start_frame, end_frame).
+    edges = np.diff(np.concatenate(([0], is_speech.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    min_silence_frames = max(1, min_silence_ms // frame_ms)
+    min_speech_frames = max(1, min_speech_ms // frame_ms)
+    merged: List[List[int]] = []
+    for start, end in zip(starts, ends):
+        if merged and start - merged[-1][1] < min_silence_frames:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    pad = int(sampling_rate * pad_ms / 1000)
+    segments: List[Segment] = []
+    for start, end in merged:
+        if end - start < min_speech_frames:
+            continue
+        start_sample = max(0, start * frame_length - pad)
+        end_sample = min(len(audio), end * frame_length + pad)
+        if segments and start_sample <= segments[-1][1]:
+            segments[-1] = (segments[-1][0], end_sample)
+        else:
+            segments.append((start_sample, end_sample))
+    return segments
+
+class SpeechMap:
+    """
+    Maps between the original audio and the audio with only the speech segments kept.
+
+    Attributes:
+        segments (List[Segment]): (start_sample, end_sample) of each speech segment in the original audio.
+        sampling_rate (int): Samples per second.
+    """
+    def __init__(self, segments: List[Segment], sampling_rate: int = SAMPLING_RATE):
+        self.segments = segments
+        self.sampling_rate = sampling_rate
+        # Where each segment starts in the speech-only audio.
+        self._speech_starts = []
+        offset = 0
+        for start, end in segments:
+            self._speech_starts.append(offset)
+            offset += end - start
+        self.speech_samples = offset
+
+    @classmethod
+    def from_audio(cls, audio: np.ndarray, sampling_rate: int = SAMPLING_RATE, **detector_options) -> "SpeechMap":
+        return cls(detect_speech_segments(audio, sampling_rate, **detector_options), sampling_rate)
+
+    def speech_only(self, audio: np.ndarray) -> np.ndarray:
+        """The speech segments of `audio`, back to back."""
+        if not self.segments:
+            return np.zeros(0, dtype=audio.dtype)
+        return np.concatenate([audio[start:end] for start, end in self.segments])
+
+    def to_original_time(self, speech_seconds: Optional[float]) -> Optional[float]:
+        """Maps a time in the speech-only audio to the same moment in the original audio."""
+        if speech_seconds is None or not self.segments:
+            return speech_seconds
+        speech_sample = int(round(speech_seconds * self.sampling_rate))
+        index = max(0, bisect.bisect_right(self._speech_starts, speech_sample) - 1)
+        original_sample = self.segments[index][0] + (speech_sample - self._speech_starts[index])
+        return float(original_sample / self.sampling_rate)
+
+    def remap_chunks(self, chunks: List[dict]) -> List[dict]:
+        """Returns the pipeline's timestamped chunks with the timestamps on the original timeline."""
+        remapped = []
+        for chunk in chunks:
+            start, end = chunk['timestamp']
+            remapped.append({**chunk, 'timestamp': (self.to_original_time(start), self.to_original_time(end))})
+        return remapped
+
+def vad_options(settings) -> dict:
+    """The VAD keyword arguments for transcribe_with_pipeline, taken from the settings."""
+    return {
+        'use_vad': settings.vad_enabled,
+        'threshold_db': settings.vad_threshold_db,
+        'min_silence_ms': settings.vad_min_silence_ms,
+        'pad_ms': settings.vad_pad_ms,
+    }
+
+def pipeline_batch_size(pipe, batch_size: int) -> int:
+    """The batch size to run the pipeline with. Speculative decoding pipelines (with an assistant model) only support 1."""
+    return 1 if getattr(pipe, 'assistant_model', None) is not None else batch_size
+
+def transcribe_with_pipeline(pipe, audio_filenames: List[str], batch_size: int, use_vad: bool = False, **detector_options) -> List[dict]:
+    """
+    Runs the ASR pipeline over the audio files, optionally with the VAD pre-pass.
+
+    Without the VAD, the pipeline reads and chunks the files itself. With the VAD, each file is decoded,
+    the silence is cut out, and only the speech is sent to the pipeline. The chunk timestamps are then
+    remapped to the original recording. In both cases the chunks of all the files share batches.
+
+    Returns:
+        List[dict]: One result per file, in order, with 'text' and, when the VAD ran, timestamped 'chunks'.
+    """
+    batch_size = pipeline_batch_size(pipe, batch_size)
+    if not use_vad:
+        return pipe(list(audio_filenames), chunk_length_s=30, batch_size=batch_size, return_timestamps=False)
+
+    speech_maps, speech_inputs = [], []
+    for audio_filename in audio_filenames:
+        audio = load_audio(audio_filename)
+        speech_map = SpeechMap.from_audio(audio, **detector_options)
+        speech_maps.append(speech_map)
+        if speech_map.speech_samples:
+            speech_inputs.append({"raw": speech_map.speech_only(audio), "sampling_rate": SAMPLING_RATE})
+
+    outputs = iter(pipe(speech_inputs, chunk_length_s=30, batch_size=batch_size, return_timestamps=True) if speech_inputs else [])
+    results = []
+    for speech_map in speech_maps:
+        if not speech_map.speech_samples:
+            # Nothing but silence. There is nothing to send to the model.
+            results.append({'text': '', 'chunks': []})
+            continue
+        output = next(outputs)
+        results.append({'text': output['text'], 'chunks': speech_map.remap_chunks(output.get('chunks', []))})
+    return results
@@ -0,0 +1,266 @@
+###########################################################################################
+# Author: HappyDay Johnson
+# Version: 0.01
+# Date: 2024-04-10
+# Summary: worker_pool_code runs Whisper inference in a pool of persistent worker processes.
+# `run_in_executor(None, ...)` runs the model in a thread of the main process, so one
+# GIL-bound process drives torch. The pool starts N processes instead. Each process keeps
+# its own warm model cache, uses a configurable number of torch intra-op threads, and can be
+# pinned to its own block of CPU cores. Jobs are sent to the workers over IPC. Status
+# messages are streamed back while a job runs, and the transcripts are returned at the end.
+#
+# License Information: MIT License
+#
+# Copyright (c) 2024 HappyDay Johnson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###########################################################################################
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from env_settings_code import get_settings
+from logger_code import LoggerBase
+from model_cache_code import default_device, get_model_cache, resolve_compute_type
+from vad_code import transcribe_with_pipeline, vad_options
+from workflow_tracker_code import ASSISTANT_MODEL_MAP, AUDIO_QUALITY_MAP, COMPUTE_TYPE_MAP
+
+StatusCallback = Callable[[str], Awaitable[None]]
+# (model name, compute type, assistant model name or None)
+WarmModel = Tuple[str, str, Optional[str]]
+
+# Most seconds a worker that has loaded its warm models waits for the others. Past it the pool does not start.
+WARM_UP_TIMEOUT_S = 900
+
+# Set in each worker process by _init_worker.
+_worker_status_queue = None
+_worker_index = None
+_worker_warm_up_barrier = None
+
+def cores_for_worker(worker_index: int, threads_per_worker: int, cpu_count: int) -> List[int]:
+    """The block of cores worker `worker_index` is pinned to. Wraps around when there are more threads than cores."""
+    first_core = worker_index * threads_per_worker
+    return sorted({(first_core + offset) % cpu_count for offset in range(threads_per_worker)})
+
+def _init_worker(status_queue, worker_counter, warm_up_barrier, threads_per_worker: int, pin_cores: bool,
+                 model_loader: Optional[Callable] = None) -> None:
+    global _worker_status_queue, _worker_index, _worker_warm_up_barrier # pylint: disable=global-statement
+    _worker_status_queue = status_queue
+    _worker_warm_up_barrier = warm_up_barrier
+    with worker_counter.get_lock():
+        _worker_index = worker_counter.value
+        worker_counter.value += 1
+    if pin_cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores_for_worker(_worker_index, threads_per_worker, os.cpu_count()))
+    # Imported here, in the worker process, so starting the pool does not import torch in the main process.
+    import torch # pylint: disable=import-outside-toplevel
+    torch.set_num_threads(threads_per_worker)
+    if model_loader:
+        get_model_cache().loader = model_loader
+
+def _send_status(job_id: str, message: str) -> None:
+    _worker_status_queue.put((job_id, f"[worker {_worker_index}] {message}"))
+
+def _warm_up(warm_models: List[WarmModel]) -> int:
+    try:
+        device = default_device()
+        for model_name, compute_float_type, assistant_model_name in warm_models:
+            # Under the same key the jobs use: the compute type resolved for the device.
+            get_model_cache().get_pipeline(model_name, resolve_compute_type(compute_float_type, device), device, assistant_model_name)
+    except BaseException:
+        # Release the workers already waiting. They get a BrokenBarrierError.
+        _worker_warm_up_barrier.abort()
+        raise
+    # Hold this worker until every worker has its warm-up job. A waiting worker cannot take a second
+    # warm-up job, so each worker gets exactly one.
+    _worker_warm_up_barrier.wait(timeout=WARM_UP_TIMEOUT_S)
+    return _worker_index
+
+def _run_transcription(job_id: str, audio_filenames: List[str], model_name: str, compute_float_type, batch_size: int,
+                       assistant_model_name: Optional[str] = None) -> List[str]:
+    _send_status(job_id, f"Getting the {model_name} model.")
+    pipe = get_model_cache().get_pipeline(model_name, compute_float_type, assistant_model_name=assistant_model_name)
+    _send_status(job_id, f"Transcribing {len(audio_filenames)} file(s).")
+    start_time = time.perf_counter()
+    results = transcribe_with_pipeline(pipe, audio_filenames, batch_size, **vad_options(get_settings()))
+    _send_status(job_id, f"Transcribed {len(audio_filenames)} file(s) in {time.perf_counter() - start_time:.1f} seconds.")
+    return [result['text'] for result in results]
+
+class TranscriptionWorkerPool:
+    """
+    A pool of persistent processes that each hold a warm ASR model.
+
+    Attributes:
+        num_workers (int): The number of worker processes.
+        threads_per_worker (int): torch intra-op threads in each worker. num_workers x threads_per_worker
+            should match the number of cores.
+        pin_cores (bool): Pin each worker to its own block of threads_per_worker cores (Linux only).
+        warm_models (List[WarmModel]): (model name, compute type, assistant model name) of the models loaded in every worker when the pool starts.
+            Defaults to the model and compute type of audio_quality_default and compute_type_default.
+        model_loader (Callable, optional): Replaces the ModelCache loader in the workers. Must be picklable. For tests.
+    """
+    def __init__(self, num_workers: Optional[int] = None, threads_per_worker: Optional[int] = None,
+                 pin_cores: Optional[bool] = None, warm_models: Optional[List[WarmModel]] = None,
+                 model_loader: Optional[Callable] = None):
+        settings = get_settings()
+        self.num_workers = num_workers if num_workers else settings.transcription_workers
+        self.threads_per_worker = threads_per_worker if threads_per_worker else settings.threads_per_worker
+        self.pin_cores = settings.pin_worker_cores if pin_cores is None else pin_cores
+        self.warm_models = warm_models if warm_models is not None else default_warm_models(settings)
+        self.model_loader = model_loader
+        self.batch_size = settings.transcription_batch_size
+        self.logger = LoggerBase.setup_logger('TranscriptionWorkerPool')
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._status_queue = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._listeners: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = {}
+        self._listeners_lock = threading.Lock()
+
+    async def start(self) -> None:
+        """Starts the worker processes and waits until each one has loaded the warm models."""
+        if self._executor:
+            return
+        # Spawn rather than fork: forking a process that already has torch threads running is unsafe.
+        context = multiprocessing.get_context('spawn')
+        self._status_queue = context.Queue()
+        worker_counter = context.Value('i', 0)
+        warm_up_barrier = context.Barrier(self.num_workers)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._status_queue, worker_counter, warm_up_barrier, self.threads_per_worker, self.pin_cores, self.model_loader)
+        )
+        self._dispatcher = threading.Thread(target=self._dispatch_status, name='worker-status-dispatcher', daemon=True)
+        self._dispatcher.start()
+        # One warm-up job per worker. The executor starts a new process for each job it cannot give
+        # to an idle worker, so this brings up all the workers. The barrier in _warm_up keeps a worker
+        # that finished its warm-up from taking another worker's.
+        warm_ups = [asyncio.wrap_future(self._executor.submit(_warm_up, self.warm_models)) for _ in range(self.num_workers)]
+        try:
+            worker_indices = await asyncio.gather(*warm_ups)
+        except BaseException:
+            # Leave no half-started pool behind: the next start() begins again from scratch.
+            self.logger.error("A transcription worker failed to warm up. Stopping the pool.")
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.shutdown, True)
+            raise
+        self.logger.debug(f"Started {len(set(worker_indices))} transcription workers with {self.threads_per_worker} threads each.")
+
+    def shutdown(self, cancel_futures: bool = False) -> None:
+        """
+        Stops the worker processes and the status dispatcher. Blocks until the running jobs finish. With
+        cancel_futures, the jobs that have not started yet are cancelled instead of run.
+        """
+        if not self._executor:
+            return
+        self._executor.shutdown(wait=True, cancel_futures=cancel_futures)
+        self._status_queue.put(None)
+        self._dispatcher.join()
+        self._executor = None
+
+    def _dispatch_status(self) -> None:
+        # Runs in a thread. Routes each (job_id, message) from the workers to the event loop awaiting that job.
+        while True:
+            item = self._status_queue.get()
+            if item is None:
+                return
+            job_id, message = item
+            with self._listeners_lock:
+                listener = self._listeners.get(job_id)
+            if listener:
+                loop, job_queue = listener
+                loop.call_soon_threadsafe(job_queue.put_nowait, message)
+
+    async def transcribe_files(self, audio_filenames: List[str], model_name: str, compute_float_type,
+                               on_status: Optional[StatusCallback] = None, assistant_model_name: Optional[str] = None) -> List[str]:
+        """
+        Transcribes the audio files in one of the worker processes.
+
+        Args:
+            audio_filenames (List[str]): Paths to the audio files. The chunks of all the files share batches.
+            model_name (str): Hugging Face model id, one of the values in AUDIO_QUALITY_MAP.
+            compute_float_type (str): One of the values in COMPUTE_TYPE_MAP.
+            on_status (StatusCallback, optional): Awaited with each status message the worker sends.
+                It runs in the caller's task, so it can update the caller's WorkflowTracker.
+            assistant_model_name (str, optional): The speculative decoding assistant, one of the values in ASSISTANT_MODEL_MAP.
+
+        Returns:
+            List[str]: The transcript of each file, in the same order as `audio_filenames`.
+        """
+        await self.start()
+        loop = asyncio.get_running_loop()
+        job_id = uuid.uuid4().hex
+        job_queue: asyncio.Queue = asyncio.Queue()
+        with self._listeners_lock:
+            self._listeners[job_id] = (loop, job_queue)
+        try:
+            result = asyncio.wrap_future(self._executor.submit(
+                _run_transcription, job_id, list(audio_filenames), model_name, compute_float_type, self.batch_size,
+                assistant_model_name))
+            while True:
+                next_status = asyncio.ensure_future(job_queue.get())
+                done, _ = await asyncio.wait({result, next_status}, return_when=asyncio.FIRST_COMPLETED)
+                if next_status in done:
+                    await self._report(next_status.result(), on_status)
+                else:
+                    next_status.cancel()
+                if result in done:
+                    break
+            while not job_queue.empty():
+                await self._report(job_queue.get_nowait(), on_status)
+            return result.result()
+        finally:
+            with self._listeners_lock:
+                del self._listeners[job_id]
+
+    async def _report(self, message: str, on_status: Optional[StatusCallback]) -> None:
+        self.logger.debug(message)
+        if on_status:
+            await on_status(message)
+
+def default_warm_models(settings) -> List[WarmModel]:
+    """The model of the settings' default audio quality and compute type, when both are known."""
+    model_name = AUDIO_QUALITY_MAP.get(settings.audio_quality_default)
+    compute_type = COMPUTE_TYPE_MAP.get(settings.compute_type_default)
+    assistant_model_name = ASSISTANT_MODEL_MAP.get(settings.audio_quality_default)
+    return [(model_name, compute_type, assistant_model_name)] if model_name and compute_type else []
+
+_worker_pool: Optional[TranscriptionWorkerPool] = None
+
+def get_worker_pool() -> Optional[TranscriptionWorkerPool]:
+    """Returns the process-wide worker pool, or None when `transcription_workers` is 0 (inference runs in-process)."""
+    global _worker_pool # pylint: disable=global-statement
+    if get_settings().transcription_workers <= 0:
+        return None
+    if _worker_pool is None:
+        _worker_pool = TranscriptionWorkerPool()
+    return _worker_pool
+
+def shutdown_worker_pool() -> None:
+    """Stops the process-wide worker pool, if one was started. The next get_worker_pool() builds a new one."""
+    global _worker_pool # pylint: disable=global-statement
+    if _worker_pool is not None:
+        _worker_pool.shutdown()
+        _worker_pool = None
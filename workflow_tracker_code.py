@@ -1,3 +1,4 @@
+from contextvars import ContextVar
 from enum import Enum
 
 from difflib import get_close_matches
@@ -7,11 +8,10 @@ from typing import Optional, Union
 from fastapi import UploadFile
 from fastapi.encoders import jsonable_encoder
 
-import torch
 
 from pydantic import BaseModel, field_validator, field_serializer, ValidationError
 
-from logger_code import LoggerBase
+from logger_code import LoggerBase, set_log_context_provider
 from pydantic_models import GDriveInput
 
 AUDIO_QUALITY_MAP = {
@@ -29,13 +29,25 @@ AUDIO_QUALITY_MAP = {
     "distil-large-v2": "distil-whisper/distil-large-v2",
     "distil-medium.en": "distil-whisper/distil-medium.en",
     "distil-small.en": "distil-whisper/distil-small.en",
+    # Speculative decoding: large-v2 with the assistant model in ASSISTANT_MODEL_MAP.
+    "speculative": "openai/whisper-large-v2",
 
 }
 
+# The assistant model of the audio qualities that use speculative decoding. distil-large-v2 drafts the tokens
+# and large-v2 verifies them: the same transcript as large-v2 at close to distil speed.
+ASSISTANT_MODEL_MAP = {
+    "speculative": "distil-whisper/distil-large-v2",
+}
+
+# Compute types stay strings until the inference stage turns them into torch dtypes (model_cache_code.torch_dtype_for),
+# so importing this module does not import torch.
 COMPUTE_TYPE_MAP = {
-    "default": torch.float16,
-    "float16": torch.float16,
-    "float32": torch.float32,
+    "default": "float16",
+    "float16": "float16",
+    "float32": "float32",
+    # Float32 weights with the Linear layers dynamically quantized to int8. CPU only.
+    "int8": "int8",
 }
 
 
@@ -113,11 +125,58 @@ class WorkflowTrackerModel(TranscriptionModel):
     transcript_compute_type: Optional[str] = None
     transcript_gdrive_id: str = None
     transcript_gdrive_filename: str = None
+    # The precision the model actually ran with after resolving transcript_compute_type for the device.
+    transcript_precision: Optional[str] = None
+    # SHA-256 of the mp3 bytes. Keys the transcript cache.
+    audio_sha256: Optional[str] = None
+    # Drive's md5Checksum of the mp3 gfile when it was downloaded. A resumed job checks it is still the content on Drive.
+    mp3_md5_checksum: Optional[str] = None
+
+# The workflow being tracked. Every asyncio task runs with its own copy of the context, so each
+# transcription job that calls WorkflowTracker.start_job() within its own task gets its own
+# WorkflowTrackerModel. Jobs running at the same time no longer overwrite each other's state.
+_workflow_model: ContextVar[WorkflowTrackerModel] = ContextVar('workflow_model')
+
+def _job_log_context() -> dict:
+    """The job_id (mp3 gfile id) and stage (workflow status) of the job in the current context, for the JSON log."""
+    workflow_model = _workflow_model.get(None)
+    if workflow_model is None:
+        return {}
+    return {'job_id': workflow_model.mp3_gfile_id, 'stage': workflow_model.status}
+
+set_log_context_provider(_job_log_context)
 
 class WorkflowTracker:
-    _model = WorkflowTrackerModel()
+    """
+    Tracks the state of the transcription job running in the current context.
+
+    All methods are class methods that resolve the current job's WorkflowTrackerModel through a
+    context variable, so callers (AudioTranscriber, GDriveHelper.log_status, update_status) do not
+    pass the job around. Note that `loop.run_in_executor` does not carry the context over to the
+    executor thread. Read what is needed from the tracker before handing work to an executor.
+    """
     _logger = LoggerBase.setup_logger('WorkflowTracker')
 
+    @classmethod
+    def _current_model(cls) -> WorkflowTrackerModel:
+        try:
+            return _workflow_model.get()
+        except LookupError:
+            model = WorkflowTrackerModel()
+            _workflow_model.set(model)
+            return model
+
+    @classmethod
+    def start_job(cls, **kwargs) -> WorkflowTrackerModel:
+        """
+        Starts tracking a new job in the current context. Call this at the start of the asyncio task
+        running the job. The fields in `kwargs` are set the same way `update` sets them.
+        """
+        model = WorkflowTrackerModel()
+        _workflow_model.set(model)
+        cls.update(**kwargs)
+        return model
+
     @classmethod
     def update(cls, **kwargs):
         for key, value in kwargs.items():
@@ -126,12 +185,12 @@ class WorkflowTracker:
                 actual_value = value.value[0]  # Adjust this as needed
             else:
                 actual_value = value
-            if hasattr(cls._model, key):
-                setattr(cls._model, key, actual_value)
+            if hasattr(cls._current_model(), key):
+                setattr(cls._current_model(), key, actual_value)
             else:
                 real_field_name = cls.get_similar_field_name(key)
                 if real_field_name:
-                    setattr(cls._model, real_field_name, actual_value)
+                    setattr(cls._current_model(), real_field_name, actual_value)
                     cls._logger.info(f"Updated similar field name: {real_field_name} for entered key: {key}")
                 else:
                     raise ValueError(f"{key} is not a property of WorkflowTrackerModel and no similar field found.")
@@ -139,7 +198,7 @@ class WorkflowTracker:
     @classmethod
     def update_from_transcription_model(cls, base_tracker_model_instance:BaseTrackerModel):
         """
-        Updates the _model with values from an instance of TranscriptionModel.
+        Updates the current job's model with values from an instance of TranscriptionModel.
         """
         try:
             # Create a new WorkflowTrackerModel instance from the TranscriptionModel instance
@@ -150,11 +209,11 @@ class WorkflowTracker:
             just_basetracker_attribs_instance = BaseTrackerModel(
                 **source_instance.model_dump()
             )
-            cls._logger.info(f"input_mp3 type before: {type(cls._model.input_mp3)}")
+            cls._logger.info(f"input_mp3 type before: {type(cls._current_model().input_mp3)}")
             for attr_name, _ in just_basetracker_attribs_instance:
-                if hasattr(cls._model, attr_name):
-                    setattr(cls._model, attr_name, getattr(just_basetracker_attribs_instance, attr_name))
-                    cls._logger.info(f"input_mp3 type after: {type(cls._model.input_mp3)}")
+                if hasattr(cls._current_model(), attr_name):
+                    setattr(cls._current_model(), attr_name, getattr(just_basetracker_attribs_instance, attr_name))
+                    cls._logger.info(f"input_mp3 type after: {type(cls._current_model().input_mp3)}")
 
 
             # Update the class's _model instance
@@ -165,13 +224,13 @@ class WorkflowTracker:
 
     @classmethod
     def get(cls, field_name):
-        if hasattr(cls._model, field_name):
-            return getattr(cls._model, field_name, None)
+        if hasattr(cls._current_model(), field_name):
+            return getattr(cls._current_model(), field_name, None)
         else:
             real_field_name = cls.get_similar_field_name(field_name)
             if real_field_name:
                 cls._logger.info(f"Entered field name: {field_name}. Returning similar WorkflowTrackerModel property: {real_field_name}")
-                return getattr(cls._model, real_field_name, None)
+                return getattr(cls._current_model(), real_field_name, None)
             else:
                 raise ValueError(f"{field_name} is not a property of WorkflowTrackerModel and no similar field found.")
 
@@ -198,12 +257,20 @@ class WorkflowTracker:
     @classmethod
     def __call__(cls, **kwargs):
         cls.update(**kwargs)
-        return cls._model
+        return cls._current_model()
 
     @classmethod
     def get_model(cls):
-        return cls._model
+        return cls._current_model()
+
+    @classmethod
+    def set_model(cls, model: WorkflowTrackerModel):
+        """
+        Makes `model` the workflow being tracked in the current context. A runner that interleaves the
+        stages of several files keeps one WorkflowTrackerModel per file and sets it before working on that file.
+        """
+        _workflow_model.set(model)
 
     @classmethod
     def get_model_dump(cls):
-        return cls._model.model_dump()
+        return cls._current_model().model_dump()